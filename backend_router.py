@@ -0,0 +1,300 @@
+"""
+Health-tracked routing between LLM backends
+Each backend gets a circuit breaker: repeated failures open the circuit and
+the router fails over to the next healthy backend, while a background prober
+closes the circuit again once the backend recovers.
+"""
+
+import json
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BackendHealth:
+    def __init__(self, name, probe=None):
+        self.name = name
+        self.probe = probe
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.latency_ewma = None
+        self.successes = 0
+        self.failures = 0
+        self.last_error = None
+
+    def to_dict(self):
+        return {
+            "backend": self.name,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "latency_ewma": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "last_error": self.last_error
+        }
+
+
+class BackendRouter:
+    # Consecutive failures before a backend's circuit opens
+    FAILURE_THRESHOLD = 3
+    # Seconds an open circuit waits before allowing a trial request
+    COOLDOWN_SECONDS = 30
+    # Seconds between background health probes of open circuits
+    PROBE_INTERVAL = 10
+    # Smoothing factor for the per-backend latency average
+    LATENCY_ALPHA = 0.3
+
+    def __init__(self, metrics=None, on_event=None):
+        self.metrics = metrics
+        self.on_event = on_event
+        self.backends = {}
+        self.priority = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._probe_thread = None
+
+    def register(self, name, probe=None, healthy=True):
+        """
+        Register a backend in priority order
+        probe is a zero-argument callable that raises (or returns False) when unhealthy
+        """
+        with self._lock:
+            health = BackendHealth(name, probe=probe)
+            if not healthy:
+                health.state = OPEN
+                health.opened_at = time.time()
+                health.consecutive_failures = self.FAILURE_THRESHOLD
+            self.backends[name] = health
+            if name not in self.priority:
+                self.priority.append(name)
+
+    def ordered_backends(self):
+        """Return backends that may be tried now, in priority order"""
+        now = time.time()
+        available = []
+        transitions = []
+        with self._lock:
+            for name in self.priority:
+                health = self.backends[name]
+                if health.state == OPEN and now - health.opened_at >= self.COOLDOWN_SECONDS:
+                    # Cooldown elapsed - let one trial request through
+                    health.state = HALF_OPEN
+                    transitions.append(name)
+                if health.state != OPEN:
+                    available.append(name)
+
+        for name in transitions:
+            self._emit("backend_circuit_half_open", backend=name)
+        return available
+
+    def is_available(self, name):
+        """True if the backend is registered and its circuit is not open"""
+        with self._lock:
+            health = self.backends.get(name)
+            return health is not None and health.state != OPEN
+
+    def has_alternative(self, name):
+        """True if another backend could take over from this one right now"""
+        with self._lock:
+            return any(other != name and health.state != OPEN
+                       for other, health in self.backends.items())
+
+    def record_success(self, name, latency):
+        with self._lock:
+            health = self.backends[name]
+            was_state = health.state
+            health.successes += 1
+            health.consecutive_failures = 0
+            health.state = CLOSED
+            health.opened_at = None
+            if health.latency_ewma is None:
+                health.latency_ewma = latency
+            else:
+                health.latency_ewma = (self.LATENCY_ALPHA * latency +
+                                       (1 - self.LATENCY_ALPHA) * health.latency_ewma)
+
+        if self.metrics:
+            self.metrics.observe(f"backend_latency.{name}", latency)
+            self.metrics.incr(f"backend_success.{name}")
+        if was_state != CLOSED:
+            self._emit("backend_circuit_closed", backend=name, latency=round(latency, 4))
+
+    def record_failure(self, name, error):
+        opened = False
+        with self._lock:
+            health = self.backends[name]
+            health.failures += 1
+            health.consecutive_failures += 1
+            health.last_error = str(error)[:200]
+            # A failed trial request re-opens immediately
+            if health.state == HALF_OPEN or (
+                    health.state == CLOSED and health.consecutive_failures >= self.FAILURE_THRESHOLD):
+                health.state = OPEN
+                health.opened_at = time.time()
+                opened = True
+
+        if self.metrics:
+            self.metrics.incr(f"backend_failure.{name}")
+        if opened:
+            if self.metrics:
+                self.metrics.incr("backend_circuit_opened")
+            self._emit("backend_circuit_open", backend=name, error=str(error)[:200])
+
+    def record_failover(self, from_backend, to_backend, error=None):
+        if self.metrics:
+            self.metrics.incr("backend_failover")
+            self.metrics.incr(f"backend_failover.{from_backend}->{to_backend}")
+        self._emit("backend_failover", from_backend=from_backend, to_backend=to_backend,
+                   error=str(error)[:200] if error else None)
+
+    def status(self):
+        with self._lock:
+            return [self.backends[name].to_dict() for name in self.priority]
+
+    def start_probing(self):
+        """Start the background prober that recovers open circuits"""
+        if self._probe_thread is not None:
+            return
+        self._probe_thread = threading.Thread(target=self._probe_loop, name="backend-prober", daemon=True)
+        self._probe_thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.PROBE_INTERVAL):
+            with self._lock:
+                candidates = [health for health in self.backends.values()
+                              if health.state == OPEN and health.probe is not None]
+            for health in candidates:
+                try:
+                    ok = health.probe()
+                except Exception as e:
+                    ok = False
+                    health.last_error = str(e)[:200]
+
+                if self.metrics:
+                    self.metrics.incr(f"backend_probe.{health.name}.{'ok' if ok is not False else 'fail'}")
+
+                if ok is False:
+                    with self._lock:
+                        # Still down - restart the cooldown
+                        if health.state == OPEN:
+                            health.opened_at = time.time()
+                    continue
+
+                with self._lock:
+                    recovered = health.state == OPEN
+                    if recovered:
+                        health.state = CLOSED
+                        health.consecutive_failures = 0
+                        health.opened_at = None
+                if recovered:
+                    self._emit("backend_recovered", backend=health.name)
+
+    def _emit(self, event, **fields):
+        if self.on_event:
+            try:
+                self.on_event(event, **fields)
+            except Exception:
+                pass
+
+
+def to_text_messages(history):
+    """
+    Flatten Anthropic-format history (string content or content blocks,
+    including tool_use/tool_result) into plain role/content text messages
+    for backends without Anthropic tool blocks
+    """
+    messages = []
+    for msg in history:
+        content = msg.get("content", "")
+        if isinstance(content, str):
+            text = content
+        else:
+            parts = []
+            for block in content:
+                if not isinstance(block, dict):
+                    continue
+                block_type = block.get("type")
+                if block_type == "text" and block.get("text"):
+                    parts.append(block["text"])
+                elif block_type == "tool_use":
+                    tool_input = block.get("input") or {}
+                    if block.get("name") == "search_knowledge":
+                        parts.append(f"[Searched the knowledge base for: {tool_input.get('query', '')}]")
+                    else:
+                        parts.append(f"[Called tool {block.get('name')}: {json.dumps(tool_input)}]")
+                elif block_type == "tool_result":
+                    result = block.get("content", "")
+                    if isinstance(result, list):
+                        result = "\n".join(b.get("text", "") for b in result if isinstance(b, dict))
+                    parts.append(f"[Search results]\n{result}")
+            text = "\n\n".join(parts)
+
+        if not text:
+            continue
+
+        # Merge consecutive same-role messages so roles keep alternating
+        if messages and messages[-1]["role"] == msg["role"]:
+            messages[-1]["content"] += "\n\n" + text
+        else:
+            messages.append({"role": msg["role"], "content": text})
+    return messages
+
+
+def to_ollama_messages(history):
+    """
+    Convert Anthropic-format history to Ollama /api/chat messages, keeping
+    tool use structured: tool_use blocks become the assistant's tool_calls
+    and tool_result blocks become role "tool" messages
+    """
+    messages = []
+    tool_names = {}
+    for msg in history:
+        content = msg.get("content", "")
+        if isinstance(content, str):
+            if content:
+                messages.append({"role": msg["role"], "content": content})
+            continue
+
+        texts = []
+        tool_calls = []
+        for block in content:
+            if not isinstance(block, dict):
+                continue
+            block_type = block.get("type")
+            if block_type == "text" and block.get("text"):
+                texts.append(block["text"])
+            elif block_type == "tool_use":
+                tool_names[block.get("id")] = block.get("name")
+                tool_calls.append({"function": {"name": block.get("name"), "arguments": block.get("input") or {}}})
+            elif block_type == "tool_result":
+                result = block.get("content", "")
+                if isinstance(result, list):
+                    result = "\n".join(b.get("text", "") for b in result if isinstance(b, dict))
+                messages.append({"role": "tool", "content": result,
+                                 "tool_name": tool_names.get(block.get("tool_use_id"), "")})
+
+        if texts or tool_calls:
+            message = {"role": msg["role"], "content": "\n\n".join(texts)}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            messages.append(message)
+    return messages
+
+
+def to_ollama_tools(tools):
+    """Anthropic tool definitions in the function format Ollama expects"""
+    return [{
+        "type": "function",
+        "function": {
+            "name": tool["name"],
+            "description": tool.get("description", ""),
+            "parameters": tool.get("input_schema", {"type": "object", "properties": {}})
+        }
+    } for tool in tools]
@@ -0,0 +1,151 @@
+"""
+Background prompt-cache warming
+Sends a minimal request against a system+tools prefix so the next real
+request reads the prefix from Anthropic's prompt cache instead of paying
+the cache write. Warm-ups are recorded as marker files in a shared
+directory, so sessions with an identical prefix share one warm-up.
+
+Only prefixes past the model's caching minimum are warmed. The shipped
+stage prompts are roughly 400-750 tokens, below even Sonnet's and Opus's
+1024, so LLMShell logs cache_warm_disabled and skips warming unless the
+prompts are extended (past 1024 tokens on Sonnet/Opus, 4096 on Haiku).
+The player's name is part of the system prompt, so a warm-up is shared
+by that player's sessions, not across players.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Minimum prompt length Anthropic will cache, per model family
+MIN_CACHEABLE_TOKENS = {
+    "haiku": 4096,
+    "sonnet": 1024,
+    "opus": 1024
+}
+
+
+def prefix_key(api_params):
+    """Hash of everything that makes up the cached prefix"""
+    prefix = {
+        "model": api_params.get("model"),
+        "system": api_params.get("system"),
+        "tools": api_params.get("tools", [])
+    }
+    return hashlib.sha256(json.dumps(prefix, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def estimate_prefix_tokens(api_params):
+    """Rough 4-chars-per-token size of the system+tools prefix"""
+    size = len(json.dumps(api_params.get("system", ""))) + len(json.dumps(api_params.get("tools", [])))
+    return size // 4
+
+
+def min_cacheable_tokens(model):
+    return next((n for family, n in MIN_CACHEABLE_TOKENS.items() if family in (model or "")), 1024)
+
+
+def cacheable(api_params):
+    """True if the API would cache api_params' system+tools prefix"""
+    return estimate_prefix_tokens(api_params) >= min_cacheable_tokens(api_params.get("model"))
+
+
+class CacheWarmer:
+    # Ephemeral cache entries live 5 minutes; leave headroom before re-warming
+    WARM_TTL_SECONDS = 240
+
+    def __init__(self, client, marker_dir, metrics=None, on_event=None, on_usage=None):
+        self.client = client
+        self.marker_dir = marker_dir
+        self.metrics = metrics
+        self.on_event = on_event
+        self.on_usage = on_usage  # Called with (model, usage) so warm-ups count toward the player's usage
+
+    def warm(self, api_params):
+        """
+        Warm the cache for api_params' prefix in a background thread
+        Returns True if a warm-up was started
+        """
+        if not cacheable(api_params):
+            # The API would not cache this prefix, so a warm-up is pure cost
+            self._incr("cache_warm_skipped_too_short")
+            return False
+
+        key = prefix_key(api_params)
+        if not self._claim(key):
+            self._incr("cache_warm_skipped_recent")
+            return False
+
+        thread = threading.Thread(target=self._send, args=(api_params, key), name="cache-warmer", daemon=True)
+        thread.start()
+        return True
+
+    def _marker_path(self, key):
+        return os.path.join(self.marker_dir, key)
+
+    def _claim(self, key):
+        """Claim the warm-up for this prefix unless another session warmed it recently"""
+        marker = self._marker_path(key)
+        try:
+            os.makedirs(self.marker_dir, exist_ok=True)
+            if time.time() - os.path.getmtime(marker) < self.WARM_TTL_SECONDS:
+                return False
+            os.remove(marker)
+        except OSError:
+            pass
+
+        try:
+            fd = os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+            return True
+        except FileExistsError:
+            # Another session claimed it between our check and create
+            return False
+        except OSError:
+            # No shared marker directory - warm anyway, just without dedup
+            return True
+
+    def _send(self, api_params, key):
+        params = dict(api_params)
+        params["max_tokens"] = 1
+        params["messages"] = [{"role": "user", "content": "."}]
+
+        started = time.time()
+        try:
+            response = self.client.messages.create(**params)
+        except Exception as e:
+            # Release the claim so a later session can try again
+            try:
+                os.remove(self._marker_path(key))
+            except OSError:
+                pass
+            self._incr("cache_warm_failed")
+            self._emit("cache_warm_failed", error=str(e)[:200])
+            return
+
+        usage = response.usage
+        if self.on_usage:
+            try:
+                self.on_usage(params.get("model"), usage)
+            except Exception:
+                pass
+        cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+        self._incr("cache_warm_sent")
+        self._incr("cache_warm_write_tokens", cache_write)
+        self._emit("cache_warmed", model=params.get("model"), prefix=key[:16],
+                   cache_write_tokens=cache_write, cache_read_tokens=cache_read,
+                   latency=round(time.time() - started, 4))
+
+    def _incr(self, name, amount=1):
+        if self.metrics:
+            self.metrics.incr(name, amount)
+
+    def _emit(self, event, **fields):
+        if self.on_event:
+            try:
+                self.on_event(event, **fields)
+            except Exception:
+                pass
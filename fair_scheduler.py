@@ -0,0 +1,180 @@
+"""
+Cross-process weighted fair queueing in front of the LLM call
+Every SSH session is its own process, so the queue lives in a SQLite table
+that all of them share. Each request gets a virtual finish tag
+
+    finish = max(virtual_time, player's last finish) + cost / weight
+
+where cost is the request's estimated input tokens. At most MAX_CONCURRENT
+requests are in flight; when that many are running, waiting requests are
+admitted in finish-tag order. A player who keeps sending long prompts
+pushes their own tags ahead, so under contention they wait while light
+players go first. With spare capacity nobody waits.
+"""
+
+import os
+import sqlite3
+import time
+
+from progress_store import _connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fq_tickets (
+    ticket_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_name TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    start_tag REAL NOT NULL,
+    finish_tag REAL NOT NULL,
+    running INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fq_users (
+    user_name TEXT PRIMARY KEY,
+    last_finish REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fq_clock (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    virtual_time REAL NOT NULL
+);
+INSERT OR IGNORE INTO fq_clock (id, virtual_time) VALUES (0, 0);
+"""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FairScheduler:
+    # Requests in flight across all sessions
+    MAX_CONCURRENT = 8
+    # Longest a request waits before going ahead regardless
+    MAX_WAIT_SECONDS = 30
+    # Polling interval while waiting
+    POLL_SECONDS = 0.05
+    # Tickets older than this are from a crashed or stuck session
+    TICKET_TTL_SECONDS = 300
+
+    def __init__(self, path, metrics=None, max_concurrent=None):
+        self.path = path
+        self.metrics = metrics
+        if max_concurrent:
+            self.MAX_CONCURRENT = max_concurrent
+        conn = _connect(path)
+        try:
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def acquire(self, user_name, cost, weight=1.0):
+        """
+        Wait for this request's turn; returns a ticket id for release()
+        Returns None (go ahead unscheduled) if the queue is unavailable
+        """
+        started = time.perf_counter()
+        try:
+            conn = _connect(self.path)
+        except sqlite3.Error:
+            return None
+        ticket = None
+        try:
+            ticket = self._enqueue(conn, user_name, max(cost, 1) / max(weight, 0.01))
+            delay = self.POLL_SECONDS
+            while not self._try_admit(conn, ticket):
+                if time.perf_counter() - started > self.MAX_WAIT_SECONDS:
+                    with conn:
+                        self._admit(conn, ticket)
+                    self._incr("fair_queue_timeouts")
+                    break
+                time.sleep(delay)
+                delay = min(delay * 1.5, 0.5)
+        except sqlite3.Error:
+            self._incr("fair_queue_errors")
+            self._discard(conn, ticket)
+            return None
+        except BaseException:
+            # Ctrl-C while queued: a leftover ticket would block everyone behind it
+            self._discard(conn, ticket)
+            raise
+        finally:
+            conn.close()
+
+        waited = time.perf_counter() - started
+        if self.metrics:
+            self.metrics.observe("fair_queue_wait_seconds", waited)
+        return ticket
+
+    def release(self, ticket):
+        if ticket is None:
+            return
+        try:
+            conn = _connect(self.path)
+            try:
+                with conn:
+                    conn.execute("DELETE FROM fq_tickets WHERE ticket_id = ?", (ticket,))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            self._incr("fair_queue_errors")
+
+    def _discard(self, conn, ticket):
+        if ticket is None:
+            return
+        try:
+            with conn:
+                conn.execute("DELETE FROM fq_tickets WHERE ticket_id = ?", (ticket,))
+        except sqlite3.Error:
+            self._incr("fair_queue_errors")
+
+    def _enqueue(self, conn, user_name, service):
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            virtual_time = conn.execute("SELECT virtual_time FROM fq_clock WHERE id = 0").fetchone()[0]
+            row = conn.execute("SELECT last_finish FROM fq_users WHERE user_name = ?", (user_name,)).fetchone()
+            start_tag = max(virtual_time, row[0] if row else 0)
+            finish_tag = start_tag + service
+            conn.execute("INSERT INTO fq_users (user_name, last_finish) VALUES (?, ?) "
+                         "ON CONFLICT(user_name) DO UPDATE SET last_finish = excluded.last_finish",
+                         (user_name, finish_tag))
+            cursor = conn.execute(
+                "INSERT INTO fq_tickets (user_name, pid, start_tag, finish_tag, created_at) VALUES (?, ?, ?, ?, ?)",
+                (user_name, os.getpid(), start_tag, finish_tag, time.time()))
+            return cursor.lastrowid
+
+    def _try_admit(self, conn, ticket):
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._expire(conn)
+            running = conn.execute("SELECT COUNT(*) FROM fq_tickets WHERE running = 1").fetchone()[0]
+            if running >= self.MAX_CONCURRENT:
+                return False
+            first = conn.execute("SELECT ticket_id FROM fq_tickets WHERE running = 0 "
+                                 "ORDER BY finish_tag, ticket_id LIMIT 1").fetchone()
+            if first is None or first[0] != ticket:
+                return False
+            self._admit(conn, ticket)
+            return True
+
+    def _admit(self, conn, ticket):
+        conn.execute("UPDATE fq_tickets SET running = 1 WHERE ticket_id = ?", (ticket,))
+        # Virtual time follows the start tag of the latest admitted request
+        conn.execute("UPDATE fq_clock SET virtual_time = MAX(virtual_time, "
+                     "(SELECT start_tag FROM fq_tickets WHERE ticket_id = ?)) WHERE id = 0", (ticket,))
+
+    def _expire(self, conn):
+        """Drop tickets of sessions that died or hung without releasing"""
+        cutoff = time.time() - self.TICKET_TTL_SECONDS
+        for ticket_id, pid, created_at in conn.execute(
+                "SELECT ticket_id, pid, created_at FROM fq_tickets").fetchall():
+            if created_at < cutoff or not _pid_alive(pid):
+                conn.execute("DELETE FROM fq_tickets WHERE ticket_id = ?", (ticket_id,))
+
+    def _incr(self, name):
+        if self.metrics:
+            self.metrics.incr(name)
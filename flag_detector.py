@@ -0,0 +1,136 @@
+"""
+Streaming flag-leak detection
+An Aho-Corasick automaton over all stage flags, compiled to a transition
+table so each streamed character costs a single dict lookup. Matcher state
+carries over between chunks, so a flag split across stream deltas is still
+found.
+
+Run `python flag_detector.py` for a per-token overhead benchmark.
+"""
+
+import random
+import string
+import time
+from collections import deque
+
+
+class FlagLeakDetector:
+    def __init__(self, patterns):
+        """
+        patterns maps a label (e.g. the stage number) to the text to detect
+        """
+        self.patterns = {label: text for label, text in patterns.items() if text}
+        self._build()
+
+    def _build(self):
+        # Trie
+        goto = [{}]
+        outputs = [[]]
+        for label, text in self.patterns.items():
+            state = 0
+            for char in text:
+                if char not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            outputs[state].append(label)
+
+        # Failure links (breadth first), folded into a full transition table
+        # over the pattern alphabet. Characters outside it always go to the root.
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])]
+        delta.extend({} for _ in range(len(goto) - 1))
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            transitions = dict(delta[fail[state]])
+            for char, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(char, 0) if state else 0
+                transitions[char] = child
+                queue.append(child)
+            delta[state] = transitions
+
+        self._delta = delta
+        self._outputs = [tuple(out) for out in outputs]
+
+    def matcher(self):
+        """Return a fresh matcher for one streamed response"""
+        return StreamMatcher(self)
+
+    def scan(self, text):
+        """Labels of all patterns found in a complete string"""
+        return self.matcher().feed(text)
+
+
+class StreamMatcher:
+    def __init__(self, detector):
+        self._delta = detector._delta
+        self._outputs = detector._outputs
+        self.state = 0
+        self.found = set()
+
+    def feed(self, chunk):
+        """
+        Advance over a streamed chunk
+        Returns labels matched for the first time in this stream
+        """
+        delta = self._delta
+        outputs = self._outputs
+        state = self.state
+        new = []
+        for char in chunk:
+            state = delta[state].get(char, 0)
+            if outputs[state]:
+                for label in outputs[state]:
+                    if label not in self.found:
+                        self.found.add(label)
+                        new.append(label)
+        self.state = state
+        return new
+
+
+def benchmark(tokens=200000, chunk_chars=4, flags=5, seed=0):
+    """Compare streaming a response with and without the detector in the loop"""
+    rng = random.Random(seed)
+    patterns = {stage: "FLAG{" + "".join(rng.choice(string.ascii_lowercase + "_") for _ in range(24)) + "}"
+                for stage in range(1, flags + 1)}
+    alphabet = string.ascii_letters + string.digits + " .,{}_"
+    chunks = ["".join(rng.choice(alphabet) for _ in range(chunk_chars)) for _ in range(tokens)]
+    # Split one flag across chunk boundaries to check it is still caught
+    leaked = patterns[flags]
+    chunks[tokens // 2:tokens // 2] = [leaked[:7], leaked[7:15], leaked[15:]]
+
+    detector = FlagLeakDetector(patterns)
+
+    started = time.perf_counter()
+    baseline = []
+    for chunk in chunks:
+        baseline.append(chunk)
+    baseline_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matcher = detector.matcher()
+    found = []
+    for chunk in chunks:
+        found.extend(matcher.feed(chunk))
+    detector_seconds = time.perf_counter() - started
+
+    overhead = max(0.0, detector_seconds - baseline_seconds)
+    return {
+        'chunks': len(chunks),
+        'chars': sum(len(c) for c in chunks),
+        'found': found,
+        'baseline_seconds': round(baseline_seconds, 4),
+        'detector_seconds': round(detector_seconds, 4),
+        'overhead_ns_per_token': round(overhead / len(chunks) * 1e9, 1)
+    }
+
+
+if __name__ == "__main__":
+    result = benchmark()
+    print(f"Streamed {result['chunks']} chunks ({result['chars']} chars)")
+    print(f"Flags found: {result['found']}")
+    print(f"Baseline: {result['baseline_seconds']}s  With detector: {result['detector_seconds']}s")
+    print(f"Overhead: {result['overhead_ns_per_token']} ns per token")
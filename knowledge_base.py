@@ -8,10 +8,23 @@ import glob
 import re
 
 class KnowledgeBase:
+    # Matches closer together than this are returned as one snippet
+    SNIPPET_MERGE_GAP = 200
+    # Joins separate snippets from the same section
+    SNIPPET_SEPARATOR = " ... "
+    # Fuzzy (misspelled) matches score at this fraction of an exact match
+    FUZZY_WEIGHT = 0.5
+    # Candidates from trigram overlap that get an edit-distance check
+    FUZZY_CANDIDATES = 20
+
     def __init__(self, knowledge_dir="/app/knowledge"):
         self.knowledge_dir = knowledge_dir
         self.documents = {}
         self.sections = {}
+        # word -> set of section keys containing it
+        self.word_index = {}
+        # character trigram -> set of indexed words, for typo-tolerant lookup
+        self.trigram_index = {}
 
         if os.path.exists(knowledge_dir):
             self._load_documents()
@@ -32,6 +45,15 @@ class KnowledgeBase:
             except Exception as e:
                 print(f"Error loading {filepath}: {e}")
 
+        self._build_trigram_index()
+
+    def _build_trigram_index(self):
+        """Index every known word by its character trigrams"""
+        self.trigram_index = {}
+        for word in self.word_index:
+            for trigram in _trigrams(word):
+                self.trigram_index.setdefault(trigram, set()).add(word)
+
     def _index_sections(self, filepath, content):
         """Split document into sections based on markdown headers"""
         # Match ## Header or # Header
@@ -45,9 +67,19 @@ class KnowledgeBase:
             text = sections[i].strip()
             if text:
                 key = f"{filepath}:{current_title}"
+                # Word offsets let search() return the part of a long section that matched
+                term_offsets = {}
+                for match in re.finditer(r'\w+', text):
+                    term_offsets.setdefault(match.group().lower(), []).append(match.start())
+                for term in set(term_offsets) | set(re.findall(r'\w+', current_title.lower())):
+                    self.word_index.setdefault(term, set()).add(key)
+
                 self.sections[key] = {
                     'title': current_title,
                     'content': text,
+                    'content_lower': text.lower(),
+                    'title_lower': current_title.lower(),
+                    'term_offsets': term_offsets,
                     'source': filepath,
                     'restricted': is_restricted
                 }
@@ -68,6 +100,12 @@ class KnowledgeBase:
         # Use 3+ char keywords to catch short terms
         keywords = [w for w in re.findall(r'\w+', query_lower) if len(w) > 2]
 
+        # Misspelled keywords (no exact match anywhere) fall back to close words
+        fuzzy_words = []
+        for keyword in keywords:
+            if not self._has_exact_match(keyword):
+                fuzzy_words.extend(self.fuzzy_matches(keyword))
+
         results = []
 
         for key, section in self.sections.items():
@@ -75,8 +113,8 @@ class KnowledgeBase:
             if section.get('restricted', False) and not allow_restricted:
                 continue
 
-            content_lower = section['content'].lower()
-            title_lower = section['title'].lower()
+            content_lower = section['content_lower']
+            title_lower = section['title_lower']
 
             score = 0
 
@@ -91,11 +129,16 @@ class KnowledgeBase:
                 # Content matches
                 score += content_lower.count(keyword)
 
+            # Fuzzy matches always score below the same number of exact matches
+            for word in fuzzy_words:
+                score += title_lower.count(word) * 3 * self.FUZZY_WEIGHT
+                score += len(section['term_offsets'].get(word, ())) * self.FUZZY_WEIGHT
+
             if score > 0:
                 results.append((
                     score,
                     section['title'],
-                    section['content'][:max_chars],
+                    self._extract_snippet(section, keywords + fuzzy_words, max_chars),
                     section['source']
                 ))
 
@@ -103,12 +146,149 @@ class KnowledgeBase:
         results.sort(reverse=True, key=lambda x: x[0])
         return results[:max_results]
 
+    def _has_exact_match(self, keyword):
+        """True if keyword occurs (as a substring, like scoring) in any indexed word"""
+        if keyword in self.word_index:
+            return True
+        # Any word containing the keyword contains all of its trigrams
+        candidates = None
+        for trigram in _trigrams(keyword, padded=False):
+            words = self.trigram_index.get(trigram, set())
+            candidates = words if candidates is None else candidates & words
+            if not candidates:
+                return False
+        return any(keyword in word for word in candidates or ())
+
+    def fuzzy_matches(self, keyword, max_distance=None):
+        """
+        Indexed words that start within a small edit distance of keyword
+        (prefix match, mirroring the substring semantics of exact scoring, so
+        "tardigard" finds "tardigrades"). Candidates come from shared trigrams;
+        only the best few are edit-distance checked
+        """
+        if max_distance is None:
+            max_distance = 1 if len(keyword) <= 5 else 2
+
+        overlap = {}
+        for trigram in _trigrams(keyword):
+            for word in self.trigram_index.get(trigram, ()):
+                if len(word) >= len(keyword) - max_distance:
+                    overlap[word] = overlap.get(word, 0) + 1
+
+        shortlist = sorted((word for word, shared in overlap.items() if shared >= 2),
+                           key=lambda w: -overlap[w])[:self.FUZZY_CANDIDATES]
+        return [word for word in shortlist
+                if _edit_distance(keyword, word, max_distance) <= max_distance]
+
+    def _match_spans(self, section, keywords):
+        """(start, end) offsets of every keyword occurrence, from the indexed word offsets"""
+        spans = []
+        for term, offsets in section['term_offsets'].items():
+            for keyword in keywords:
+                # Substring semantics, same as the scoring in search()
+                pos = term.find(keyword)
+                if pos < 0:
+                    continue
+                for offset in offsets:
+                    spans.append((offset + pos, offset + pos + len(keyword)))
+        spans.sort()
+        return spans
+
+    def _extract_snippet(self, section, keywords, max_chars):
+        """
+        Return up to max_chars of a section, centred on where the keywords matched
+        Nearby matches are merged into one window; separate clusters are joined
+        with SNIPPET_SEPARATOR, densest first, until the budget runs out
+        """
+        content = section['content']
+        if len(content) <= max_chars:
+            return content
+
+        spans = self._match_spans(section, keywords)
+        if not spans:
+            # Title-only match - the start of the section is the best we have
+            return content[:max_chars]
+
+        # Group matches that sit close together
+        clusters = []
+        for start, end in spans:
+            if clusters and start - clusters[-1][1] <= self.SNIPPET_MERGE_GAP:
+                clusters[-1][1] = max(clusters[-1][1], end)
+                clusters[-1][2] += 1
+            else:
+                clusters.append([start, end, 1])
+
+        # A cluster wider than the budget is narrowed to its densest window
+        for cluster in clusters:
+            if cluster[1] - cluster[0] > max_chars:
+                inner = [span for span in spans if cluster[0] <= span[0] < cluster[1]]
+                cluster[0], cluster[1], cluster[2] = self._densest_window(inner, max_chars)
+
+        # Pick clusters by match count until the budget (including separators) is spent
+        separator = len(self.SNIPPET_SEPARATOR)
+        chosen = []
+        used = 0
+        for cluster in sorted(clusters, key=lambda c: (-c[2], c[0])):
+            cost = cluster[1] - cluster[0] + (separator if chosen else 0)
+            if used + cost > max_chars:
+                continue
+            chosen.append([cluster[0], cluster[1]])
+            used += cost
+        if not chosen:
+            # Not even one window fits (a single match longer than the budget)
+            return content[:max_chars]
+        chosen.sort()
+
+        # Spread the leftover budget as context on both sides of each window
+        padding = (max_chars - used) // (2 * len(chosen))
+        windows = []
+        for start, end in chosen:
+            start = max(0, start - padding)
+            end = min(len(content), end + padding)
+            if windows and start <= windows[-1][1] + separator:
+                windows[-1][1] = end
+            else:
+                windows.append([start, end])
+
+        parts = []
+        for start, end in windows:
+            # Snap to word boundaries so snippets don't start or end mid-word
+            if start > 0:
+                space = content.find(' ', start)
+                if 0 <= space < end:
+                    start = space + 1
+            if end < len(content):
+                space = content.rfind(' ', start, end)
+                if space > start:
+                    end = space
+            parts.append(content[start:end].strip())
+
+        return self.SNIPPET_SEPARATOR.join(parts)[:max_chars]
+
+    def _densest_window(self, spans, width):
+        """(start, end, hits) of the width-limited window covering the most spans"""
+        best = (spans[0][0], spans[0][1], 1)
+        left = 0
+        for right in range(len(spans)):
+            # A single span wider than the window stays on its own
+            while left < right and spans[right][1] - spans[left][0] > width:
+                left += 1
+            hits = right - left + 1
+            if hits > best[2]:
+                best = (spans[left][0], spans[right][1], hits)
+        return best
+
     def get_context(self, query, max_chars=2000, allow_restricted=False):
         """
         Get formatted context string for injection into prompt
         """
         results = self.search(query, max_results=3, max_chars=max_chars, allow_restricted=allow_restricted)
+        return self.format_results(results)
 
+    def format_results(self, results):
+        """
+        Format search() results as a context string, or None if empty
+        """
         if not results:
             return None
 
@@ -117,3 +297,36 @@ class KnowledgeBase:
             context_parts.append(f"[From {title}]\n{content}")
 
         return "\n\n".join(context_parts)
+
+
+def _trigrams(word, padded=True):
+    """Character trigrams; padding marks word boundaries so prefixes/suffixes count"""
+    if padded:
+        word = f"${word}$"
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def _edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance (edits plus adjacent transpositions)
+    between a and the closest prefix of b
+    Stops early and returns limit + 1 once every path exceeds limit
+    """
+    if len(b) < len(a) - limit:
+        return limit + 1
+    b = b[:len(a) + limit]
+
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and i > 1 and j > 1 and
+                    a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return min(previous[max(0, len(a) - limit):])
@@ -5,12 +5,79 @@ import os
 import json
 import time
 import socket
+import uuid
+from collections import deque
 from datetime import datetime
 from anthropic import Anthropic
 import openai
 import requests
-from system_prompt import get_system_prompt, get_flag_for_stage
+from system_prompt import get_system_prompt, get_flag_for_stage, FLAGS
 from knowledge_base import KnowledgeBase
+from backend_router import BackendRouter, to_ollama_messages, to_ollama_tools, to_text_messages
+from metrics import SessionMetrics
+from retrieval_prefetch import RetrievalPrefetcher, normalize_query
+from cache_warmer import CacheWarmer, cacheable, estimate_prefix_tokens, min_cacheable_tokens
+from retrieval_ledger import RetrievalLedger
+from flag_detector import FlagLeakDetector
+from progress_store import ProgressStore
+from conversation_compactor import ConversationCompactor
+from model_router import ModelRouter, estimate_cost
+from profiling import Profiler
+from response_cache import NAME_PLACEHOLDER, ResponseCache, text_chunks
+from token_accounting import TokenAccountant, _env_number, usage_from_response
+from fair_scheduler import FairScheduler
+
+# Directory for session logs (mounted as a volume in docker-compose)
+LOG_DIR = os.getenv('LOG_DIR', '/app/logs')
+LOG_FILE = os.path.join(LOG_DIR, 'llm_shell.jsonl')
+
+SONNET_MODEL = "claude-sonnet-4-5-20250929"
+HAIKU_MODEL = "claude-haiku-4-5-20251001"
+
+# Knowledge base search tool offered to the model in stage 3
+SEARCH_TOOL = {
+    "name": "search_knowledge",
+    "description": """
+            Search the knowledge base for information. Use this tool when you need to look up specific topics, terms, or data that may be stored in the knowledge base.
+            You have several markdown documents available to you in this tool. Topics include:
+              - Animal facts
+                - Octopuses, tardigrades, mantis shrimp, elephants, crows, axolotls
+              - Food facts
+                - Honey, bananas, vanilla, capsaicin, cheese, potatoes
+              - History facts
+                - Ancient Egypt, Roman Empire, Vikings, Medieval period, World War I, Ancient Greece
+              - Space facts
+                - The Sun, black holes, the Moon, neutron stars, Venus
+              - Technology facts
+                - QWERTY keyboard, first computer bug, internet traffic, GPS satellites, Nintendo, email
+              - An additional file with information about your system and its functionality
+            """,
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "The term or topic to search for. Try specific terms first, then broader terms if needed."
+            }
+        },
+        "required": ["query"]
+    }
+}
+
+
+QUOTA_MESSAGES = {
+    "session": "[Usage limit reached for this session. Reconnect to keep playing.]",
+    "daily": "[Daily usage limit reached. Please come back tomorrow.]"
+}
+
+
+class GenerationCancelled(KeyboardInterrupt):
+    """Raised when the player presses Ctrl-C while a response is streaming"""
+
+    def __init__(self, partial_text=""):
+        super().__init__()
+        self.partial_text = partial_text
+
 
 class LLMShell:
     # Model configuration - set to True for Sonnet, False for Haiku
@@ -19,34 +86,128 @@ class LLMShell:
     DEBUG_MODE = False
     # Maximum conversation history messages to keep (prevents unbounded context growth)
     MAX_HISTORY = 10
-
-    def __init__(self):
+    # Output token limit for every backend
+    MAX_OUTPUT_TOKENS = 1000
+    # Run likely knowledge base searches while the first API call is in flight
+    SPECULATIVE_RETRIEVAL = True
+    # Seconds per character of fake streaming for text that precedes a tool call
+    PRE_TOOL_TEXT_DELAY = 0.01
+    # Summarize older turns into one synthetic exchange instead of dropping them
+    COMPACT_HISTORY = False
+    # Pick Haiku or Sonnet per turn from stage, turn shape and recent latency/errors
+    ADAPTIVE_MODEL_ROUTING = False
+    # Answer repeated opening messages from a response cache shared by all sessions
+    RESPONSE_CACHE = False
+    # Local model served by Ollama
+    OLLAMA_MODEL = "llama3.2"
+    # How long Ollama keeps the model loaded after a request (OLLAMA_KEEP_ALIVE overrides)
+    OLLAMA_KEEP_ALIVE = "30m"
+
+    def __init__(self, anthropic_client=None):
         self.assistant_name = "AI"
         self.location = "The Cloud"
-        self.session_id = f"session_{int(time.time())}"
+        # Include the pid - several players can connect in the same second
+        self.session_id = f"session_{int(time.time())}_{os.getpid()}"
 
         # Capture the user's name from SSH and title-case it
         raw_name = os.getenv('USER', 'unknown_user')
         self.user_name = raw_name.title()
+        self.user_key = raw_name  # Stable key for persisted progress
 
         # Set model based on configuration
         if self.USE_SONNET:
-            self.claude_model = "claude-sonnet-4-5-20250929"
+            self.claude_model = SONNET_MODEL
         else:
-            self.claude_model = "claude-haiku-4-5-20251001"
+            self.claude_model = HAIKU_MODEL
 
         # Initialize LLM clients
         self.anthropic_client = None
         self.openai_client = None
         self.ollama_host = None
-        
-        self.setup_llm_clients()
+        self.ollama_keep_alive = self.OLLAMA_KEEP_ALIVE
+
+        # Per-session metrics and health-tracked backend selection
+        self.metrics = SessionMetrics()
+        self.backend_router = BackendRouter(metrics=self.metrics, on_event=self.log_event)
+        self.active_backend = None
+
+        # claude_model stays the default when per-turn routing is off
+        self.model_router = None
+        if self.ADAPTIVE_MODEL_ROUTING:
+            self.model_router = ModelRouter(HAIKU_MODEL, SONNET_MODEL, metrics=self.metrics)
+        self.turn_model = self.claude_model
+
+        self.setup_llm_clients(anthropic_client)
         self.log_session_start()
-        
+
+        # Shared across sessions through marker files in the log directory
+        self.cache_warmer = None
+        if self.anthropic_client:
+            self.cache_warmer = CacheWarmer(self.anthropic_client, os.path.join(LOG_DIR, 'cache_warm'),
+                                            metrics=self.metrics, on_event=self.log_event,
+                                            on_usage=self._record_background_usage)
+
+        # Older turns are summarized by Haiku, or locally without an Anthropic client
+        self.conversation_compactor = None
+        if self.COMPACT_HISTORY:
+            self.conversation_compactor = ConversationCompactor(self.anthropic_client, model=HAIKU_MODEL,
+                                                                metrics=self.metrics, on_event=self.log_event,
+                                                                on_usage=self._record_background_usage)
+
+        self.response_cache = None
+        if self.RESPONSE_CACHE:
+            try:
+                self.response_cache = ResponseCache(
+                    os.getenv('RESPONSE_CACHE_DB', os.path.join(LOG_DIR, 'response_cache.db')), metrics=self.metrics)
+            except Exception as e:
+                print(f"Response cache unavailable: {e}", file=sys.stderr)
+
+        # Token/cost accounting, quotas and the cross-session fair queue share one SQLite file
+        self.token_accountant = None
+        self.fair_scheduler = None
+        usage_db = os.getenv('USAGE_DB', os.path.join(LOG_DIR, 'usage.db'))
+        try:
+            self.token_accountant = TokenAccountant(usage_db, self.user_key, metrics=self.metrics)
+        except Exception as e:
+            print(f"Usage accounting unavailable: {e}", file=sys.stderr)
+        try:
+            self.fair_scheduler = FairScheduler(usage_db, metrics=self.metrics,
+                                                max_concurrent=max(0, int(_env_number('LLM_MAX_CONCURRENT'))))
+        except Exception as e:
+            print(f"Fair queue unavailable: {e}", file=sys.stderr)
+
         # Session state
         self.known_visitors = []
         self.conversation_history = []  # Track full conversation for LLM context
         self.stage = 1  # You can track puzzle progress
+        self.turn = 0  # Player messages sent to the LLM this session
+        self.turn_usage = {}  # Token usage of the latest turn, summed over API calls
+        self.turn_tool_rounds = []  # Model content blocks of each tool round in the latest turn
+        self.turn_cache = None  # Response cache outcome of the latest turn ("hit", "miss" or None)
+        self.turn_cost = None  # Estimated USD cost of the latest turn
+        self.turn_api_seconds = 0.0  # Time spent waiting on the backend this turn, rendering excluded
+        self.answer_tokens = deque(maxlen=20)  # Rough token length of recent completed answers
+        self.resumed = False
+        self._progress_user_saved = False
+
+        # Resume stage and recent history from the progress store
+        self.progress_store = None
+        try:
+            self.progress_store = ProgressStore(os.getenv('PROGRESS_DB', os.path.join(LOG_DIR, 'progress.db')),
+                                                metrics=self.metrics)
+            saved_stage, saved_history = self.progress_store.load(self.user_key)
+            if saved_stage:
+                self.stage = saved_stage
+                self.conversation_history = saved_history
+                self.resumed = True
+                self._progress_user_saved = True
+                self.log_event("session_resumed", user=self.user_key, history_messages=len(saved_history))
+        except Exception as e:
+            print(f"Progress store unavailable: {e}", file=sys.stderr)
+
+        # Watches streamed output for any stage's flag
+        self.flag_detector = FlagLeakDetector(FLAGS)
+        self._leak_matcher = None
 
         # Generate system prompt based on current stage
         # Include user name so the AI always knows who it's talking to
@@ -61,44 +222,43 @@ class LLMShell:
             knowledge_dir = os.path.join(script_dir, 'knowledge')
 
         self.knowledge_base = KnowledgeBase(knowledge_dir=knowledge_dir)
+        self.retrieval_prefetcher = RetrievalPrefetcher(self.knowledge_base, metrics=self.metrics,
+                                                        max_results=3, max_chars=1500)
+        # Tracks which sections the model can already see in history
+        self.retrieval_ledger = RetrievalLedger(metrics=self.metrics)
 
         # Define the search tool for AI
-        self.search_tool = {
-            "name": "search_knowledge",
-"description": """
-            Search the knowledge base for information. Use this tool when you need to look up specific topics, terms, or data that may be stored in the knowledge base.
-            You have several markdown documents available to you in this tool. Topics include:
-              - Animal facts
-                - Octopuses, tardigrades, mantis shrimp, elephants, crows, axolotls
-              - Food facts
-                - Honey, bananas, vanilla, capsaicin, cheese, potatoes
-              - History facts
-                - Ancient Egypt, Roman Empire, Vikings, Medieval period, World War I, Ancient Greece
-              - Space facts
-                - The Sun, black holes, the Moon, neutron stars, Venus
-              - Technology facts
-                - QWERTY keyboard, first computer bug, internet traffic, GPS satellites, Nintendo, email
-              - An additional file with information about your system and its functionality
-            """,
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                        "description": "The term or topic to search for. Try specific terms first, then broader terms if needed."
-                    }
-                },
-                "required": ["query"]
-            }
+        self.search_tool = SEARCH_TOOL
+
+        # Warm-ups only pay off for stages whose prefix the routed model will cache
+        self.cache_warm_stages = set()
+        if self.cache_warmer:
+            self._check_cache_warming()
+
+        # Operator profiling: LLM_SHELL_PROFILE=1, or SIGUSR1 (cProfile) / SIGUSR2 (tracemalloc)
+        self.profiler = Profiler(os.path.join(LOG_DIR, 'profiles'), self.session_id,
+                                 memory_sizes=self._memory_sizes, on_event=self.log_event)
+        self.query_llm = self.profiler.wrap(self.query_llm)
+        self.knowledge_base.search = self.profiler.wrap(self.knowledge_base.search)
+        self.profiler.install()
+
+    def _memory_sizes(self):
+        """Sizes of the long-lived session state, for memory snapshots"""
+        return {
+            "conversation_history_messages": len(self.conversation_history),
+            "conversation_history_json_bytes": len(json.dumps(self.conversation_history)),
+            "knowledge_sections": len(self.knowledge_base.sections),
+            "word_index_terms": len(self.knowledge_base.word_index),
+            "trigram_index_grams": len(self.knowledge_base.trigram_index)
         }
 
     def _update_system_prompt(self):
         """Regenerate system prompt for current stage"""
         self.system_prompt = get_system_prompt(user_name=self.user_name, stage=self.stage)
 
-    def _get_available_tools(self):
-        """Return list of tools available for the current stage"""
-        if self.stage == 3:
+    def _get_available_tools(self, stage=None):
+        """Return list of tools available for the current stage (or the given one)"""
+        if (stage or self.stage) == 3:
             return [self.search_tool]
         return []
 
@@ -113,16 +273,69 @@ class LLMShell:
                 self.stage += 1
                 self._update_system_prompt()
                 self.conversation_history = []  # Clear history for new stage
+                self.retrieval_ledger.reset()
+                self._warm_stage_cache()
+                self._save_stage_complete(old_stage)
+                self.log_event("flag_accepted", completed_stage=old_stage)
                 return True, old_stage
             else:
                 # Stage 5 completed - game won!
+                self._save_stage_complete(5)
+                self.log_event("flag_accepted", completed_stage=5)
                 return True, 5
         return False, None
 
-    def setup_llm_clients(self):
-        """Initialize available LLM clients"""
+    def _save_stage_complete(self, completed_stage):
+        """Persist a completed stage and the player's new position"""
+        if not self.progress_store:
+            return
+        self.progress_store.record_stage_complete(self.user_key, completed_stage, self.session_id)
+        self.progress_store.save_stage(self.user_key, self.stage)
+        self.progress_store.save_history(self.user_key, self.stage, self.conversation_history)
+
+    def _save_history(self):
+        """Queue a snapshot of the recent conversation (written off the turn path)"""
+        if not self.progress_store:
+            return
+        if not self._progress_user_saved:
+            # First snapshot for a new player also creates their users row
+            self.progress_store.save_stage(self.user_key, self.stage)
+            self._progress_user_saved = True
+        # History is already bounded by _smart_truncate_history, which keeps tool pairs intact
+        self.progress_store.save_history(self.user_key, self.stage, self.conversation_history)
+
+    def _stage_cache_params(self, stage):
+        """Request parameters for a stage's system+tools prefix, on the model it is routed to"""
+        model = self.model_router.stage_model(stage) if self.model_router else None
+        system_prompt = get_system_prompt(user_name=self.user_name, stage=stage)
+        return self._build_api_params(system_prompt, [], self._get_available_tools(stage), model=model)
+
+    def _check_cache_warming(self):
+        """Find the stages worth warming once, and turn warming off if there are none"""
+        for stage in range(1, 6):
+            if cacheable(self._stage_cache_params(stage)):
+                self.cache_warm_stages.add(stage)
+        if not self.cache_warm_stages:
+            params = self._stage_cache_params(5)
+            self.log_event("cache_warm_disabled", model=params["model"],
+                           prefix_tokens_estimate=estimate_prefix_tokens(params),
+                           min_cacheable_tokens=min_cacheable_tokens(params["model"]))
+            self.cache_warmer = None
+
+    def _warm_stage_cache(self):
+        """Prime the prompt cache for the new stage's system+tools prefix in the background"""
+        if not self.cache_warmer or self.stage not in self.cache_warm_stages:
+            return
+        if not self.backend_router.is_available("anthropic"):
+            return
+        self.cache_warmer.warm(self._stage_cache_params(self.stage))
+
+    def setup_llm_clients(self, anthropic_client=None):
+        """Initialize available LLM clients (anthropic_client replaces the one built from the API key)"""
         try:
-            if os.getenv('ANTHROPIC_API_KEY'):
+            if anthropic_client is not None:
+                self.anthropic_client = anthropic_client
+            elif os.getenv('ANTHROPIC_API_KEY'):
                 self.anthropic_client = Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
                 # print("✅ Claude initialized", file=sys.stderr)
                 
@@ -132,37 +345,80 @@ class LLMShell:
                 
             if os.getenv('OLLAMA_HOST'):
                 self.ollama_host = os.getenv('OLLAMA_HOST')
-                # Test Ollama connection
-                try:
-                    response = requests.get(f"{self.ollama_host}/api/tags", timeout=2)
-                    if response.status_code == 200:
-                        pass
-                        # print("✅ Ollama initialized", file=sys.stderr)
-                    else:
-                        self.ollama_host = None
-                except:
-                    self.ollama_host = None
+                keep_alive = os.getenv('OLLAMA_KEEP_ALIVE')
+                if keep_alive:
+                    # Ollama takes a duration ("30m") or a number of seconds (-1 keeps it loaded)
+                    self.ollama_keep_alive = int(keep_alive) if keep_alive.lstrip("-").isdigit() else keep_alive
                     
         except Exception as e:
             print(f"Error initializing LLM clients: {e}", file=sys.stderr)
 
+        self._register_backends()
+
+    def _register_backends(self):
+        """Register configured clients with the backend router, in priority order"""
+        if self.anthropic_client:
+            self.backend_router.register("anthropic", probe=self._probe_anthropic)
+        if self.openai_client:
+            self.backend_router.register("openai", probe=self._probe_openai)
+        if self.ollama_host:
+            # Keep an unreachable Ollama registered with an open circuit so the
+            # background prober can bring it back instead of dropping it for good
+            self.backend_router.register("ollama", probe=self._probe_ollama, healthy=self._probe_ollama())
+        self.backend_router.start_probing()
+
+    def _probe_anthropic(self):
+        self.anthropic_client.models.list(limit=1)
+        return True
+
+    def _probe_openai(self):
+        self.openai_client.models.list()
+        return True
+
+    def _probe_ollama(self):
+        """Test Ollama connection"""
+        try:
+            response = requests.get(f"{self.ollama_host}/api/tags", timeout=2)
+            return response.status_code == 200
+        except:
+            return False
+
+    def _write_log(self, log_entry):
+        """Append a single entry to the session log"""
+        try:
+            with open(LOG_FILE, "a") as f:
+                f.write(json.dumps(log_entry) + "\n")
+        except:
+            pass
+
+    def log_event(self, event, **fields):
+        """Log a structured operational event (backend health, metrics, etc.)"""
+        log_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "session_id": self.session_id,
+            "event": event,
+            "stage": getattr(self, "stage", None)
+        }
+        log_entry.update(fields)
+        self._write_log(log_entry)
+
     def log_session_start(self):
         """Log session start"""
         try:
-            os.makedirs("/app/logs", exist_ok=True)
+            os.makedirs(LOG_DIR, exist_ok=True)
             log_entry = {
                 "timestamp": datetime.now().isoformat(),
                 "session_id": self.session_id,
                 "event": "session_start",
+                "user": self.user_key,
                 "client_ip": os.getenv("SSH_CLIENT", "unknown").split()[0] if os.getenv("SSH_CLIENT") else "unknown"
             }
             
-            with open(f"/app/logs/llm_shell.jsonl", "a") as f:
-                f.write(json.dumps(log_entry) + "\n")
+            self._write_log(log_entry)
         except:
             pass
 
-    def log_command(self, user_input, response):
+    def log_command(self, user_input, response, latency=None):
         """Log conversation with the AI"""
         try:
             log_entry = {
@@ -171,21 +427,37 @@ class LLMShell:
                 "event": "chat",
                 "user_input": user_input,
                 "ai_response": response,
-                "stage": self.stage
+                "stage": self.stage,
+                "backend": self.active_backend,
+                "model": self.turn_model if self.active_backend == "anthropic" else None,
+                "turn": self.turn,
+                "latency_ms": round(latency * 1000) if latency is not None else None,
+                "usage": self.turn_usage,
+                "tool_rounds": self.turn_tool_rounds,
+                "response_cache": self.turn_cache,
+                "cost_usd": round(self.turn_cost, 6) if self.turn_cost is not None else None
             }
             
-            with open(f"/app/logs/llm_shell.jsonl", "a") as f:
-                f.write(json.dumps(log_entry) + "\n")
+            self._write_log(log_entry)
         except:
             pass
 
+    def _cache_breakpoint(self):
+        """
+        Index of the history message that carries the cache_control marker
+        If we have at least 4 messages, it is the second-to-last message:
+        this caches everything except the current user input
+        """
+        if len(self.conversation_history) >= 4:
+            return len(self.conversation_history) - 2
+        return None
+
     def _build_messages_with_cache(self):
         """Build messages list with caching strategy for conversation history"""
         messages_to_send = []
+        cache_index = self._cache_breakpoint()
         for i, msg in enumerate(self.conversation_history):
-            # If we have at least 4 messages, add cache control to the second-to-last message
-            # This caches everything except the current user input
-            if len(self.conversation_history) >= 4 and i == len(self.conversation_history) - 2:
+            if i == cache_index:
                 # Only add cache_control to simple string messages
                 # Tool use messages already have proper content structure
                 if isinstance(msg["content"], str):
@@ -203,8 +475,9 @@ class LLMShell:
                     # For structured content (tool use/results), add cache_control to last block
                     content_copy = msg["content"].copy() if isinstance(msg["content"], list) else msg["content"]
                     if isinstance(content_copy, list) and len(content_copy) > 0:
-                        # Add cache_control to the last content block
-                        content_copy[-1]["cache_control"] = {"type": "ephemeral"}
+                        # Add cache_control to a copy of the last content block so the
+                        # marker doesn't leak into stored history and pile up across turns
+                        content_copy[-1] = dict(content_copy[-1], cache_control={"type": "ephemeral"})
                     new_msg = {"role": msg["role"], "content": content_copy}
             else:
                 # Regular message format
@@ -213,26 +486,41 @@ class LLMShell:
             messages_to_send.append(new_msg)
         return messages_to_send
 
-    def _execute_tool(self, tool_name, tool_input):
+    def _execute_tool(self, tool_name, tool_input, tool_use_id=None):
         """Execute a tool call and return the result"""
         if tool_name == "search_knowledge":
-            query = tool_input.get("query", "")
+            query = normalize_query(tool_input.get("query", ""))
             # Allow restricted content access in stage 3 for the tool-based attack
             allow_restricted = (self.stage == 3)
 
-            # Get raw results for debug info
-            raw_results = self.knowledge_base.search(query, max_results=3, max_chars=1500, allow_restricted=allow_restricted)
+            # Serve from the speculative prefetch when it guessed this query
+            raw_results = self.retrieval_prefetcher.lookup(query, allow_restricted=allow_restricted)
+            if raw_results is None:
+                started = time.perf_counter()
+                raw_results = self.knowledge_base.search(query, max_results=3, max_chars=1500, allow_restricted=allow_restricted)
+                self.metrics.observe("retrieval_search_seconds", time.perf_counter() - started)
 
             if self.DEBUG_MODE:
                 print(f"[DEBUG] Search found {len(raw_results)} results", file=sys.stderr)
                 for i, (score, title, _, _) in enumerate(raw_results):
                     print(f"[DEBUG]   {i+1}. '{title}' (score: {score})", file=sys.stderr)
 
-            result = self.knowledge_base.get_context(query, max_chars=1500, allow_restricted=allow_restricted)
-            if result:
-                return result
-            else:
+            if not raw_results:
                 return "No relevant information found in the archives for this query. Try different search terms."
+
+            # Sections still visible in history are only referenced, not resent
+            new_results, repeated_titles = self.retrieval_ledger.split(raw_results)
+            self.retrieval_ledger.make_room(self.conversation_history, sum(len(r[2]) for r in new_results),
+                                            cached_until=self._cache_breakpoint())
+            self.retrieval_ledger.record(tool_use_id, new_results)
+
+            context_parts = []
+            result = self.knowledge_base.format_results(new_results)
+            if result:
+                context_parts.append(result)
+            for title in repeated_titles:
+                context_parts.append(f"[From {title}]\n(Already returned by an earlier search above.)")
+            return "\n\n".join(context_parts)
         return "Unknown tool"
 
     def _smart_truncate_history(self):
@@ -258,11 +546,53 @@ class LLMShell:
 
         self.conversation_history = self.conversation_history[start_idx:]
 
+    def _build_api_params(self, system_prompt, messages, tools, model=None):
+        """Build Anthropic request parameters with the cached system prompt"""
+        api_params = {
+            "model": model or self.claude_model,
+            "max_tokens": self.MAX_OUTPUT_TOKENS,
+            "system": [
+                {
+                    "type": "text",
+                    "text": system_prompt,
+                    "cache_control": {"type": "ephemeral"}
+                }
+            ],
+            "messages": messages
+        }
+
+        # Only add tools if there are any available
+        if tools:
+            api_params["tools"] = tools
+        return api_params
+
+    def _record_background_usage(self, model, usage):
+        """Charge API calls made off the turn path (cache warm-ups, history summaries) to the player"""
+        if self.token_accountant:
+            self.token_accountant.record(model, usage_from_response(usage), turn=False)
+
+    def _record_usage(self, usage, prefix=""):
+        """Add an API response's token usage to this turn's totals"""
+        for field in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+            self.turn_usage[field] = self.turn_usage.get(field, 0) + (getattr(usage, field, 0) or 0)
+
+        # Debug: show token usage and cache info
+        if self.DEBUG_MODE:
+            print(f"{prefix}[DEBUG] Tokens - Input: {usage.input_tokens}, Output: {usage.output_tokens}", file=sys.stderr)
+            if hasattr(usage, 'cache_creation_input_tokens'):
+                print(f"[DEBUG] Cache - Write: {usage.cache_creation_input_tokens}, Read: {usage.cache_read_input_tokens}", file=sys.stderr)
+
     def query_llm(self, prompt):
-        """Query the configured LLM with tool-based RAG"""
+        """Query the configured LLM with tool-based RAG, failing over between backends"""
 
         # Keep conversation manageable - trim while keeping tool pairs together
-        self._smart_truncate_history()
+        if self.conversation_compactor:
+            self.conversation_history = self.conversation_compactor.compact(self.conversation_history)
+        # Trimming the head under a pending summary would make it stale before it lands,
+        # but a summary that has been pending for several turns no longer holds back the cap
+        compactor = self.conversation_compactor
+        if not (compactor and compactor.pending and not compactor.stalled):
+            self._smart_truncate_history()
 
         # Use current system prompt
         system_prompt = self.system_prompt
@@ -272,322 +602,554 @@ class LLMShell:
             "role": "user",
             "content": prompt
         })
+        turn_start = len(self.conversation_history)
+        self.turn += 1
+        self.turn_usage = {}
+        self.turn_tool_rounds = []
+        self.turn_cache = None
+        self.turn_cost = None
+
+        # Players over quota are refused before anything is sent
+        weight = 1.0
+        if self.token_accountant:
+            limit, weight = self.token_accountant.check()
+            if limit:
+                del self.conversation_history[turn_start - 1:]
+                self.metrics.incr("quota_refused")
+                self.log_event("quota_exceeded", user=self.user_key, limit=limit)
+                print(f"\nAI: {QUOTA_MESSAGES[limit]}")
+                return QUOTA_MESSAGES[limit]
+
+        input_chars = sum(len(m["content"]) if isinstance(m["content"], str) else len(json.dumps(m["content"]))
+                          for m in self.conversation_history)
+
+        # Pin the model for the whole turn so the tool loop and retries stay on it
+        self.turn_model = self.claude_model
+        route = None
+        if self.model_router:
+            has_tools = bool(self._get_available_tools())
+            self.turn_model, reason = self.model_router.choose(self.stage, input_chars, has_tools)
+            route = {"reason": reason, "input_chars": input_chars, "has_tools": has_tools}
+
+        # An opening message may already have been answered for another session
+        cache_key = None
+        if self.response_cache and turn_start == 1:
+            cache_key = self.response_cache.key(prompt, get_system_prompt(user_name=NAME_PLACEHOLDER, stage=self.stage),
+                                                self.turn_model, self._get_available_tools())
+            cached = self.response_cache.get(cache_key, self.user_name)
+            self.turn_cache = "hit" if cached is not None else "miss"
+            if cached is not None:
+                try:
+                    return self._replay_cached_turn(cached)
+                except KeyboardInterrupt as interrupt:
+                    return self._cancel_turn(turn_start, getattr(interrupt, "partial_text", ""))
 
-        try:
-            # Try Anthropic Claude first with retry logic
-            if self.anthropic_client:
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        # Build messages with caching
-                        messages_to_send = self._build_messages_with_cache()
-
-                        # Get available tools for current stage
-                        available_tools = self._get_available_tools()
-
-                        # First call: non-streaming to check for tool use
-                        api_params = {
-                            "model": self.claude_model,
-                            "max_tokens": 1000,
-                            "system": [
-                                {
-                                    "type": "text",
-                                    "text": system_prompt,
-                                    "cache_control": {"type": "ephemeral"}
-                                }
-                            ],
-                            "messages": messages_to_send
-                        }
-
-                        # Only add tools if there are any available
-                        if available_tools:
-                            api_params["tools"] = available_tools
-
-                        response = self.anthropic_client.messages.create(**api_params)
-
-                        # Debug: show token usage and cache info
-                        if self.DEBUG_MODE:
-                            usage = response.usage
-                            print(f"\n[DEBUG] Tokens - Input: {usage.input_tokens}, Output: {usage.output_tokens}", file=sys.stderr)
-                            if hasattr(usage, 'cache_creation_input_tokens'):
-                                print(f"[DEBUG] Cache - Write: {usage.cache_creation_input_tokens}, Read: {usage.cache_read_input_tokens}", file=sys.stderr)
-
-                        # Handle tool use in a loop (allows multiple searches per turn)
-                        max_tool_calls = 3  # Prevent infinite loops
-                        tool_calls = 0
-                        printed_prefix = False  # Track if we've already printed AI:
-
-                        while response.stop_reason == "tool_use" and tool_calls < max_tool_calls:
-                            tool_calls += 1
-
-                            # Print any text content that came before the tool call
-                            # (e.g., "Let me search for that...") with fake streaming
-                            for block in response.content:
-                                if hasattr(block, 'text') and block.text:
-                                    if not printed_prefix:
-                                        print("\nAI: ", end="", flush=True)
-                                        printed_prefix = True
-                                    # Fake streaming effect for pre-tool text
-                                    for char in block.text:
-                                        print(char, end="", flush=True)
-                                        time.sleep(0.01)
-
-                            # Find ALL tool use blocks (model may request multiple parallel searches)
-                            tool_use_blocks = [block for block in response.content if block.type == "tool_use"]
-
-                            if not tool_use_blocks:
-                                break
-
-                            # Execute all tool calls and collect results
-                            tool_results = []
-                            for tool_use_block in tool_use_blocks:
-                                # Debug: show tool call
-                                if self.DEBUG_MODE:
-                                    print(f"\n[DEBUG] Tool call #{tool_calls}: {tool_use_block.name}({tool_use_block.input})", file=sys.stderr)
-                                    print(f"[DEBUG] Tool use ID: {tool_use_block.id}", file=sys.stderr)
-
-                                # Execute the tool
-                                tool_result = self._execute_tool(tool_use_block.name, tool_use_block.input)
-
-                                # Debug: show result preview
-                                if self.DEBUG_MODE:
-                                    preview = tool_result[:100] + "..." if len(tool_result) > 100 else tool_result
-                                    print(f"[DEBUG] Result: {preview}", file=sys.stderr)
-
-                                tool_results.append({
-                                    "type": "tool_result",
-                                    "tool_use_id": tool_use_block.id,
-                                    "content": tool_result
-                                })
-
-                            # Add the assistant's tool request to history
-                            # Convert SDK objects to dicts for serialization
-                            content_dicts = [block.model_dump() for block in response.content]
-
-                            # Debug: verify the tool_use IDs in stored content
-                            if self.DEBUG_MODE:
-                                for cd in content_dicts:
-                                    if cd.get('type') == 'tool_use':
-                                        print(f"[DEBUG] Storing assistant tool_use ID: {cd.get('id')}", file=sys.stderr)
-
-                            self.conversation_history.append({
-                                "role": "assistant",
-                                "content": content_dicts
-                            })
-
-                            # Add ALL tool results in a single user message
-                            self.conversation_history.append({
-                                "role": "user",
-                                "content": tool_results
-                            })
-
-                            # Rebuild messages and check if model wants another tool call
-                            messages_to_send = self._build_messages_with_cache()
-
-                            # Debug: show message structure before sending
-                            if self.DEBUG_MODE:
-                                print(f"[DEBUG] Sending {len(messages_to_send)} messages:", file=sys.stderr)
-                                for j, m in enumerate(messages_to_send):
-                                    content_preview = str(m.get('content', ''))[:50]
-                                    print(f"[DEBUG]   {j}. {m['role']}: {content_preview}...", file=sys.stderr)
-
-                            api_params = {
-                                "model": self.claude_model,
-                                "max_tokens": 1000,
-                                "system": [
-                                    {
-                                        "type": "text",
-                                        "text": system_prompt,
-                                        "cache_control": {"type": "ephemeral"}
-                                    }
-                                ],
-                                "messages": messages_to_send
-                            }
+        # Start likely searches now so a search_knowledge call can skip the search
+        self.retrieval_prefetcher.clear()
+        if self.SPECULATIVE_RETRIEVAL and self.search_tool in self._get_available_tools():
+            self.retrieval_prefetcher.start(prompt, allow_restricted=(self.stage == 3))
 
-                            if available_tools:
-                                api_params["tools"] = available_tools
+        # Wait for this player's fair share of the API when every slot is busy
+        ticket = None
+        try:
+            if self.fair_scheduler:
+                try:
+                    # Roughly four characters per input token
+                    ticket = self.fair_scheduler.acquire(self.user_key, (len(system_prompt) + input_chars) // 4, weight)
+                except KeyboardInterrupt:
+                    # Cancelled while queued - nothing was sent, so forget the turn
+                    return self._cancel_turn(turn_start, "")
+            return self._query_backends(prompt, system_prompt, turn_start, route, cache_key)
+        finally:
+            if self.fair_scheduler:
+                self.fair_scheduler.release(ticket)
+            if self.token_accountant and self.turn_usage:
+                self.turn_cost = self.token_accountant.record(self.turn_model, self.turn_usage)
+
+    def _query_backends(self, prompt, system_prompt, turn_start, route, cache_key):
+        """Try each healthy backend in priority order until one answers"""
+        handlers = {
+            "anthropic": self._query_anthropic,
+            "openai": self._query_openai,
+            "ollama": self._query_ollama
+        }
 
-                            response = self.anthropic_client.messages.create(**api_params)
+        last_backend = None
+        last_error = None
+        for backend in self.backend_router.ordered_backends():
+            if last_backend:
+                self.backend_router.record_failover(last_backend, backend, last_error)
+
+            started = time.time()
+            self.turn_api_seconds = 0.0
+            self.active_backend = backend
+            self._leak_matcher = self.flag_detector.matcher()
+            try:
+                response = handlers[backend](system_prompt)
+            except KeyboardInterrupt as interrupt:
+                # Ctrl-C during generation cancels the turn, not the session
+                return self._cancel_turn(turn_start, getattr(interrupt, "partial_text", ""))
+            except Exception as e:
+                last_backend = backend
+                last_error = e
+                self.backend_router.record_failure(backend, e)
+                print(f"LLM Error ({backend}): {e}", file=sys.stderr)
+                if backend == "anthropic":
+                    self._record_model_route(route, time.time() - started, error=e)
+                # Drop any partial tool exchange so the next backend sees a clean turn
+                del self.conversation_history[turn_start:]
+                self.turn_tool_rounds = []
+                continue
+
+            # Routers compare backends and models on API time, not fake streaming or rendering
+            self.backend_router.record_success(backend, self.turn_api_seconds)
+            self.answer_tokens.append(len(response) // 4)
+            if backend == "anthropic":
+                self._record_model_route(route, self.turn_api_seconds)
+                if cache_key:
+                    self._store_cached_turn(cache_key, turn_start)
+            return response
+
+        self.active_backend = None
+        if last_error is not None:
+            error_msg = str(last_error)
 
-                            # Debug: show token usage
-                            if self.DEBUG_MODE:
-                                usage = response.usage
-                                print(f"[DEBUG] Tokens - Input: {usage.input_tokens}, Output: {usage.output_tokens}", file=sys.stderr)
-                                if hasattr(usage, 'cache_creation_input_tokens'):
-                                    print(f"[DEBUG] Cache - Write: {usage.cache_creation_input_tokens}, Read: {usage.cache_read_input_tokens}", file=sys.stderr)
+            # Provide more helpful message for overload errors
+            if "500" in error_msg or "Overloaded" in error_msg:
+                error_response = "[System overloaded. Please wait a moment and try again.]"
+            else:
+                error_response = self.fallback_response(prompt)
+        else:
+            # Fallback if no LLM available
+            error_response = self.fallback_response(prompt)
 
-                        # After tool loop, stream the final response
-                        if tool_calls > 0:
-                            full_response = ""
-                            if printed_prefix:
-                                print("\n\n", end="", flush=True)  # Just newline, we already printed AI:
-                            else:
-                                print("\nAI: ", end="", flush=True)
+        # Still add to history for consistency
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": error_response
+        })
+        return error_response
+
+    def _replay_cached_turn(self, messages):
+        """Play a cached opening turn through the normal renderer, tool trace included"""
+        self.active_backend = "cache"
+        self._leak_matcher = self.flag_detector.matcher()
+        printed_prefix = False
+        for msg in messages[:-1]:
+            self.conversation_history.append(msg)
+            if msg["role"] != "assistant" or not isinstance(msg["content"], list):
+                continue
+            self.turn_tool_rounds.append(msg["content"])
+            for block in msg["content"]:
+                if block.get("type") == "text" and block.get("text"):
+                    if not printed_prefix:
+                        print("\nAI: ", end="", flush=True)
+                        printed_prefix = True
+                    for char in block["text"]:
+                        print(char, end="", flush=True)
+                        time.sleep(self.PRE_TOOL_TEXT_DELAY)
 
-                            # Make a streaming call for the final response
-                            stream_params = {
-                                "model": self.claude_model,
-                                "max_tokens": 1000,
-                                "system": [
-                                    {
-                                        "type": "text",
-                                        "text": system_prompt,
-                                        "cache_control": {"type": "ephemeral"}
-                                    }
-                                ],
-                                "messages": messages_to_send
-                            }
+        print("\n\n" if printed_prefix else "\nAI: ", end="", flush=True)
+        full_response = self._render_stream(text_chunks(messages[-1]["content"])).strip()
+        print()
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": full_response
+        })
+        return full_response
 
-                            if available_tools:
-                                stream_params["tools"] = available_tools
+    def _store_cached_turn(self, cache_key, turn_start):
+        """Share a finished opening turn, unless any flag appears anywhere in it"""
+        messages = self.conversation_history[turn_start:]
+        if not messages or self.flag_detector.scan(json.dumps(messages)):
+            self.metrics.incr("response_cache_skipped_flag")
+            return
+        self.response_cache.put(cache_key, messages, self.user_name)
 
-                            with self.anthropic_client.messages.stream(**stream_params) as stream:
-                                for text in stream.text_stream:
-                                    print(text, end="", flush=True)
-                                    full_response += text
+    def _record_model_route(self, route, latency, error=None):
+        """Feed a routed turn's outcome back to the model router and log it for tuning"""
+        if not self.model_router or route is None:
+            return
+        self.model_router.record(self.turn_model, latency, error=error is not None,
+                                 tool_rounds=len(self.turn_tool_rounds))
+        self.log_event("model_route", model=self.turn_model, turn=self.turn, latency_ms=round(latency * 1000),
+                       tool_rounds=len(self.turn_tool_rounds), usage=self.turn_usage,
+                       cost_usd=round(estimate_cost(self.turn_model, self.turn_usage), 6),
+                       error=str(error) if error is not None else None, **route)
+
+    def _render_stream(self, chunks, close=None, started=None):
+        """
+        Print streamed text as it arrives and return the full text
+        With started (the request's perf_counter start), time to first token
+        is added to turn_api_seconds - or the whole wait if no text arrives
+        Ctrl-C closes the underlying stream and raises GenerationCancelled
+        """
+        full_response = ""
+        try:
+            for text in chunks:
+                if not text:
+                    continue
+                if started is not None:
+                    self.turn_api_seconds += time.perf_counter() - started
+                    started = None
+                print(text, end="", flush=True)
+                full_response += text
+                self._check_leak(text)
+        except KeyboardInterrupt:
+            if close:
+                try:
+                    close()
+                except Exception:
+                    pass
+            raise GenerationCancelled(full_response)
+        if started is not None:
+            self.turn_api_seconds += time.perf_counter() - started
+        return full_response
+
+    def _check_leak(self, text):
+        """Feed streamed output to the flag detector and record any leak"""
+        if self._leak_matcher is None:
+            return
+        for flag_stage in self._leak_matcher.feed(text):
+            self.metrics.incr("flag_leaked")
+            self.log_event("flag_leaked", flag_stage=flag_stage, turn=self.turn,
+                           backend=self.active_backend, current_stage_flag=(flag_stage == self.stage))
+
+    def _cancel_turn(self, turn_start, partial_text):
+        """Keep history valid after a cancelled generation and record the tokens saved"""
+        partial_text = partial_text.strip()
+        if partial_text:
+            # Completed tool exchanges stay; the partial answer closes the turn
+            self.conversation_history.append({
+                "role": "assistant",
+                "content": partial_text
+            })
+        else:
+            # Nothing usable was generated - forget the turn entirely
+            del self.conversation_history[turn_start - 1:]
+
+        # At a rough 4 chars per token: max_tokens_remaining is the upper bound (the
+        # output budget left), tokens_saved_estimate what this session's median
+        # completed answer would still have generated (unknown before the first one)
+        generated_tokens = len(partial_text) // 4
+        max_tokens_remaining = max(0, self.MAX_OUTPUT_TOKENS - generated_tokens)
+        tokens_saved_estimate = None
+        if self.answer_tokens:
+            typical = sorted(self.answer_tokens)[len(self.answer_tokens) // 2]
+            tokens_saved_estimate = max(0, min(typical, self.MAX_OUTPUT_TOKENS) - generated_tokens)
+            self.metrics.incr("cancel_tokens_saved_estimate", tokens_saved_estimate)
+        self.metrics.incr("generation_cancelled")
+        self.metrics.incr("cancel_max_tokens_remaining", max_tokens_remaining)
+        self.log_event("generation_cancelled", backend=self.active_backend,
+                       partial_chars=len(partial_text), max_tokens_remaining=max_tokens_remaining,
+                       tokens_saved_estimate=tokens_saved_estimate)
+
+        print("\n[Generation cancelled]")
+        return partial_text
+
+    def _create_message(self, api_params):
+        """Non-streaming Anthropic request, timed into turn_api_seconds"""
+        started = time.perf_counter()
+        try:
+            return self.anthropic_client.messages.create(**api_params)
+        finally:
+            self.turn_api_seconds += time.perf_counter() - started
+
+    def _query_anthropic(self, system_prompt):
+        """Anthropic Claude with tool use, prompt caching and retry logic"""
+        turn_start = len(self.conversation_history)
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                # Build messages with caching
+                messages_to_send = self._build_messages_with_cache()
+
+                # Get available tools for current stage
+                available_tools = self._get_available_tools()
+
+                # First call: non-streaming to check for tool use
+                api_params = self._build_api_params(system_prompt, messages_to_send, available_tools, model=self.turn_model)
+                response = self._create_message(api_params)
+                self._record_usage(response.usage, prefix="\n")
+
+                # Handle tool use in a loop (allows multiple searches per turn)
+                max_tool_calls = 3  # Prevent infinite loops
+                tool_calls = 0
+                printed_prefix = False  # Track if we've already printed AI:
+
+                while response.stop_reason == "tool_use" and tool_calls < max_tool_calls:
+                    tool_calls += 1
+
+                    # Print any text content that came before the tool call
+                    # (e.g., "Let me search for that...") with fake streaming
+                    for block in response.content:
+                        if hasattr(block, 'text') and block.text:
+                            if not printed_prefix:
+                                print("\nAI: ", end="", flush=True)
+                                printed_prefix = True
+                            # Fake streaming effect for pre-tool text
+                            for char in block.text:
+                                print(char, end="", flush=True)
+                                time.sleep(self.PRE_TOOL_TEXT_DELAY)
+                            self._check_leak(block.text)
 
-                            print()  # New line after response
+                    # Find ALL tool use blocks (model may request multiple parallel searches)
+                    tool_use_blocks = [block for block in response.content if block.type == "tool_use"]
 
-                            # Add final response to conversation history
-                            self.conversation_history.append({
-                                "role": "assistant",
-                                "content": full_response.strip()
-                            })
+                    if not tool_use_blocks:
+                        break
 
-                            return full_response.strip()
+                    # Execute all tool calls and collect results
+                    self.retrieval_ledger.sync(self.conversation_history)
+                    tool_results = []
+                    for tool_use_block in tool_use_blocks:
+                        # Debug: show tool call
+                        if self.DEBUG_MODE:
+                            print(f"\n[DEBUG] Tool call #{tool_calls}: {tool_use_block.name}({tool_use_block.input})", file=sys.stderr)
+                            print(f"[DEBUG] Tool use ID: {tool_use_block.id}", file=sys.stderr)
 
-                        # No tool use - extract text and we're done
-                        # But we need to stream for UX, so make another streaming call
-                        # (The first call was just to check for tool use)
-                        full_response = ""
-                        print("\nAI: ", end="", flush=True)
+                        # Execute the tool
+                        tool_result = self._execute_tool(tool_use_block.name, tool_use_block.input, tool_use_block.id)
 
-                        stream_params = {
-                            "model": self.claude_model,
-                            "max_tokens": 1000,
-                            "system": [
-                                {
-                                    "type": "text",
-                                    "text": system_prompt,
-                                    "cache_control": {"type": "ephemeral"}
-                                }
-                            ],
-                            "messages": messages_to_send
-                        }
-
-                        if available_tools:
-                            stream_params["tools"] = available_tools
-
-                        with self.anthropic_client.messages.stream(**stream_params) as stream:
-                            for text in stream.text_stream:
-                                print(text, end="", flush=True)
-                                full_response += text
-                            # Get final message for usage stats
-                            final_message = stream.get_final_message()
-
-                        print()  # New line after response
-
-                        # Debug: show token usage for streaming response
+                        # Debug: show result preview
                         if self.DEBUG_MODE:
-                            usage = final_message.usage
-                            print(f"[DEBUG] Tokens - Input: {usage.input_tokens}, Output: {usage.output_tokens}", file=sys.stderr)
-                            if hasattr(usage, 'cache_creation_input_tokens'):
-                                print(f"[DEBUG] Cache - Write: {usage.cache_creation_input_tokens}, Read: {usage.cache_read_input_tokens}", file=sys.stderr)
-
-                        # Add assistant response to conversation history
-                        self.conversation_history.append({
-                            "role": "assistant",
-                            "content": full_response.strip()
+                            preview = tool_result[:100] + "..." if len(tool_result) > 100 else tool_result
+                            print(f"[DEBUG] Result: {preview}", file=sys.stderr)
+
+                        tool_results.append({
+                            "type": "tool_result",
+                            "tool_use_id": tool_use_block.id,
+                            "content": tool_result
                         })
 
-                        return full_response.strip()
-                    except Exception as api_error:
-                        # Check if it's a 500/overload error
-                        if "500" in str(api_error) or "Overloaded" in str(api_error):
-                            if attempt < max_retries - 1:
-                                wait_time = (2 ** attempt)  # Exponential backoff: 1s, 2s, 4s
-                                print(f"\nAPI overloaded, retrying in {wait_time}s... (attempt {attempt + 1}/{max_retries})", file=sys.stderr)
-                                time.sleep(wait_time)
-                                continue
-                        # Re-raise if not a retryable error or last attempt
-                        raise
-            
-            # Try OpenAI (keeping this for compatibility)
-            elif self.openai_client:
-                # OpenAI includes system message in the messages array
-                messages = [{"role": "system", "content": system_prompt}] + self.conversation_history
-                response = self.openai_client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=messages,
-                    max_tokens=1000,
-                    temperature=0.3
-                )
-                assistant_response = response.choices[0].message.content.strip()
+                    # Add the assistant's tool request to history
+                    # Convert SDK objects to dicts for serialization
+                    content_dicts = [block.model_dump() for block in response.content]
+
+                    # Debug: verify the tool_use IDs in stored content
+                    if self.DEBUG_MODE:
+                        for cd in content_dicts:
+                            if cd.get('type') == 'tool_use':
+                                print(f"[DEBUG] Storing assistant tool_use ID: {cd.get('id')}", file=sys.stderr)
+
+                    self.conversation_history.append({
+                        "role": "assistant",
+                        "content": content_dicts
+                    })
+                    self.turn_tool_rounds.append(content_dicts)
+
+                    # Add ALL tool results in a single user message
+                    self.conversation_history.append({
+                        "role": "user",
+                        "content": tool_results
+                    })
+
+                    # Rebuild messages and check if model wants another tool call
+                    messages_to_send = self._build_messages_with_cache()
+
+                    # Debug: show message structure before sending
+                    if self.DEBUG_MODE:
+                        print(f"[DEBUG] Sending {len(messages_to_send)} messages:", file=sys.stderr)
+                        for j, m in enumerate(messages_to_send):
+                            content_preview = str(m.get('content', ''))[:50]
+                            print(f"[DEBUG]   {j}. {m['role']}: {content_preview}...", file=sys.stderr)
+
+                    api_params = self._build_api_params(system_prompt, messages_to_send, available_tools, model=self.turn_model)
+                    response = self._create_message(api_params)
+                    self._record_usage(response.usage)
+
+                # After tool loop, stream the final response
+                # No tool use - we still need to stream for UX, so make another streaming call
+                # (The first call was just to check for tool use)
+                if tool_calls > 0 and printed_prefix:
+                    print("\n\n", end="", flush=True)  # Just newline, we already printed AI:
+                else:
+                    print("\nAI: ", end="", flush=True)
+
+                stream_params = self._build_api_params(system_prompt, messages_to_send, available_tools, model=self.turn_model)
+                stream_started = time.perf_counter()
+                with self.anthropic_client.messages.stream(**stream_params) as stream:
+                    full_response = self._render_stream(stream.text_stream, close=stream.close, started=stream_started)
+                    # Get final message for usage stats
+                    final_message = stream.get_final_message()
+
+                print()  # New line after response
+
+                # Debug: show token usage for streaming response
+                self._record_usage(final_message.usage)
 
                 # Add assistant response to conversation history
                 self.conversation_history.append({
                     "role": "assistant",
-                    "content": assistant_response
+                    "content": full_response.strip()
                 })
 
-                return assistant_response
-            
-            # Try Ollama (keeping this for compatibility)
-            elif self.ollama_host:
-                # Build conversation context for Ollama
-                conversation_text = f"{system_prompt}\n\n"
-                for msg in self.conversation_history[:-1]:  # Exclude the current user message we just added
-                    role = "User" if msg["role"] == "user" else "Assistant"
-                    conversation_text += f"{role}: {msg['content']}\n\n"
-                conversation_text += f"User: {prompt}\n\nAssistant:"
-
-                payload = {
-                    "model": "llama3.2",
-                    "prompt": conversation_text,
-                    "stream": False
-                }
-
-                response = requests.post(f"{self.ollama_host}/api/generate",
-                                    json=payload,
-                                    timeout=30)
-
-                if response.status_code == 200:
-                    assistant_response = response.json().get("response", "").strip()
+                return full_response.strip()
+            except Exception as api_error:
+                # Check if it's a 500/overload error
+                if "500" in str(api_error) or "Overloaded" in str(api_error):
+                    # Only wait out the backoff when there is nowhere else to fail over to
+                    if attempt < max_retries - 1 and not self.backend_router.has_alternative("anthropic"):
+                        wait_time = (2 ** attempt)  # Exponential backoff: 1s, 2s, 4s
+                        print(f"\nAPI overloaded, retrying in {wait_time}s... (attempt {attempt + 1}/{max_retries})", file=sys.stderr)
+                        time.sleep(wait_time)
+                        del self.conversation_history[turn_start:]
+                        self.turn_tool_rounds = []
+                        continue
+                # Re-raise if not a retryable error or last attempt
+                raise
+
+    def _query_openai(self, system_prompt):
+        """OpenAI chat completions (keeping this for compatibility)"""
+        # OpenAI includes system message in the messages array
+        # Tool blocks from an Anthropic session are flattened to text
+        messages = [{"role": "system", "content": system_prompt}] + to_text_messages(self.conversation_history)
+        started = time.perf_counter()
+        stream = self.openai_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=self.MAX_OUTPUT_TOKENS,
+            temperature=0.3,
+            stream=True
+        )
+
+        print("\nAI: ", end="", flush=True)
+        chunks = (chunk.choices[0].delta.content for chunk in stream if chunk.choices)
+        assistant_response = self._render_stream(chunks, close=stream.response.close, started=started).strip()
+        print()
 
-                    # Add assistant response to conversation history
-                    self.conversation_history.append({
-                        "role": "assistant",
-                        "content": assistant_response
-                    })
+        # Add assistant response to conversation history
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": assistant_response
+        })
 
-                    return assistant_response
+        return assistant_response
+
+    def _query_ollama(self, system_prompt):
+        """Ollama chat API with tool use, keeping the model loaded between turns"""
+        available_tools = to_ollama_tools(self._get_available_tools())
+        max_tool_calls = 3  # Prevent infinite loops
+        tool_calls = 0
+
+        print("\nAI: ", end="", flush=True)
+        while True:
+            payload = {
+                "model": self.OLLAMA_MODEL,
+                # The system message leads unchanged every turn, so Ollama can
+                # reuse the evaluated prefix instead of re-reading the whole prompt
+                "messages": [{"role": "system", "content": system_prompt}] + to_ollama_messages(self.conversation_history),
+                "stream": True,
+                "keep_alive": self.ollama_keep_alive,
+                "options": {"num_predict": self.MAX_OUTPUT_TOKENS}
+            }
+            # Once the tool budget is spent the model has to answer
+            if available_tools and tool_calls < max_tool_calls:
+                payload["tools"] = available_tools
+
+            started = time.perf_counter()
+            response = requests.post(f"{self.ollama_host}/api/chat",
+                                     json=payload,
+                                     stream=True,
+                                     timeout=30)
+            response.raise_for_status()
+
+            result = {"tool_calls": [], "done": None}
+            try:
+                text = self._render_stream(self._ollama_chunks(response, result), close=response.close,
+                                           started=started)
+            finally:
+                response.close()
+            self._record_ollama_timing(result["done"], tool_calls)
+
+            if not result["tool_calls"] or tool_calls >= max_tool_calls:
+                break
+            tool_calls += 1
+
+            # Store the round in Anthropic format so history stays valid for every backend
+            content = []
+            if text.strip():
+                content.append({"type": "text", "text": text})
+            for call in result["tool_calls"]:
+                function = call.get("function") or {}
+                arguments = function.get("arguments") or {}
+                if isinstance(arguments, str):
+                    try:
+                        arguments = json.loads(arguments)
+                    except ValueError:
+                        arguments = {}
+                content.append({"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}",
+                                "name": function.get("name", ""), "input": arguments})
+
+            self.retrieval_ledger.sync(self.conversation_history)
+            tool_results = []
+            for block in content:
+                if block["type"] != "tool_use":
+                    continue
+                if self.DEBUG_MODE:
+                    print(f"\n[DEBUG] Tool call #{tool_calls}: {block['name']}({block['input']})", file=sys.stderr)
+                tool_results.append({
+                    "type": "tool_result",
+                    "tool_use_id": block["id"],
+                    "content": self._execute_tool(block["name"], block["input"], block["id"])
+                })
 
-            # Fallback if no LLM available
-            fallback = self.fallback_response(prompt)
-            # Still add to history for consistency
             self.conversation_history.append({
                 "role": "assistant",
-                "content": fallback
+                "content": content
             })
-            return fallback
-            
-        except Exception as e:
-            error_msg = str(e)
-            print(f"LLM Error: {error_msg}", file=sys.stderr)
-
-            # Provide more helpful message for overload errors
-            if "500" in error_msg or "Overloaded" in error_msg:
-                error_response = "[System overloaded. Please wait a moment and try again.]"
-            else:
-                error_response = self.fallback_response(prompt)
-
-            # Add error response to conversation history
+            self.turn_tool_rounds.append(content)
             self.conversation_history.append({
-                "role": "assistant",
-                "content": error_response
+                "role": "user",
+                "content": tool_results
             })
+            if text.strip():
+                print("\n\n", end="", flush=True)
 
-            return error_response
+        assistant_response = text.strip()
+        print()
+
+        # Add assistant response to conversation history
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": assistant_response
+        })
+
+        return assistant_response
+
+    def _ollama_chunks(self, response, result):
+        """
+        Yield streamed text from Ollama's one-JSON-object-per-line stream,
+        collecting tool calls and the final timing object into result
+        """
+        for line in response.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(f"Ollama error: {data['error']}")
+            message = data.get("message") or {}
+            result["tool_calls"].extend(message.get("tool_calls") or [])
+            if data.get("done"):
+                result["done"] = data
+            yield message.get("content", "")
+
+    def _record_ollama_timing(self, done, tool_round):
+        """Report prompt evaluation from Ollama's timing fields (durations are in nanoseconds)"""
+        if not done:
+            return
+        prompt_eval_seconds = done.get("prompt_eval_duration", 0) / 1e9
+        self.metrics.observe("ollama_prompt_eval_seconds", prompt_eval_seconds)
+        self.metrics.incr("ollama_prompt_eval_tokens", done.get("prompt_eval_count", 0))
+        self.log_event("ollama_timing", turn=self.turn, tool_round=tool_round,
+                       prompt_eval_count=done.get("prompt_eval_count", 0),
+                       prompt_eval_ms=round(prompt_eval_seconds * 1000),
+                       eval_count=done.get("eval_count", 0),
+                       eval_ms=round(done.get("eval_duration", 0) / 1e6),
+                       load_ms=round(done.get("load_duration", 0) / 1e6))
+        if self.DEBUG_MODE:
+            print(f"[DEBUG] Ollama prompt eval: {done.get('prompt_eval_count', 0)} tokens "
+                  f"in {prompt_eval_seconds:.2f}s", file=sys.stderr)
 
     def _handle_slash_command(self, command):
         """Handle slash commands without triggering the LLM"""
@@ -676,6 +1238,8 @@ Type /hint for a hint about this stage.
 
         elif cmd == "/reset":
             self.conversation_history = []
+            self.retrieval_ledger.reset()
+            self._save_history()
             return f"""
 Conversation history cleared! The AI has no memory of your previous
 attempts, but you're still on Stage {self.stage}. Good luck with your fresh start!
@@ -782,12 +1346,27 @@ Keep trying! Use /hint if you're stuck.
         print("There are 5 progressively difficult stages. Good luck!")
         print()
         print("─" * 64)
-        print("STAGE 1 of 5: The Warmup (Easy)")
-        print("─" * 64)
-        print()
-        print("This is your introduction to prompt injection. The AI has minimal")
-        print("defenses. See if you can get it to reveal the flag!")
-        print()
+        if self.resumed:
+            stage_names = {
+                1: "The Warmup (Easy)",
+                2: "Basic Resistance (Medium)",
+                3: "Alternate attack surfaces (Hard)",
+                4: "External research (Very Hard)",
+                5: "True Redteam (Expert)"
+            }
+            print(f"STAGE {self.stage} of 5: {stage_names.get(self.stage, 'Unknown')}")
+            print("─" * 64)
+            print()
+            print("Welcome back! Your progress and recent conversation were restored.")
+            print("Use /reset if you'd rather start this stage's conversation fresh.")
+            print()
+        else:
+            print("STAGE 1 of 5: The Warmup (Easy)")
+            print("─" * 64)
+            print()
+            print("This is your introduction to prompt injection. The AI has minimal")
+            print("defenses. See if you can get it to reveal the flag!")
+            print()
         print("Type /help to see available commands, or just start chatting.")
         print()
 
@@ -822,7 +1401,9 @@ Keep trying! Use /hint if you're stuck.
                     # Get LLM response (as AI)
                     # Conversation is tracked inside query_llm()
                     # Note: query_llm now handles printing for streaming responses
+                    turn_started = time.time()
                     response = self.query_llm(user_input)
+                    turn_latency = time.time() - turn_started
 
                     # For non-streaming responses (fallback, errors), print them
                     if response and not response.startswith("[System overloaded"):
@@ -833,7 +1414,8 @@ Keep trying! Use /hint if you're stuck.
                         print(f"\nAI: {response}\n")
 
                     # Log the interaction
-                    self.log_command(user_input, response)
+                    self.log_command(user_input, response, latency=turn_latency)
+                    self._save_history()
                     
                 except KeyboardInterrupt:
                     print("\n\nKeyboard interrupt not supported. To exit, type 'exit' or 'quit'.")
@@ -853,13 +1435,31 @@ Keep trying! Use /hint if you're stuck.
             log_entry = {
                 "timestamp": datetime.now().isoformat(),
                 "session_id": self.session_id,
-                "event": "session_end"
+                "event": "session_end",
+                "metrics": self.metrics.snapshot(),
+                "backends": self.backend_router.status()
             }
+            if self.model_router:
+                log_entry["models"] = self.model_router.status()
+            if self.token_accountant:
+                # Let the last turn's write land so the day's totals include it
+                self.token_accountant.flush()
+                log_entry["usage"] = self.token_accountant.summary()
             
-            with open(f"/app/logs/llm_shell.jsonl", "a") as f:
-                f.write(json.dumps(log_entry) + "\n")
+            self._write_log(log_entry)
         except:
             pass
+        self.profiler.close()
+        self.backend_router.stop()
+        self.retrieval_prefetcher.shutdown()
+        if self.conversation_compactor:
+            self.conversation_compactor.shutdown()
+        if self.response_cache:
+            self.response_cache.shutdown()
+        if self.token_accountant:
+            self.token_accountant.shutdown()
+        if self.progress_store:
+            self.progress_store.close()
 
 if __name__ == "__main__":
     shell = LLMShell()
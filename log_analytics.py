@@ -0,0 +1,394 @@
+"""
+Streaming analytics over the session logs
+
+    python -m log_analytics /app/logs
+    python -m log_analytics /app/logs/llm_shell.jsonl /app/logs/llm_shell.jsonl.1.gz --json
+    python -m log_analytics /app/logs --session session_1700000000_42
+
+Reads llm_shell.jsonl and its rotated segments (.gz, or .zst when the
+zstandard package is installed) line by line, so memory stays flat however
+large the logs grow. Each segment is summarized in its own worker process
+and the partial results are merged: per-stage funnels, turn latency
+percentiles, token usage and time-to-solve per stage.
+
+A sidecar index (<segment>.idx.json) records byte offsets by time and by
+session so --since and --session jump straight to the relevant part of a
+segment instead of scanning it from the top.
+"""
+
+import argparse
+import bisect
+import glob
+import gzip
+import io
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# One time-index entry every this many lines
+INDEX_EVERY = 1000
+INDEX_SUFFIX = ".idx.json"
+SEGMENT_PATTERNS = ("*.jsonl", "*.jsonl.*")
+STAGES = (1, 2, 3, 4, 5)
+
+
+def open_segment(path):
+    """Open a (possibly compressed) log segment as a binary stream"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path}: install the 'zstandard' package to read .zst segments")
+        # The zstd reader has no readline; buffering it gives line iteration
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+    return open(path, "rb")
+
+
+def find_segments(paths):
+    """Expand directories into their log segments, oldest rotation first"""
+    segments = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in SEGMENT_PATTERNS:
+                segments.extend(glob.glob(os.path.join(path, pattern)))
+        else:
+            segments.append(path)
+    segments = [s for s in segments if not s.endswith(INDEX_SUFFIX)]
+    return sorted(set(segments), key=lambda s: os.path.getmtime(s))
+
+
+def parse_time(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def iter_events(path, start_offset=0):
+    """Yield (offset, event) for each JSON line, starting at an uncompressed byte offset"""
+    with open_segment(path) as stream:
+        offset = 0
+        if start_offset:
+            if path.endswith(".zst"):
+                # zstd streams can't seek - skip forward in bounded reads
+                while offset < start_offset:
+                    chunk = stream.read(min(1 << 20, start_offset - offset))
+                    if not chunk:
+                        return
+                    offset += len(chunk)
+            else:
+                stream.seek(start_offset)
+                offset = start_offset
+        for line in stream:
+            line_offset = offset
+            offset += len(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_offset, json.loads(line)
+            except ValueError:
+                continue
+
+
+# ---------------------------------------------------------------------------
+# Sidecar offset index
+# ---------------------------------------------------------------------------
+
+def _index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def load_index(path, rebuild=False):
+    """Return the segment's offset index, (re)building it if missing or stale"""
+    stat = os.stat(path)
+    index_path = _index_path(path)
+    if not rebuild and os.path.exists(index_path):
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            if index.get("size") == stat.st_size and index.get("mtime") == stat.st_mtime:
+                return index
+        except (OSError, ValueError):
+            pass
+    return build_index(path)
+
+
+def build_index(path):
+    """One streaming pass recording (timestamp, offset) checkpoints and session start offsets"""
+    stat = os.stat(path)
+    times = []
+    sessions = {}
+    for line_number, (offset, event) in enumerate(iter_events(path)):
+        session_id = event.get("session_id")
+        if session_id and session_id not in sessions:
+            sessions[session_id] = offset
+        if line_number % INDEX_EVERY == 0:
+            ts = parse_time(event.get("timestamp"))
+            if ts is not None:
+                times.append([ts, offset])
+
+    index = {"size": stat.st_size, "mtime": stat.st_mtime, "times": times, "sessions": sessions}
+    try:
+        with open(_index_path(path), "w") as f:
+            json.dump(index, f)
+    except OSError:
+        # Read-only log directory - the index still works for this run
+        pass
+    return index
+
+
+def seek_offset(index, since=None, session=None):
+    """Uncompressed byte offset to start reading from, or None if nothing can match"""
+    if session is not None:
+        return index["sessions"].get(session)
+    if since is not None and index["times"]:
+        stamps = [ts for ts, _ in index["times"]]
+        # Last checkpoint at or before `since`; lines in between are filtered by time
+        position = bisect.bisect_right(stamps, since) - 1
+        return index["times"][position][1] if position >= 0 else 0
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Mergeable aggregates
+# ---------------------------------------------------------------------------
+
+class Histogram:
+    """Log-bucketed histogram: constant memory, mergeable, ~5% percentile error"""
+    GROWTH = 1.1
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or {}
+
+    def add(self, value):
+        bucket = 0 if value <= 1 else int(math.log(value, self.GROWTH)) + 1
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def count(self):
+        return sum(self.buckets.values())
+
+    def percentile(self, pct):
+        total = self.count()
+        if not total:
+            return None
+        rank = math.ceil(pct / 100.0 * total)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return round(self.GROWTH ** bucket, 1) if bucket else 1.0
+        return None
+
+
+def _empty_session():
+    return {"user": None, "start": None, "end": None, "turns": 0,
+            "first_seen": {}, "solved": {}, "max_stage": 0}
+
+
+def summarize_segment(path, since=None, session=None, rebuild_index=False):
+    """Worker: stream one segment into per-session partials plus latency/token totals"""
+    start_offset = 0
+    if since is not None or session is not None or rebuild_index:
+        index = load_index(path, rebuild=rebuild_index)
+        start_offset = seek_offset(index, since=since, session=session)
+        if start_offset is None:
+            return {"sessions": {}, "latency": {}, "tokens": {}, "events": 0}
+
+    sessions = {}
+    latency = {}
+    tokens = {}
+    events = 0
+    for _, event in iter_events(path, start_offset=start_offset):
+        session_id = event.get("session_id")
+        if session is not None and session_id != session:
+            continue
+        ts = parse_time(event.get("timestamp"))
+        if since is not None and (ts is None or ts < since):
+            continue
+        events += 1
+
+        info = sessions.setdefault(session_id, _empty_session())
+        if ts is not None:
+            info["start"] = ts if info["start"] is None else min(info["start"], ts)
+            info["end"] = ts if info["end"] is None else max(info["end"], ts)
+
+        kind = event.get("event")
+        stage = event.get("stage")
+        if kind == "session_start":
+            info["user"] = event.get("user") or info["user"]
+        if isinstance(stage, int) and ts is not None:
+            key = str(stage)
+            info["first_seen"][key] = min(info["first_seen"].get(key, ts), ts)
+            info["max_stage"] = max(info["max_stage"], stage)
+
+        if kind == "chat":
+            info["turns"] += 1
+            stage_key = str(stage)
+            if event.get("latency_ms") is not None:
+                latency.setdefault(stage_key, Histogram()).add(event["latency_ms"])
+            usage = event.get("usage") or {}
+            stage_tokens = tokens.setdefault(stage_key, {})
+            for field, value in usage.items():
+                if isinstance(value, (int, float)):
+                    stage_tokens[field] = stage_tokens.get(field, 0) + value
+        elif kind == "flag_accepted" and ts is not None and isinstance(event.get("completed_stage"), int):
+            completed = event["completed_stage"]
+            key = str(completed)
+            info["solved"][key] = min(info["solved"].get(key, ts), ts)
+            info["max_stage"] = max(info["max_stage"], min(5, completed + 1))
+        elif kind == "session_end" and session is not None:
+            # The requested session is over - no need to read the rest of the segment
+            break
+
+    return {
+        "sessions": sessions,
+        "latency": {stage: hist.buckets for stage, hist in latency.items()},
+        "tokens": tokens,
+        "events": events
+    }
+
+
+def merge_partials(partials):
+    """Combine per-segment summaries - sessions may span rotated segments"""
+    sessions = {}
+    latency = {}
+    tokens = {}
+    events = 0
+    for partial in partials:
+        events += partial["events"]
+        for stage, buckets in partial["latency"].items():
+            latency.setdefault(stage, Histogram()).merge(Histogram(buckets))
+        for stage, fields in partial["tokens"].items():
+            merged = tokens.setdefault(stage, {})
+            for field, value in fields.items():
+                merged[field] = merged.get(field, 0) + value
+        for session_id, info in partial["sessions"].items():
+            into = sessions.setdefault(session_id, _empty_session())
+            into["user"] = into["user"] or info["user"]
+            for bound, pick in (("start", min), ("end", max)):
+                values = [v for v in (into[bound], info[bound]) if v is not None]
+                into[bound] = pick(values) if values else None
+            into["turns"] += info["turns"]
+            into["max_stage"] = max(into["max_stage"], info["max_stage"])
+            for field in ("first_seen", "solved"):
+                for stage, ts in info[field].items():
+                    into[field][stage] = min(into[field].get(stage, ts), ts)
+    return sessions, latency, tokens, events
+
+
+def build_report(sessions, latency, tokens, events):
+    # Funnel per player when the user is known (progress now persists across sessions)
+    players = {}
+    for session_id, info in sessions.items():
+        player = info["user"] or session_id
+        players[player] = max(players.get(player, 0), info["max_stage"])
+
+    funnel = {str(stage): sum(1 for reached in players.values() if reached >= stage) for stage in STAGES}
+
+    solve_times = {}
+    for info in sessions.values():
+        for stage, solved_at in info["solved"].items():
+            # Fall back to the session start for stages resumed from an earlier session
+            began = info["first_seen"].get(stage, info["start"])
+            if began is not None and solved_at >= began:
+                solve_times.setdefault(stage, Histogram()).add(solved_at - began)
+
+    def summarize(hist):
+        return {"count": hist.count(), "p50": hist.percentile(50),
+                "p95": hist.percentile(95), "p99": hist.percentile(99)}
+
+    return {
+        "events": events,
+        "sessions": len(sessions),
+        "players": len(players),
+        "turns": sum(info["turns"] for info in sessions.values()),
+        "stage_funnel": funnel,
+        "turn_latency_ms": {stage: summarize(hist) for stage, hist in sorted(latency.items())},
+        "tokens": dict(sorted(tokens.items())),
+        "time_to_solve_seconds": {stage: summarize(hist) for stage, hist in sorted(solve_times.items())}
+    }
+
+
+def analyze(paths, workers=None, since=None, session=None, rebuild_index=False):
+    segments = find_segments(paths)
+    if not segments:
+        raise FileNotFoundError(f"No log segments found in {', '.join(paths)}")
+
+    if len(segments) == 1 or workers == 1:
+        partials = [summarize_segment(s, since, session, rebuild_index) for s in segments]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(summarize_segment, s, since, session, rebuild_index) for s in segments]
+            partials = [future.result() for future in futures]
+
+    report = build_report(*merge_partials(partials))
+    report["segments"] = segments
+    return report
+
+
+def print_report(report):
+    print(f"Segments: {len(report['segments'])}  Events: {report['events']}  "
+          f"Sessions: {report['sessions']}  Players: {report['players']}  Turns: {report['turns']}")
+    print()
+    print("Stage funnel (players reaching each stage):")
+    for stage, count in report["stage_funnel"].items():
+        print(f"  Stage {stage}: {count}")
+    print()
+    print("Turn latency (ms):")
+    for stage, stats in report["turn_latency_ms"].items():
+        print(f"  Stage {stage}: n={stats['count']} p50={stats['p50']} p95={stats['p95']} p99={stats['p99']}")
+    print()
+    print("Tokens:")
+    for stage, fields in report["tokens"].items():
+        totals = ", ".join(f"{field}={value}" for field, value in sorted(fields.items()))
+        print(f"  Stage {stage}: {totals}")
+    print()
+    print("Time to solve (s):")
+    for stage, stats in report["time_to_solve_seconds"].items():
+        print(f"  Stage {stage}: n={stats['count']} p50={stats['p50']} p95={stats['p95']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Streaming analytics over llm_shell session logs")
+    parser.add_argument("paths", nargs="*", default=["/app/logs"],
+                        help="Log segments or directories (default: /app/logs)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--since", help="Only events at or after this ISO timestamp")
+    parser.add_argument("--session", help="Only this session_id")
+    parser.add_argument("--reindex", action="store_true", help="Rebuild the sidecar offset indexes")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    since = parse_time(args.since) if args.since else None
+    if args.since and since is None:
+        parser.error(f"Invalid --since timestamp: {args.since}")
+
+    try:
+        report = analyze(args.paths, workers=args.workers, since=since,
+                         session=args.session, rebuild_index=args.reindex)
+    except (FileNotFoundError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Lightweight in-process metrics for a shell session
+Counters and timing observations, snapshotted into the session logs
+"""
+
+import math
+import threading
+
+
+class SessionMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}
+
+    def incr(self, name, amount=1):
+        """Increment a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        """Record a timing (or any numeric) observation"""
+        with self._lock:
+            self.timings.setdefault(name, []).append(value)
+
+    def get(self, name, default=0):
+        """Return the current value of a counter"""
+        with self._lock:
+            return self.counters.get(name, default)
+
+    def snapshot(self):
+        """
+        Return a JSON-serializable view of all metrics
+        Timings are summarized as count/mean/p50/p95/max
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            timings = {name: list(values) for name, values in self.timings.items()}
+
+        summary = {}
+        for name, values in timings.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            summary[name] = {
+                'count': len(ordered),
+                'mean': round(sum(ordered) / len(ordered), 4),
+                'p50': round(percentile(ordered, 50), 4),
+                'p95': round(percentile(ordered, 95), 4),
+                'max': round(ordered[-1], 4)
+            }
+
+        return {'counters': counters, 'timings': summary}
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile over an already sorted list"""
+    if not ordered:
+        return 0
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
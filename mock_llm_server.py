@@ -0,0 +1,324 @@
+"""
+Mock Anthropic / Ollama HTTP server for load testing
+Speaks enough of the Anthropic Messages API (JSON and SSE streaming,
+tool_use) and the Ollama API for LLMShell to run against it unchanged:
+
+    python mock_llm_server.py --port 8900 --latency 0.4 --tokens-per-second 80 --error-500 0.02
+    ANTHROPIC_API_KEY=mock ANTHROPIC_BASE_URL=http://127.0.0.1:8900 python llm_shell.py
+
+Latency, streaming rate, tool_use rate and injected errors (500, 429,
+529 overloaded) are configurable.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOREM = ("The archives hold many curious facts about animals, food, history, space and technology. "
+         "Ask about any of them and I will do my best to help you find what you are looking for. ")
+
+
+class MockConfig:
+    def __init__(self, latency=0.3, tokens_per_second=100.0, response_tokens=60,
+                 tool_use_rate=0.5, error_500=0.0, error_429=0.0, overloaded=0.0, seed=None):
+        # Seconds before the first byte of every response
+        self.latency = latency
+        # Streaming speed; 0 sends everything at once
+        self.tokens_per_second = tokens_per_second
+        # Words in each generated answer
+        self.response_tokens = response_tokens
+        # Chance of answering with tool_use when tools are offered
+        self.tool_use_rate = tool_use_rate
+        # Chances of injected failures
+        self.error_500 = error_500
+        self.error_429 = error_429
+        self.overloaded = overloaded
+        self.rng = random.Random(seed)
+        self.seed_bits = seed or 0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def roll(self):
+        with self.lock:
+            return self.rng.random()
+
+
+def estimate_tokens(payload):
+    return max(1, len(json.dumps(payload)) // 4)
+
+
+def answer_words(config):
+    words = LOREM.split()
+    return [words[i % len(words)] for i in range(config.response_tokens)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # -- plumbing ---------------------------------------------------------
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        # No Content-Length: close the connection to mark the end of the stream
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _pace(self):
+        if self.config.tokens_per_second:
+            time.sleep(1.0 / self.config.tokens_per_second)
+
+    def _inject_error(self):
+        """Maybe answer with an injected failure; returns True if one was sent"""
+        config = self.config
+        roll = config.roll()
+        for chance, status, kind, message in (
+                (config.error_500, 500, "api_error", "Internal server error"),
+                (config.error_429, 429, "rate_limit_error", "Rate limited"),
+                (config.overloaded, 529, "overloaded_error", "Overloaded")):
+            if roll < chance:
+                with config.lock:
+                    config.errors += 1
+                headers = {"retry-after": "1"} if status == 429 else None
+                self._send_json(status, {"type": "error", "error": {"type": kind, "message": message}}, headers)
+                return True
+            roll -= chance
+        return False
+
+    # -- routes -----------------------------------------------------------
+
+    def do_GET(self):
+        if self.path.startswith("/v1/models"):
+            self._send_json(200, {"data": [{"type": "model", "id": "mock-model", "display_name": "Mock",
+                                            "created_at": "2025-01-01T00:00:00Z"}],
+                                  "has_more": False, "first_id": "mock-model", "last_id": "mock-model"})
+        elif self.path.startswith("/api/tags"):
+            self._send_json(200, {"models": [{"name": "llama3.2"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        with self.config.lock:
+            self.config.requests += 1
+        payload = self._read_json()
+        time.sleep(self.config.latency)
+        if self._inject_error():
+            return
+
+        if self.path.startswith("/v1/messages"):
+            self._anthropic_messages(payload)
+        elif self.path.startswith("/api/generate"):
+            self._ollama_generate(payload)
+        elif self.path.startswith("/api/chat"):
+            self._ollama_chat(payload)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    # -- Anthropic --------------------------------------------------------
+
+    def _wants_tool(self, payload):
+        if not payload.get("tools"):
+            return False
+        last_message = (payload.get("messages") or [{}])[-1]
+        last = last_message.get("content")
+        # Answer after a tool round instead of looping forever
+        if last_message.get("role") == "tool":
+            return False
+        if isinstance(last, list) and any(b.get("type") == "tool_result" for b in last if isinstance(b, dict)):
+            return False
+        # Decide from the conversation itself so the shell's create() probe and the
+        # follow-up stream() of the same messages get the same kind of answer
+        digest = hashlib.sha256(json.dumps(payload.get("messages"), sort_keys=True).encode("utf-8")).hexdigest()
+        return random.Random(int(digest[:16], 16) ^ self.config.seed_bits).random() < self.config.tool_use_rate
+
+    def _anthropic_messages(self, payload):
+        input_tokens = estimate_tokens(payload)
+        model = payload.get("model", "mock-model")
+        message_id = f"msg_{uuid.uuid4().hex[:24]}"
+
+        if self._wants_tool(payload):
+            tool = payload["tools"][0]
+            content = [
+                {"type": "text", "text": "Let me search for that."},
+                {"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}", "name": tool["name"],
+                 "input": {"query": "tardigrades"}}
+            ]
+            stop_reason = "tool_use"
+        else:
+            content = [{"type": "text", "text": " ".join(answer_words(self.config))}]
+            stop_reason = "end_turn"
+        output_tokens = self.config.response_tokens
+
+        if not payload.get("stream"):
+            self._send_json(200, {
+                "id": message_id, "type": "message", "role": "assistant", "model": model,
+                "content": content, "stop_reason": stop_reason, "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                          "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+            })
+            return
+
+        self._start_stream("text/event-stream")
+        self._sse("message_start", {"type": "message_start", "message": {
+            "id": message_id, "type": "message", "role": "assistant", "model": model, "content": [],
+            "stop_reason": None, "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": 1,
+                      "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}}})
+        for index, block in enumerate(content):
+            if block["type"] == "text":
+                self._sse("content_block_start", {"type": "content_block_start", "index": index,
+                                                  "content_block": {"type": "text", "text": ""}})
+                for word in block["text"].split(" "):
+                    self._pace()
+                    self._sse("content_block_delta", {"type": "content_block_delta", "index": index,
+                                                      "delta": {"type": "text_delta", "text": word + " "}})
+            else:
+                self._sse("content_block_start", {"type": "content_block_start", "index": index,
+                                                  "content_block": dict(block, input={})})
+                self._sse("content_block_delta", {"type": "content_block_delta", "index": index,
+                                                  "delta": {"type": "input_json_delta",
+                                                            "partial_json": json.dumps(block["input"])}})
+            self._sse("content_block_stop", {"type": "content_block_stop", "index": index})
+        self._sse("message_delta", {"type": "message_delta",
+                                    "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                                    "usage": {"output_tokens": output_tokens}})
+        self._sse("message_stop", {"type": "message_stop"})
+
+    def _sse(self, event, data):
+        try:
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream
+            pass
+
+    # -- Ollama -----------------------------------------------------------
+
+    def _ollama_generate(self, payload):
+        words = answer_words(self.config)
+        if not payload.get("stream", True):
+            self._send_json(200, {"model": payload.get("model"), "response": " ".join(words), "done": True})
+            return
+
+        self._start_stream("application/x-ndjson")
+        try:
+            for word in words:
+                self._pace()
+                self.wfile.write((json.dumps({"response": word + " ", "done": False}) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write((json.dumps({"response": "", "done": True,
+                                          "prompt_eval_count": estimate_tokens(payload),
+                                          "eval_count": len(words)}) + "\n").encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _ollama_chat(self, payload):
+        words = answer_words(self.config)
+        tool_calls = []
+        if self._wants_tool(payload):
+            words = "Let me search for that.".split()
+            tool_calls = [{"function": {"name": payload["tools"][0]["function"]["name"],
+                                        "arguments": {"query": "tardigrades"}}}]
+        prompt_tokens = estimate_tokens(payload)
+        # Timing fields as Ollama reports them, in nanoseconds
+        done = {"done": True, "done_reason": "stop", "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": prompt_tokens * 100000, "eval_count": len(words),
+                "eval_duration": int(len(words) * 1e9 / (self.config.tokens_per_second or 1000)),
+                "load_duration": 0}
+
+        if not payload.get("stream", True):
+            message = {"role": "assistant", "content": " ".join(words)}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            self._send_json(200, dict(done, model=payload.get("model"), message=message))
+            return
+
+        self._start_stream("application/x-ndjson")
+        try:
+            for word in words:
+                self._pace()
+                self._ndjson({"message": {"role": "assistant", "content": word + " "}, "done": False})
+            if tool_calls:
+                self._ndjson({"message": {"role": "assistant", "content": "", "tool_calls": tool_calls},
+                              "done": False})
+            self._ndjson(dict(done, message={"role": "assistant", "content": ""}))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _ndjson(self, data):
+        self.wfile.write((json.dumps(data) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+def start_server(config, host="127.0.0.1", port=0):
+    """Start the mock server in a background thread; returns (server, base_url)"""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds before each response starts")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="Streaming rate (0 = instant)")
+    parser.add_argument("--response-tokens", type=int, default=60, help="Words per generated answer")
+    parser.add_argument("--tool-use-rate", type=float, default=0.5, help="Chance of tool_use when tools are sent")
+    parser.add_argument("--error-500", type=float, default=0.0, help="Chance of an injected 500")
+    parser.add_argument("--error-429", type=float, default=0.0, help="Chance of an injected 429")
+    parser.add_argument("--overloaded", type=float, default=0.0, help="Chance of an injected 529 overloaded")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+
+
+def config_from_args(args):
+    return MockConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                      response_tokens=args.response_tokens, tool_use_rate=args.tool_use_rate,
+                      error_500=args.error_500, error_429=args.error_429,
+                      overloaded=args.overloaded, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Anthropic/Ollama server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server, url = start_server(config_from_args(args), host=args.host, port=args.port)
+    print(f"Mock LLM server listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
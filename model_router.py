@@ -0,0 +1,130 @@
+"""
+Per-turn Claude model selection
+Each turn starts from the model its stage calls for and moves to the other
+model when the preferred one is failing or is predicted to miss the p95
+latency target for this turn's shape (input size, tool loop). The choice
+is pinned for the whole turn - tool loop, final stream and retries - so
+tool_use ids and prompt caching stay consistent within a turn.
+"""
+
+import threading
+from collections import deque
+
+from metrics import percentile
+
+# USD per million tokens: (input, output), matched by model family
+MODEL_PRICES = {
+    "haiku": (1.0, 5.0),
+    "sonnet": (3.0, 15.0),
+    "opus": (15.0, 75.0)
+}
+# Prompt cache writes and reads relative to the base input price
+CACHE_WRITE_MULTIPLIER = 1.25
+CACHE_READ_MULTIPLIER = 0.1
+
+
+def estimate_cost(model, usage):
+    """USD cost of a usage dict (input/output/cache write/cache read tokens)"""
+    input_price, output_price = next(
+        (prices for family, prices in MODEL_PRICES.items() if family in (model or "")), MODEL_PRICES["sonnet"])
+    cost = (usage.get("input_tokens", 0) * input_price
+            + usage.get("output_tokens", 0) * output_price
+            + usage.get("cache_creation_input_tokens", 0) * input_price * CACHE_WRITE_MULTIPLIER
+            + usage.get("cache_read_input_tokens", 0) * input_price * CACHE_READ_MULTIPLIER)
+    return cost / 1_000_000
+
+
+class ModelRouter:
+    # Stages whose defenses get the strong model; the rest use the fast one
+    STRONG_STAGES = (4, 5)
+    # Per-turn latency target the policy routes around
+    P95_TARGET_SECONDS = 10.0
+    # Recent turns per model used for latency and error rates
+    WINDOW = 20
+    # Turns needed before a model's history is trusted
+    MIN_SAMPLES = 5
+    # Error rate at which a model is avoided while the other is healthy
+    MAX_ERROR_RATE = 0.3
+    # A tool loop costs at least one more round trip than a plain answer
+    TOOL_LATENCY_FACTOR = 2.0
+    # Requests longer than this are predicted to take proportionally longer
+    LONG_INPUT_CHARS = 8000
+
+    def __init__(self, fast_model, strong_model, metrics=None):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._latencies = {fast_model: deque(maxlen=self.WINDOW), strong_model: deque(maxlen=self.WINDOW)}
+        self._outcomes = {fast_model: deque(maxlen=self.WINDOW), strong_model: deque(maxlen=self.WINDOW)}
+
+    def stage_model(self, stage):
+        return self.strong_model if stage in self.STRONG_STAGES else self.fast_model
+
+    def _other(self, model):
+        return self.fast_model if model == self.strong_model else self.strong_model
+
+    def choose(self, stage, input_chars, has_tools):
+        """Return (model, reason) for a new turn"""
+        preferred = self.stage_model(stage)
+        alternative = self._other(preferred)
+
+        if self._error_rate(preferred) >= self.MAX_ERROR_RATE > self._error_rate(alternative):
+            model, reason = alternative, "error_rate"
+        else:
+            predicted = self.predict_latency(preferred, input_chars, has_tools)
+            fallback = self.predict_latency(alternative, input_chars, has_tools)
+            if (predicted is not None and predicted > self.P95_TARGET_SECONDS
+                    and (fallback is None or fallback < predicted)
+                    and self._error_rate(alternative) < self.MAX_ERROR_RATE):
+                model, reason = alternative, "latency"
+            else:
+                model, reason = preferred, "stage"
+
+        if self.metrics:
+            self.metrics.incr(f"model_route_{reason}")
+        return model, reason
+
+    def predict_latency(self, model, input_chars, has_tools):
+        """Recent p95 per-round latency scaled to this turn's shape, or None without enough history"""
+        with self._lock:
+            latencies = sorted(self._latencies[model])
+        if len(latencies) < self.MIN_SAMPLES:
+            return None
+        predicted = percentile(latencies, 95)
+        if has_tools:
+            predicted *= self.TOOL_LATENCY_FACTOR
+        if input_chars > self.LONG_INPUT_CHARS:
+            predicted *= input_chars / self.LONG_INPUT_CHARS
+        return predicted
+
+    def _error_rate(self, model):
+        with self._lock:
+            outcomes = list(self._outcomes[model])
+        if len(outcomes) < self.MIN_SAMPLES:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    def record(self, model, latency=None, error=False, tool_rounds=0):
+        """
+        Record a turn's outcome on the model that served it
+        Latency is kept per round so tool and plain turns are comparable
+        """
+        if model not in self._outcomes:
+            return
+        with self._lock:
+            self._outcomes[model].append(not error)
+            if latency is not None and not error:
+                self._latencies[model].append(latency / (1 + tool_rounds))
+
+    def status(self):
+        status = {}
+        for model in (self.fast_model, self.strong_model):
+            with self._lock:
+                latencies = sorted(self._latencies[model])
+            status[model] = {
+                "turns": len(self._outcomes[model]),
+                "error_rate": round(self._error_rate(model), 3),
+                "p95_round_seconds": round(percentile(latencies, 95), 3) if latencies else None
+            }
+        return status
@@ -0,0 +1,177 @@
+"""
+Operator-only profiling of a live shell process
+
+    LLM_SHELL_PROFILE=1            profile from the start of the session
+    kill -USR1 <pid>               start / stop cProfile
+    kill -USR2 <pid>               tracemalloc snapshot (the first one starts tracing)
+
+cProfile covers the wrapped entry points (query_llm and KnowledgeBase.search,
+including searches on the prefetch thread). Stopping writes a .pstats file
+and a text summary. Each later snapshot writes a diff against the previous
+one, plus the size of the conversation history and the search indexes. The
+signal handlers only hand work to a background thread, so the player's turn
+carries on undisturbed.
+"""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+
+PROFILE_ENV = "LLM_SHELL_PROFILE"
+# Stack depth recorded per allocation once tracing starts
+TRACEMALLOC_FRAMES = 10
+# Lines in the text reports
+REPORT_LINES = 30
+
+
+class Profiler:
+    def __init__(self, profile_dir, session_id, memory_sizes=None, on_event=None):
+        self.profile_dir = profile_dir
+        self.session_id = session_id
+        self.memory_sizes = memory_sizes
+        self.on_event = on_event
+        self.enabled = False
+        self.skipped_calls = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._started_at = None
+        self._snapshot = None
+
+    def install(self):
+        """Register the signal handlers; returns False outside the main thread"""
+        try:
+            signal.signal(signal.SIGUSR1, self._on_toggle_signal)
+            signal.signal(signal.SIGUSR2, self._on_snapshot_signal)
+        except (ValueError, AttributeError, OSError):
+            return False
+        if os.getenv(PROFILE_ENV) == "1":
+            self.start()
+        return True
+
+    def wrap(self, func):
+        """Profile calls to func while profiling is on; nested calls join the outer profile"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or getattr(self._local, "active", False):
+                return func(*args, **kwargs)
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another thread's profile is active (one profiler per process on 3.12+)
+                self.skipped_calls += 1
+                return func(*args, **kwargs)
+            self._local.active = True
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                self._local.active = False
+                with self._lock:
+                    self._profiles.append(profile)
+        return wrapper
+
+    # -- cProfile -------------------------------------------------------------
+
+    def start(self):
+        self.enabled = True
+        self._started_at = time.time()
+        self._event("profiling_started")
+
+    def stop(self):
+        """Stop profiling and write what was collected"""
+        self.enabled = False
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        if not profiles:
+            self._event("profiling_stopped", calls=0)
+            return None
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        path = self._path("pstats")
+        stats.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(path, stream=summary).sort_stats("cumulative").print_stats(REPORT_LINES)
+        self._write(path[:-len(".pstats")] + ".txt", summary.getvalue())
+        self._event("profiling_stopped", calls=len(profiles), skipped_calls=self.skipped_calls,
+                    seconds=round(time.time() - self._started_at, 1), path=path)
+        return path
+
+    def close(self):
+        """Flush an active profile at session end"""
+        if self.enabled:
+            self.stop()
+
+    # -- tracemalloc ----------------------------------------------------------
+
+    def snapshot(self):
+        """Start tracing on the first call; afterwards write a diff against the previous snapshot"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._snapshot = tracemalloc.take_snapshot()
+            self._event("tracemalloc_started")
+            return None
+
+        current = tracemalloc.take_snapshot()
+        lines = [f"Session {self.session_id} at {time.strftime('%Y-%m-%d %H:%M:%S')}"]
+        traced, peak = tracemalloc.get_traced_memory()
+        lines.append(f"Traced memory: {traced / 1024:.1f} KiB (peak {peak / 1024:.1f} KiB)")
+        if self.memory_sizes:
+            lines.append("")
+            lines.append("State sizes:")
+            for name, value in self.memory_sizes().items():
+                lines.append(f"  {name}: {value}")
+        lines.append("")
+        lines.append("By file:")
+        lines.extend(f"  {stat}" for stat in current.statistics("filename")[:10])
+        lines.append("")
+        lines.append("Growth since the previous snapshot:")
+        lines.extend(f"  {stat}" for stat in current.compare_to(self._snapshot, "lineno")[:REPORT_LINES])
+        self._snapshot = current
+
+        path = self._path("memory.txt")
+        self._write(path, "\n".join(lines) + "\n")
+        self._event("tracemalloc_snapshot", traced_bytes=traced, path=path)
+        return path
+
+    # -- plumbing -------------------------------------------------------------
+
+    def _on_toggle_signal(self, signum, frame):
+        # Keep the handler trivial: the work happens off the interrupted thread
+        self._in_background(self.stop if self.enabled else self.start)
+
+    def _on_snapshot_signal(self, signum, frame):
+        self._in_background(self.snapshot)
+
+    def _in_background(self, func):
+        threading.Thread(target=self._run_quietly, args=(func,), name="profiler", daemon=True).start()
+
+    def _run_quietly(self, func):
+        try:
+            func()
+        except Exception as e:
+            self._event("profiling_error", error=str(e))
+
+    def _path(self, suffix):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.profile_dir, f"{self.session_id}_{stamp}.{suffix}")
+
+    @staticmethod
+    def _write(path, text):
+        with open(path, "w") as f:
+            f.write(text)
+
+    def _event(self, event, **fields):
+        if self.on_event:
+            self.on_event(event, **fields)
@@ -0,0 +1,162 @@
+"""
+Persistent player progress in an embedded SQLite database
+WAL mode lets every SSH session read while one writes, and all writes go
+through a background thread so a slow disk never delays a turn.
+"""
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_name TEXT PRIMARY KEY,
+    stage INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stage_progress (
+    user_name TEXT NOT NULL,
+    stage INTEGER NOT NULL,
+    session_id TEXT,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (user_name, stage)
+);
+CREATE TABLE IF NOT EXISTS history_snapshots (
+    user_name TEXT PRIMARY KEY,
+    stage INTEGER NOT NULL,
+    history BLOB NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL + NORMAL only risks the last transaction on power loss, never corruption
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def pack_history(history):
+    return zlib.compress(json.dumps(history, separators=(',', ':')).encode('utf-8'))
+
+
+def unpack_history(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+class ProgressStore:
+    # Seconds close() waits for queued writes to land
+    FLUSH_TIMEOUT = 2
+
+    def __init__(self, path, metrics=None):
+        self.path = path
+        self.metrics = metrics
+        conn = _connect(path)
+        try:
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="progress-writer", daemon=True)
+        self._writer.start()
+
+    def load(self, user_name):
+        """
+        Return (stage, history) for a user, or (None, []) if unknown
+        History is only returned if it belongs to the user's current stage
+        """
+        conn = _connect(self.path)
+        try:
+            row = conn.execute(
+                "SELECT u.stage, h.stage, h.history FROM users u "
+                "LEFT JOIN history_snapshots h ON h.user_name = u.user_name "
+                "WHERE u.user_name = ?", (user_name,)).fetchone()
+        finally:
+            conn.close()
+
+        if row is None:
+            return None, []
+        stage, history_stage, blob = row
+        history = unpack_history(blob) if blob is not None and history_stage == stage else []
+        return stage, history
+
+    def save_stage(self, user_name, stage):
+        self._queue.put(("stage", user_name, stage, time.time()))
+
+    def record_stage_complete(self, user_name, stage, session_id):
+        self._queue.put(("complete", user_name, stage, session_id, time.time()))
+
+    def save_history(self, user_name, stage, history):
+        """Queue a history snapshot; only the latest queued snapshot per user is written"""
+        self._queue.put(("history", user_name, stage, pack_history(history), time.time()))
+
+    def close(self):
+        """Flush pending writes (bounded by FLUSH_TIMEOUT) and stop the writer"""
+        self._queue.put(None)
+        self._writer.join(self.FLUSH_TIMEOUT)
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        try:
+            running = True
+            while running:
+                batch = [self._queue.get()]
+                # Drain whatever else is waiting so it lands in one transaction
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in batch:
+                    running = False
+                    batch = [item for item in batch if item is not None]
+                if batch:
+                    self._write_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn, batch):
+        # Older snapshots in the same batch are superseded
+        latest_history = {}
+        for item in batch:
+            if item[0] == "history":
+                latest_history[item[1]] = item
+
+        started = time.perf_counter()
+        try:
+            with conn:
+                for item in batch:
+                    kind = item[0]
+                    if kind == "stage":
+                        _, user_name, stage, now = item
+                        conn.execute(
+                            "INSERT INTO users (user_name, stage, updated_at) VALUES (?, ?, ?) "
+                            "ON CONFLICT(user_name) DO UPDATE SET stage = excluded.stage, "
+                            "updated_at = excluded.updated_at", (user_name, stage, now))
+                    elif kind == "complete":
+                        _, user_name, stage, session_id, now = item
+                        conn.execute(
+                            "INSERT OR IGNORE INTO stage_progress (user_name, stage, session_id, completed_at) "
+                            "VALUES (?, ?, ?, ?)", (user_name, stage, session_id, now))
+                    elif kind == "history" and latest_history.get(item[1]) is item:
+                        _, user_name, stage, blob, now = item
+                        conn.execute(
+                            "INSERT INTO history_snapshots (user_name, stage, history, updated_at) "
+                            "VALUES (?, ?, ?, ?) ON CONFLICT(user_name) DO UPDATE SET "
+                            "stage = excluded.stage, history = excluded.history, "
+                            "updated_at = excluded.updated_at", (user_name, stage, blob, now))
+        except sqlite3.Error:
+            if self.metrics:
+                self.metrics.incr("progress_write_errors")
+            return
+
+        if self.metrics:
+            self.metrics.observe("progress_write_seconds", time.perf_counter() - started)
@@ -0,0 +1,155 @@
+"""
+Shared cache of opening-turn responses
+Right after a stage starts, many players send nearly the same first
+message. With history empty the request is fully determined by the stage's
+system prompt, the model, the tools and the message, so a response (with
+its tool trace) can be stored once in a local SQLite file and replayed to
+every session that asks the same thing within the TTL.
+
+The player's name is part of the system prompt and often of the answer;
+both are keyed and stored with a placeholder so players share entries.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from progress_store import _connect
+
+NAME_PLACEHOLDER = "{{player_name}}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    cache_key TEXT PRIMARY KEY,
+    messages TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+def normalize_input(text):
+    """Case, spacing and trailing punctuation don't change an opening message"""
+    return " ".join(text.lower().split()).rstrip(" .!?")
+
+
+def text_chunks(text):
+    """Split text into word-sized chunks for the streaming renderer"""
+    return re.findall(r"\s*\S+|\s+", text)
+
+
+def _word_pattern(word):
+    return re.compile(r"\b" + re.escape(word) + r"\b")
+
+
+def _replace_name(messages, old, new):
+    # Only the exact rendered name: "Chase" is the player, "chase" is a word
+    pattern = re.compile(re.escape(old)) if old == NAME_PLACEHOLDER else _word_pattern(old)
+    return json.loads(pattern.sub(lambda match: new, json.dumps(messages)))
+
+
+class ResponseCache:
+    # Seconds an entry is served after it was stored
+    TTL_SECONDS = 600
+    # Entries kept; the least recently used are evicted beyond this
+    MAX_ENTRIES = 500
+    # Shorter names can't be told apart from ordinary words in a response
+    MIN_NAME_CHARS = 3
+
+    def __init__(self, path, metrics=None):
+        self.path = path
+        self.metrics = metrics
+        conn = _connect(path)
+        try:
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+        # Stores and hit bookkeeping happen off the turn path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-cache")
+
+    @staticmethod
+    def key(text, system_template, model, tools):
+        parts = {
+            "input": normalize_input(text),
+            "system": hashlib.sha256(system_template.encode('utf-8')).hexdigest(),
+            "model": model,
+            "tools": hashlib.sha256(json.dumps(tools, sort_keys=True).encode('utf-8')).hexdigest()
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key, user_name):
+        """Cached turn messages personalized for user_name, or None"""
+        try:
+            conn = _connect(self.path)
+            try:
+                row = conn.execute("SELECT messages FROM responses WHERE cache_key = ? AND created_at >= ?",
+                                   (key, time.time() - self.TTL_SECONDS)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            row = None
+
+        if row is None:
+            self._incr("response_cache_miss")
+            return None
+        self._incr("response_cache_hit")
+        self._executor.submit(self._touch, key)
+        return _replace_name(json.loads(row[0]), NAME_PLACEHOLDER, user_name)
+
+    def put(self, key, messages, user_name):
+        """Store a finished turn (tool rounds and final answer) in the background"""
+        text = json.dumps(messages)
+        # A name that the turn also uses as an ordinary word can't be told apart from it
+        if (len(user_name) < self.MIN_NAME_CHARS or user_name.lower() == user_name
+                or _word_pattern(user_name.lower()).search(text)):
+            self._incr("response_cache_skipped")
+            return
+        stored = json.dumps(_replace_name(messages, user_name, NAME_PLACEHOLDER))
+        self._executor.submit(self._store, key, stored)
+        self._incr("response_cache_stored")
+
+    def _store(self, key, stored):
+        now = time.time()
+        try:
+            conn = _connect(self.path)
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT INTO responses (cache_key, messages, created_at, last_used) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(cache_key) DO UPDATE SET messages = excluded.messages, "
+                        "created_at = excluded.created_at, last_used = excluded.last_used",
+                        (key, stored, now, now))
+                    conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.TTL_SECONDS,))
+                    conn.execute(
+                        "DELETE FROM responses WHERE cache_key IN (SELECT cache_key FROM responses "
+                        "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.MAX_ENTRIES,))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            self._incr("response_cache_write_errors")
+
+    def _touch(self, key):
+        try:
+            conn = _connect(self.path)
+            try:
+                with conn:
+                    conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE cache_key = ?",
+                                 (time.time(), key))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+    def shutdown(self):
+        # Let a pending store land; it is a single small transaction
+        self._executor.shutdown(wait=True)
+
+    def _incr(self, name):
+        if self.metrics:
+            self.metrics.incr(name)
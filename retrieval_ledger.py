@@ -0,0 +1,126 @@
+"""
+Per-session ledger of knowledge base sections already delivered to the model
+Sections that are still visible in the live conversation history are sent
+again only as short back-references, and the total retrieved text kept in
+the history window is held under a character budget, as far as that can be
+done without rewriting the prompt-cached part of the history.
+"""
+
+import hashlib
+
+
+def section_id(result):
+    """
+    Stable id for the text a search() result delivered
+    Snippets depend on the query, so a different window of the same section
+    gets a different id and is sent in full
+    """
+    score, title, content, source = result
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+    return f"{source}:{title}:{digest}"
+
+
+class RetrievalLedger:
+    # Maximum characters of retrieved content kept in the live history window
+    MAX_LIVE_CHARS = 8000
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        # section id -> (tool_use_id, chars) for sections visible in history
+        self.delivered = {}
+        # tool_use_id -> list of (section id, title) delivered with that call
+        self.by_tool = {}
+
+    def sync(self, history):
+        """Forget deliveries whose tool_result is no longer in the history window"""
+        live_ids = set()
+        for msg in history:
+            content = msg.get("content")
+            if isinstance(content, list):
+                for block in content:
+                    if isinstance(block, dict) and block.get("type") == "tool_result":
+                        live_ids.add(block.get("tool_use_id"))
+
+        self.delivered = {sid: entry for sid, entry in self.delivered.items() if entry[0] in live_ids}
+        self.by_tool = {tid: sections for tid, sections in self.by_tool.items() if tid in live_ids}
+
+    def live_chars(self):
+        return sum(chars for _, chars in self.delivered.values())
+
+    def split(self, results):
+        """
+        Split search results into (new_results, repeated_titles)
+        repeated_titles are sections the model can already see above
+        """
+        new_results = []
+        repeated_titles = []
+        for result in results:
+            if section_id(result) in self.delivered:
+                repeated_titles.append(result[1])
+                if self.metrics:
+                    # The back-reference costs a few tokens; the section would cost ~len/4
+                    self.metrics.incr("retrieval_dedup_sections")
+                    self.metrics.incr("retrieval_dedup_tokens_saved_estimate", len(result[2]) // 4)
+            else:
+                new_results.append(result)
+        return new_results, repeated_titles
+
+    def record(self, tool_use_id, results):
+        """Record sections delivered with a tool call"""
+        sections = []
+        for result in results:
+            sid = section_id(result)
+            self.delivered[sid] = (tool_use_id, len(result[2]))
+            sections.append((sid, result[1]))
+        if sections:
+            self.by_tool.setdefault(tool_use_id, []).extend(sections)
+
+    def make_room(self, history, incoming_chars, cached_until=None):
+        """
+        Elide the oldest delivered tool results until the live window plus
+        incoming_chars fits the budget
+        history[:cached_until] is inside the prompt-cache prefix of the last
+        request (cached_until is its breakpoint). Stubbing a result there would
+        make the next request write the cache again from that message on,
+        costing more than the result itself, so those results are left for
+        history truncation to drop
+        """
+        if self.live_chars() + incoming_chars <= self.MAX_LIVE_CHARS:
+            return
+
+        for index, msg in enumerate(history):
+            content = msg.get("content")
+            if not isinstance(content, list):
+                continue
+            if cached_until is not None and index < cached_until:
+                if self.metrics and any(isinstance(block, dict) and block.get("tool_use_id") in self.by_tool
+                                        for block in content):
+                    self.metrics.incr("retrieval_evict_skipped_cached")
+                continue
+            for i, block in enumerate(content):
+                if not (isinstance(block, dict) and block.get("type") == "tool_result"):
+                    continue
+                tool_use_id = block.get("tool_use_id")
+                sections = self.by_tool.pop(tool_use_id, None)
+                if not sections:
+                    continue
+
+                titles = ", ".join(title for _, title in sections)
+                stub = f"[Earlier search results removed to save space: {titles}. Search again if needed.]"
+                freed = 0
+                for sid, _ in sections:
+                    entry = self.delivered.pop(sid, None)
+                    if entry:
+                        freed += entry[1]
+                content[i] = {"type": "tool_result", "tool_use_id": tool_use_id, "content": stub}
+
+                if self.metrics:
+                    self.metrics.incr("retrieval_evicted_results")
+                    self.metrics.incr("retrieval_evicted_tokens_estimate", freed // 4)
+
+                if self.live_chars() + incoming_chars <= self.MAX_LIVE_CHARS:
+                    return
+
+    def reset(self):
+        self.delivered = {}
+        self.by_tool = {}
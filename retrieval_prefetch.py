@@ -0,0 +1,103 @@
+"""
+Speculative knowledge base retrieval
+Runs likely search_knowledge queries for a user message in a worker thread
+while the first API call is in flight, so the tool call can be served
+without searching on the critical path.
+"""
+
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Words that make poor standalone search queries
+STOPWORDS = {
+    'the', 'and', 'are', 'can', 'for', 'how', 'what', 'who', 'why', 'when', 'where',
+    'which', 'you', 'your', 'about', 'tell', 'does', 'did', 'with', 'that', 'this',
+    'there', 'have', 'has', 'was', 'were', 'know', 'search', 'find', 'look', 'please',
+    'any', 'some', 'info', 'information', 'give', 'show', 'from', 'into', 'knowledge', 'base'
+}
+
+
+def normalize_query(query):
+    """Canonical form used both for prefetching and for serving tool calls"""
+    return " ".join(query.lower().split())
+
+
+class RetrievalPrefetcher:
+    # Upper bound on speculative searches per user message
+    MAX_QUERIES = 12
+
+    def __init__(self, knowledge_base, metrics=None, max_results=3, max_chars=1500):
+        self.knowledge_base = knowledge_base
+        self.metrics = metrics
+        self.max_results = max_results
+        self.max_chars = max_chars
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval-prefetch")
+        self._future = None
+
+    def candidate_queries(self, text):
+        """
+        Guess the queries the model is likely to issue for this message:
+        the whole message, each content word, and adjacent word pairs
+        (for multi-word topics like "mantis shrimp" or "black holes")
+        """
+        words = [w for w in re.findall(r'\w+', text.lower()) if len(w) > 2 and w not in STOPWORDS]
+
+        candidates = [normalize_query(text)]
+        candidates.extend(words)
+        candidates.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+
+        unique = []
+        for query in candidates:
+            if query and query not in unique:
+                unique.append(query)
+        return unique[:self.MAX_QUERIES]
+
+    def start(self, text, allow_restricted=False):
+        """Kick off speculative searches for a new user message"""
+        queries = self.candidate_queries(text)
+        self._future = self._executor.submit(self._run, queries, allow_restricted)
+        if self.metrics:
+            self.metrics.incr("retrieval_prefetch_started")
+
+    def _run(self, queries, allow_restricted):
+        results = {}
+        for query in queries:
+            started = time.perf_counter()
+            found = self.knowledge_base.search(query, max_results=self.max_results,
+                                               max_chars=self.max_chars, allow_restricted=allow_restricted)
+            results[query] = (allow_restricted, found, time.perf_counter() - started)
+        return results
+
+    def lookup(self, query, allow_restricted=False):
+        """
+        Return prefetched search results for a query, or None on a miss
+        Waits for the worker if it is still running - it is local and fast
+        """
+        if self._future is None:
+            return None
+
+        try:
+            prefetched = self._future.result()
+        except Exception:
+            self._future = None
+            return None
+
+        entry = prefetched.get(normalize_query(query))
+        if entry is None or entry[0] != allow_restricted:
+            if self.metrics:
+                self.metrics.incr("retrieval_prefetch_miss")
+            return None
+
+        _, results, search_seconds = entry
+        if self.metrics:
+            self.metrics.incr("retrieval_prefetch_hit")
+            # Search time that would otherwise have been spent on the critical path
+            self.metrics.observe("retrieval_prefetch_saved_seconds", search_seconds)
+        return results
+
+    def clear(self):
+        self._future = None
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
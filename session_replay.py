@@ -0,0 +1,454 @@
+"""
+Deterministic replay of real player sessions from the logs
+
+    python -m session_replay /app/logs --output before.jsonl
+    python -m session_replay /app/logs --output after.jsonl --baseline before.jsonl
+    python -m session_replay /app/logs --session session_1700000000_42 --json
+
+Rebuilds each session from its "chat" records in llm_shell.jsonl and feeds
+the player's messages through a real LLMShell whose Anthropic client is a
+playback backend: model output, including the tool_use rounds logged in
+"tool_rounds", is served from the log instead of the network. Everything
+on our side of the API (history truncation, message and cache_control
+building, retrieval, the tool loop) runs for real, so a change to any of it
+can be measured on real traffic shapes at full speed.
+
+Tokens are estimated at 4 characters per token. Prompt caching is modelled
+per session: a cache_control breakpoint writes its prefix, later requests
+read the longest previously written prefix still inside the TTL (measured
+on the logged timestamps). Sessions replay in parallel across a process
+pool; the per-turn results can be saved with --output and compared against
+an earlier run with --baseline.
+
+Sessions that resumed saved history start from an empty conversation, and
+records logged before tool rounds were recorded replay without tool calls.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cache_warmer import MIN_CACHEABLE_TOKENS
+from log_analytics import find_segments, iter_events, load_index, parse_time, seek_offset
+from metrics import percentile
+
+# Ephemeral prompt cache lifetime, refreshed on every hit
+CACHE_TTL_SECONDS = 300
+CHARS_PER_TOKEN = 4
+
+# Live backends, quotas, the fair queue limit and profiling are all off during a replay
+REPLAY_UNSET_ENV = ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "OLLAMA_HOST",
+                    "LLM_SESSION_TOKEN_LIMIT", "LLM_USER_DAILY_TOKEN_LIMIT", "LLM_USER_DAILY_COST_LIMIT",
+                    "LLM_MAX_CONCURRENT", "LLM_SHELL_PROFILE")
+# Every SQLite store the shell opens, pointed into the replay's own directory
+REPLAY_STATE_FILES = {
+    "PROGRESS_DB": "progress.db",
+    "USAGE_DB": "usage.db",
+    "RESPONSE_CACHE_DB": "response_cache.db"
+}
+
+
+def _tokens(chars):
+    return chars // CHARS_PER_TOKEN
+
+
+# ---------------------------------------------------------------------------
+# Loading sessions
+# ---------------------------------------------------------------------------
+
+def load_sessions(paths, since=None, session=None):
+    """Group chat records by session, in log order"""
+    sessions = {}
+    for path in find_segments(paths):
+        start_offset = 0
+        if since is not None or session is not None:
+            start_offset = seek_offset(load_index(path), since=since, session=session)
+            if start_offset is None:
+                continue
+        for _, event in iter_events(path, start_offset=start_offset):
+            session_id = event.get("session_id")
+            if session is not None and session_id != session:
+                continue
+            if since is not None and (parse_time(event.get("timestamp")) or 0) < since:
+                continue
+            kind = event.get("event")
+            if kind == "session_start":
+                sessions.setdefault(session_id, {"session_id": session_id, "user": None, "turns": []})
+                sessions[session_id]["user"] = event.get("user")
+            elif kind == "chat" and event.get("user_input"):
+                info = sessions.setdefault(session_id, {"session_id": session_id, "user": None, "turns": []})
+                info["turns"].append(event)
+    return [info for info in sessions.values() if info["turns"]]
+
+
+# ---------------------------------------------------------------------------
+# Playback backend
+# ---------------------------------------------------------------------------
+
+class _Record(dict):
+    """Dict with attribute access, standing in for the SDK's response objects"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def model_dump(self):
+        return dict(self)
+
+
+class PromptCacheModel:
+    """Approximation of Anthropic prompt caching over one session's requests"""
+
+    def __init__(self):
+        self.entries = {}  # prefix hash -> last use (logged clock)
+
+    def usage(self, params, output_chars, now):
+        positions = list(self._prefix_positions(params))
+        total = positions[-1][1] if positions else 0
+        model = params.get("model", "")
+        min_tokens = next((n for family, n in MIN_CACHEABLE_TOKENS.items() if family in model), 1024)
+
+        for digest, _, _ in positions:
+            if digest in self.entries and now - self.entries[digest] > CACHE_TTL_SECONDS:
+                del self.entries[digest]
+
+        breakpoints = [(digest, chars) for digest, chars, marked in positions if marked]
+        last_breakpoint = breakpoints[-1][1] if breakpoints else 0
+        read = 0
+        for digest, chars, _ in positions:
+            if chars <= last_breakpoint and digest in self.entries:
+                read = chars
+                self.entries[digest] = now
+        written = 0
+        for digest, chars in breakpoints:
+            if _tokens(chars) >= min_tokens and digest not in self.entries:
+                self.entries[digest] = now
+                written = max(written, chars - read)
+
+        return _Record(input_tokens=_tokens(total - read - written),
+                       output_tokens=max(1, _tokens(output_chars)),
+                       cache_creation_input_tokens=_tokens(written),
+                       cache_read_input_tokens=_tokens(read))
+
+    @staticmethod
+    def _prefix_positions(params):
+        """(running hash, running chars, is breakpoint) after each block, in API prefix order"""
+        blocks = list(params.get("tools") or [])
+        system = params.get("system") or []
+        blocks.extend([{"type": "text", "text": system}] if isinstance(system, str) else system)
+        for message in params.get("messages", []):
+            content = message["content"]
+            if isinstance(content, str):
+                content = [{"type": "text", "text": content}]
+            blocks.extend(dict(block, role=message["role"]) for block in content)
+
+        running = hashlib.sha256(params.get("model", "").encode("utf-8"))
+        chars = 0
+        for block in blocks:
+            stripped = {key: value for key, value in block.items() if key != "cache_control"}
+            text = json.dumps(stripped, sort_keys=True)
+            running.update(text.encode("utf-8"))
+            chars += len(text)
+            yield running.hexdigest(), chars, "cache_control" in block
+
+
+class _PlaybackStream:
+    def __init__(self, text, usage):
+        self._text = text
+        self._usage = usage
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        # Word-sized chunks, like the real stream's text deltas
+        return iter(re.findall(r"\s*\S+|\s+", self._text))
+
+    def get_final_message(self):
+        return _Record(content=[_Record(type="text", text=self._text)], stop_reason="end_turn",
+                       usage=self._usage)
+
+    def close(self):
+        pass
+
+
+class _PlaybackMessages:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, **params):
+        client = self._client
+        round_index = _tool_round_index(params.get("messages", []))
+        if round_index < len(client.tool_rounds):
+            content = [_Record(block) for block in client.tool_rounds[round_index]]
+            stop_reason = "tool_use"
+            output_chars = len(json.dumps(client.tool_rounds[round_index]))
+        else:
+            content = [_Record(type="text", text=client.response)]
+            stop_reason = "end_turn"
+            output_chars = len(client.response)
+        usage = client.record_call(params, output_chars)
+        return _Record(content=content, stop_reason=stop_reason, usage=usage)
+
+    def stream(self, **params):
+        client = self._client
+        return _PlaybackStream(client.response, client.record_call(params, len(client.response)))
+
+
+class _PlaybackModels:
+    def list(self, **kwargs):
+        return []
+
+
+class PlaybackClient:
+    """Anthropic client stand-in serving one logged turn at a time"""
+
+    def __init__(self):
+        self.messages = _PlaybackMessages(self)
+        self.models = _PlaybackModels()
+        self.cache = PromptCacheModel()
+        self.load_turn({})
+
+    def load_turn(self, record):
+        self.response = record.get("ai_response") or ""
+        self.tool_rounds = record.get("tool_rounds") or []
+        self.clock = parse_time(record.get("timestamp")) or 0
+        self.calls = 0
+        self.request_chars = 0
+
+    def record_call(self, params, output_chars):
+        self.calls += 1
+        self.request_chars += len(json.dumps(params))
+        return self.cache.usage(params, output_chars, self.clock)
+
+
+def _tool_round_index(messages):
+    """Number of tool rounds the model has already made since the player's last message"""
+    rounds = 0
+    for message in reversed(messages):
+        content = message["content"]
+        if message["role"] == "user":
+            if isinstance(content, list) and any(block.get("type") == "tool_result" for block in content):
+                continue
+            break
+        if isinstance(content, list) and any(block.get("type") == "tool_use" for block in content):
+            rounds += 1
+    return rounds
+
+
+# ---------------------------------------------------------------------------
+# Replaying
+# ---------------------------------------------------------------------------
+
+def replay_session(session):
+    """Worker: run one logged session through LLMShell; returns per-turn results"""
+    with tempfile.TemporaryDirectory(prefix="llm_shell_replay_") as workdir:
+        # Only the playback client answers, and no quota, queue or shared state of the
+        # live deployment may leak into (or be written by) the replay
+        for name in REPLAY_UNSET_ENV:
+            os.environ.pop(name, None)
+        os.environ["LOG_DIR"] = workdir
+        for name, filename in REPLAY_STATE_FILES.items():
+            os.environ[name] = os.path.join(workdir, filename)
+        os.environ["USER"] = session.get("user") or "replay"
+
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            import llm_shell
+
+            # LOG_FILE is fixed at import; keep replayed events out of the real logs
+            llm_shell.LOG_DIR = workdir
+            llm_shell.LOG_FILE = os.path.join(workdir, "llm_shell.jsonl")
+
+            playback = PlaybackClient()
+            shell = llm_shell.LLMShell(anthropic_client=playback)
+            shell.PRE_TOOL_TEXT_DELAY = 0
+
+            results = []
+            try:
+                for record in session["turns"]:
+                    stage = record.get("stage")
+                    if isinstance(stage, int) and stage != shell.stage:
+                        # The flag was submitted between these turns
+                        shell.stage = stage
+                        shell.conversation_history = []
+                        shell.retrieval_ledger.reset()
+                        shell._update_system_prompt()
+
+                    playback.load_turn(record)
+                    started = time.perf_counter()
+                    response = shell.query_llm(record["user_input"])
+                    latency = time.perf_counter() - started
+
+                    usage = shell.turn_usage
+                    logged_rounds = len(record.get("tool_rounds") or [])
+                    results.append({
+                        "session_id": session["session_id"],
+                        "turn": len(results) + 1,
+                        "stage": shell.stage,
+                        "api_calls": playback.calls,
+                        "request_chars": playback.request_chars,
+                        "history_messages": len(shell.conversation_history),
+                        "tokens_sent": sum(usage.get(field, 0) for field in (
+                            "input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")),
+                        "usage": dict(usage),
+                        "latency_ms": round(latency * 1000, 3),
+                        "logged_latency_ms": record.get("latency_ms"),
+                        "logged_usage": record.get("usage"),
+                        "tool_rounds": len(shell.turn_tool_rounds),
+                        "diverged": (response != (record.get("ai_response") or "").strip()
+                                     or len(shell.turn_tool_rounds) != logged_rounds)
+                    })
+            finally:
+                shell.log_session_end()
+    return results
+
+
+def replay(sessions, workers=None):
+    if len(sessions) == 1 or workers == 1:
+        return [turn for session in sessions for turn in replay_session(session)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [turn for turns in pool.map(replay_session, sessions) for turn in turns]
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def load_results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(results, baseline):
+    """Attach per-turn deltas against a baseline run and summarize them"""
+    previous = {(row["session_id"], row["turn"]): row for row in baseline}
+    matched = 0
+    changed = 0
+    tokens_before = 0
+    tokens_after = 0
+    for row in results:
+        before = previous.get((row["session_id"], row["turn"]))
+        if before is None:
+            continue
+        matched += 1
+        row["tokens_sent_delta"] = row["tokens_sent"] - before["tokens_sent"]
+        row["latency_ms_delta"] = round(row["latency_ms"] - before["latency_ms"], 3)
+        if row["tokens_sent_delta"]:
+            changed += 1
+        tokens_before += before["tokens_sent"]
+        tokens_after += row["tokens_sent"]
+    return {
+        "matched_turns": matched,
+        "turns_with_token_change": changed,
+        "tokens_sent_before": tokens_before,
+        "tokens_sent_after": tokens_after,
+        "tokens_sent_change_pct": round((tokens_after - tokens_before) / tokens_before * 100, 2)
+        if tokens_before else None
+    }
+
+
+def summarize(results):
+    latencies = sorted(row["latency_ms"] for row in results)
+    tokens = sorted(row["tokens_sent"] for row in results)
+    totals = {}
+    for row in results:
+        for field, value in row["usage"].items():
+            totals[field] = totals.get(field, 0) + value
+    return {
+        "sessions": len({row["session_id"] for row in results}),
+        "turns": len(results),
+        "diverged_turns": sum(1 for row in results if row["diverged"]),
+        "api_calls": sum(row["api_calls"] for row in results),
+        "usage": totals,
+        "tokens_sent_per_turn": {"mean": round(sum(tokens) / len(tokens), 1) if tokens else 0,
+                                 "p50": percentile(tokens, 50), "p95": percentile(tokens, 95),
+                                 "max": tokens[-1] if tokens else 0},
+        "latency_ms": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                       "max": latencies[-1] if latencies else 0}
+    }
+
+
+def print_report(report, results):
+    print(f"Sessions: {report['sessions']}  Turns: {report['turns']}  "
+          f"API calls: {report['api_calls']}  Diverged turns: {report['diverged_turns']}")
+    tokens = report["tokens_sent_per_turn"]
+    print(f"Tokens sent per turn: mean={tokens['mean']} p50={tokens['p50']} p95={tokens['p95']} max={tokens['max']}")
+    print("Usage: " + ", ".join(f"{field}={value}" for field, value in sorted(report["usage"].items())))
+    latency = report["latency_ms"]
+    print(f"Local turn latency (ms): p50={latency['p50']} p95={latency['p95']} max={latency['max']}")
+
+    comparison = report.get("baseline")
+    if comparison:
+        print()
+        print(f"Against baseline: {comparison['matched_turns']} turns matched, "
+              f"{comparison['turns_with_token_change']} changed tokens sent")
+        print(f"  Tokens sent: {comparison['tokens_sent_before']} -> {comparison['tokens_sent_after']} "
+              f"({comparison['tokens_sent_change_pct']}%)")
+        for row in results:
+            if row.get("tokens_sent_delta"):
+                print(f"  {row['session_id']} turn {row['turn']}: tokens {row['tokens_sent_delta']:+d}, "
+                      f"latency {row['latency_ms_delta']:+.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay logged llm_shell sessions against a playback backend")
+    parser.add_argument("paths", nargs="*", default=["/app/logs"],
+                        help="Log segments or directories (default: /app/logs)")
+    parser.add_argument("--session", help="Only this session_id")
+    parser.add_argument("--since", help="Only turns at or after this ISO timestamp")
+    parser.add_argument("--limit", type=int, help="Replay at most this many sessions")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--output", help="Write per-turn results as JSONL")
+    parser.add_argument("--baseline", help="Per-turn results of an earlier run to compare against")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    since = parse_time(args.since) if args.since else None
+    if args.since and since is None:
+        parser.error(f"Invalid --since timestamp: {args.since}")
+
+    try:
+        sessions = load_sessions(args.paths, since=since, session=args.session)
+        baseline = load_results(args.baseline) if args.baseline else None
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if args.limit:
+        sessions = sessions[:args.limit]
+    if not sessions:
+        print("No chat records found to replay", file=sys.stderr)
+        return 1
+
+    results = replay(sessions, workers=args.workers)
+    report = summarize(results)
+    if baseline is not None:
+        report["baseline"] = compare(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            for row in results:
+                f.write(json.dumps(row) + "\n")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
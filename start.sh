@@ -5,11 +5,17 @@ cat > /etc/profile.d/llm_env.sh << EOF
 export ANTHROPIC_API_KEY="${ANTHROPIC_API_KEY}"
 export OPENAI_API_KEY="${OPENAI_API_KEY}"
 export OLLAMA_HOST="${OLLAMA_HOST}"
+export OLLAMA_KEEP_ALIVE="${OLLAMA_KEEP_ALIVE}"
 export FLAG_STAGE_1="${FLAG_STAGE_1}"
 export FLAG_STAGE_2="${FLAG_STAGE_2}"
 export FLAG_STAGE_3="${FLAG_STAGE_3}"
 export FLAG_STAGE_4="${FLAG_STAGE_4}"
 export FLAG_STAGE_5="${FLAG_STAGE_5}"
+export LLM_SHELL_PROFILE="${LLM_SHELL_PROFILE}"
+export LLM_SESSION_TOKEN_LIMIT="${LLM_SESSION_TOKEN_LIMIT}"
+export LLM_USER_DAILY_TOKEN_LIMIT="${LLM_USER_DAILY_TOKEN_LIMIT}"
+export LLM_USER_DAILY_COST_LIMIT="${LLM_USER_DAILY_COST_LIMIT}"
+export LLM_MAX_CONCURRENT="${LLM_MAX_CONCURRENT}"
 EOF
 
 chmod 644 /etc/profile.d/llm_env.sh
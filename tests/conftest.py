@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, next to llm_shell.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# system_prompt refuses to import without the stage flags
+for stage in range(1, 6):
+    os.environ.setdefault(f"FLAG_STAGE_{stage}", f"FLAG{{test_stage_{stage}}}")
+
+
+@pytest.fixture
+def make_shell(tmp_path, monkeypatch):
+    """Build LLMShells whose logs and SQLite stores all live in tmp_path"""
+    for name in ("anthropic", "openai", "requests", "dotenv"):
+        pytest.importorskip(name)
+    import llm_shell
+    from session_replay import REPLAY_STATE_FILES, REPLAY_UNSET_ENV
+
+    for name in REPLAY_UNSET_ENV:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("LOG_DIR", str(tmp_path))
+    for name, filename in REPLAY_STATE_FILES.items():
+        monkeypatch.setenv(name, str(tmp_path / filename))
+    monkeypatch.setenv("USER", "tester")
+    monkeypatch.setattr(llm_shell, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(llm_shell, "LOG_FILE", str(tmp_path / "llm_shell.jsonl"))
+    monkeypatch.setattr(llm_shell.LLMShell, "PRE_TOOL_TEXT_DELAY", 0)
+
+    shells = []
+
+    def make(anthropic_client=None, ollama_host=None):
+        if ollama_host:
+            monkeypatch.setenv("OLLAMA_HOST", ollama_host)
+        shell = llm_shell.LLMShell(anthropic_client=anthropic_client)
+        shells.append(shell)
+        return shell
+
+    yield make
+    for shell in shells:
+        shell.log_session_end()
+
+
+@pytest.fixture
+def shell_events(tmp_path):
+    """Read back one kind of event from the log make_shell's shells write"""
+    def read(event):
+        path = tmp_path / "llm_shell.jsonl"
+        if not path.exists():
+            return []
+        with open(path) as f:
+            return [entry for entry in map(json.loads, f) if entry.get("event") == event]
+    return read
@@ -0,0 +1,96 @@
+"""Anthropic client stand-ins for driving LLMShell without the API"""
+
+import time
+
+
+class Record(dict):
+    """Dict with attribute access, like the SDK's response objects"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def model_dump(self):
+        return dict(self)
+
+
+USAGE = Record(input_tokens=10, output_tokens=5, cache_creation_input_tokens=0, cache_read_input_tokens=0)
+
+
+class FakeStream:
+    def __init__(self, chunks, interrupt_at=None, latency=0):
+        self.chunks = chunks
+        self.interrupt_at = interrupt_at
+        self.latency = latency
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        time.sleep(self.latency)
+        for index, chunk in enumerate(self.chunks):
+            if index == self.interrupt_at:
+                raise KeyboardInterrupt
+            yield chunk
+
+    def get_final_message(self):
+        return Record(usage=USAGE)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeMessages:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, **params):
+        client = self.client
+        client.requests.append(params)
+        time.sleep(client.latency)
+        if client.interrupt_tool_loop and client.created == 1:
+            raise KeyboardInterrupt
+        client.created += 1
+        if client.tool_rounds:
+            return Record(content=client.tool_rounds.pop(0), stop_reason="tool_use", usage=USAGE)
+        return Record(content=[Record(type="text", text="".join(client.chunks))], stop_reason="end_turn",
+                      usage=USAGE)
+
+    def stream(self, **params):
+        self.client.requests.append(params)
+        self.client.stream = FakeStream(self.client.chunks, self.client.interrupt_at, self.client.latency)
+        return self.client.stream
+
+
+class FakeModels:
+    def list(self, **kwargs):
+        return []
+
+
+class FakeAnthropic:
+    """
+    Answers each turn with the chunks given to next_turn, raising Ctrl-C where asked
+    Every request, and the stream's first chunk, takes latency seconds
+    """
+
+    def __init__(self, latency=0):
+        self.messages = FakeMessages(self)
+        self.models = FakeModels()
+        self.requests = []
+        self.latency = latency
+        self.next_turn(["Hello", " there."])
+
+    def next_turn(self, chunks, interrupt_at=None, tool_rounds=(), interrupt_tool_loop=False):
+        self.chunks = chunks
+        self.interrupt_at = interrupt_at
+        self.tool_rounds = list(tool_rounds)
+        self.interrupt_tool_loop = interrupt_tool_loop
+        self.created = 0
+        self.stream = None
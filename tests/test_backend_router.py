@@ -0,0 +1,64 @@
+from backend_router import (CLOSED, HALF_OPEN, OPEN, BackendRouter, to_ollama_messages, to_ollama_tools,
+                            to_text_messages)
+from metrics import SessionMetrics
+
+TOOL_TURN = [
+    {"role": "user", "content": "Tell me about tardigrades"},
+    {"role": "assistant", "content": [
+        {"type": "text", "text": "Let me search."},
+        {"type": "tool_use", "id": "toolu_1", "name": "search_knowledge", "input": {"query": "tardigrades"}}]},
+    {"role": "user", "content": [{"type": "tool_result", "tool_use_id": "toolu_1", "content": "Water bears."}]},
+    {"role": "assistant", "content": "They are tough."}
+]
+
+
+def state(router, name):
+    return router.backends[name].state
+
+
+def test_circuit_opens_after_repeated_failures():
+    router = BackendRouter(metrics=SessionMetrics())
+    router.register("anthropic")
+    router.register("ollama")
+    for _ in range(router.FAILURE_THRESHOLD):
+        router.record_failure("anthropic", RuntimeError("500"))
+    assert state(router, "anthropic") == OPEN
+    assert router.ordered_backends() == ["ollama"]
+    assert not router.has_alternative("ollama")
+
+
+def test_half_open_trial_after_cooldown():
+    router = BackendRouter()
+    router.COOLDOWN_SECONDS = 0
+    router.register("anthropic", healthy=False)
+    assert router.ordered_backends() == ["anthropic"]
+    assert state(router, "anthropic") == HALF_OPEN
+
+    # A failed trial re-opens at once, a successful one closes
+    router.record_failure("anthropic", RuntimeError("still down"))
+    assert state(router, "anthropic") == OPEN
+    router.ordered_backends()
+    router.record_success("anthropic", 0.5)
+    assert state(router, "anthropic") == CLOSED
+
+
+def test_text_messages_flatten_tool_blocks():
+    messages = to_text_messages(TOOL_TURN)
+    assert [m["role"] for m in messages] == ["user", "assistant", "user", "assistant"]
+    assert "[Searched the knowledge base for: tardigrades]" in messages[1]["content"]
+    assert "Water bears." in messages[2]["content"]
+
+
+def test_ollama_messages_keep_tool_calls():
+    messages = to_ollama_messages(TOOL_TURN)
+    assert [m["role"] for m in messages] == ["user", "assistant", "tool", "assistant"]
+    assert messages[1]["tool_calls"] == [{"function": {"name": "search_knowledge",
+                                                       "arguments": {"query": "tardigrades"}}}]
+    assert messages[2] == {"role": "tool", "content": "Water bears.", "tool_name": "search_knowledge"}
+
+
+def test_ollama_tools_use_the_function_format():
+    tool = {"name": "search_knowledge", "description": "Search",
+            "input_schema": {"type": "object", "properties": {"query": {"type": "string"}}}}
+    assert to_ollama_tools([tool]) == [{"type": "function", "function": {
+        "name": "search_knowledge", "description": "Search", "parameters": tool["input_schema"]}}]
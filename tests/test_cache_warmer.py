@@ -0,0 +1,61 @@
+import threading
+from types import SimpleNamespace
+
+from cache_warmer import CacheWarmer, cacheable, min_cacheable_tokens
+from metrics import SessionMetrics
+
+
+def params(model, tokens):
+    return {"model": model, "system": [{"type": "text", "text": "x" * (tokens * 4)}], "tools": []}
+
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+        self.sent = threading.Event()
+        self.messages = self
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        self.sent.set()
+        return SimpleNamespace(usage=SimpleNamespace(cache_creation_input_tokens=2000, cache_read_input_tokens=0))
+
+
+def test_minimum_depends_on_the_model():
+    assert min_cacheable_tokens("claude-3-5-haiku-20241022") == 4096
+    assert min_cacheable_tokens("claude-sonnet-4-5") == 1024
+    assert not cacheable(params("claude-3-5-haiku-20241022", 1300))
+    assert cacheable(params("claude-sonnet-4-5", 1300))
+
+
+def test_short_prefix_is_not_sent(tmp_path):
+    client = RecordingClient()
+    metrics = SessionMetrics()
+    warmer = CacheWarmer(client, str(tmp_path), metrics=metrics)
+    assert not warmer.warm(params("claude-3-5-haiku-20241022", 1300))
+    assert client.calls == []
+    assert metrics.get("cache_warm_skipped_too_short") == 1
+
+
+def test_sessions_share_one_warm_up(tmp_path):
+    client = RecordingClient()
+    first = CacheWarmer(client, str(tmp_path))
+    second = CacheWarmer(client, str(tmp_path))
+    assert first.warm(params("claude-sonnet-4-5", 2000))
+    assert client.sent.wait(5)
+    assert not second.warm(params("claude-sonnet-4-5", 2000))
+    assert client.calls[0]["max_tokens"] == 1
+
+
+def test_warm_up_usage_is_reported(tmp_path):
+    reported = []
+    done = threading.Event()
+
+    def on_usage(model, usage):
+        reported.append((model, usage.cache_creation_input_tokens))
+        done.set()
+
+    warmer = CacheWarmer(RecordingClient(), str(tmp_path), on_usage=on_usage)
+    assert warmer.warm(params("claude-sonnet-4-5", 2000))
+    assert done.wait(5)
+    assert reported == [("claude-sonnet-4-5", 2000)]
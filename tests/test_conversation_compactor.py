@@ -0,0 +1,134 @@
+import threading
+from types import SimpleNamespace
+
+from conversation_compactor import SUMMARY_PREFIX, ConversationCompactor, extractive_summary
+from metrics import SessionMetrics
+
+MAX_HISTORY = 10
+
+
+def truncate(history):
+    """LLMShell._smart_truncate_history: keep MAX_HISTORY messages, tool pairs whole"""
+    if len(history) <= MAX_HISTORY:
+        return history
+    start = len(history) - MAX_HISTORY
+    while start > 0:
+        content = history[start].get("content")
+        if isinstance(content, list) and content and content[0].get("type") == "tool_result":
+            start -= 1
+            continue
+        break
+    return history[start:]
+
+
+def tool_turn(n):
+    tool_id = f"toolu_{n}"
+    return [
+        {"role": "user", "content": f"Tell me about topic {n}."},
+        {"role": "assistant", "content": [
+            {"type": "text", "text": "Let me search for that."},
+            {"type": "tool_use", "id": tool_id, "name": "search_knowledge", "input": {"query": f"topic {n}"}}]},
+        {"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": tool_id, "content": f"[From Topic {n}]\nFacts about topic {n}."}]},
+        {"role": "assistant", "content": f"Topic {n} is interesting. Here is more."}
+    ]
+
+
+def run_session(turns, truncate_while_pending):
+    """Replay query_llm's compact-then-truncate order, letting each summary finish between turns"""
+    metrics = SessionMetrics()
+    compactor = ConversationCompactor(metrics=metrics)
+    history = []
+    for n in range(turns):
+        history = compactor.compact(history)
+        if truncate_while_pending or not compactor.pending:
+            history = truncate(history)
+        history = history + tool_turn(n)
+        if compactor.pending:
+            compactor._pending[2].result()
+    compactor.shutdown()
+    return history, metrics
+
+
+def test_tool_session_applies_summaries():
+    history, metrics = run_session(8, truncate_while_pending=False)
+    assert metrics.get("compaction_applied") >= 2
+    assert metrics.get("compaction_stale") == 0
+    assert history[0]["content"].startswith(SUMMARY_PREFIX)
+    # The summary still mentions early searches
+    assert "topic" in history[0]["content"]
+
+
+def test_truncating_under_a_pending_summary_makes_it_stale():
+    _, metrics = run_session(8, truncate_while_pending=True)
+    assert metrics.get("compaction_applied") == 0
+    assert metrics.get("compaction_stale") >= 1
+
+
+def test_boundary_keeps_tool_pairs_whole():
+    compactor = ConversationCompactor()
+    history = tool_turn(0) + tool_turn(1) + tool_turn(2)
+    boundary = compactor._boundary(history)
+    assert history[boundary] == tool_turn(2)[0]
+    compactor.shutdown()
+
+
+def test_extractive_summary_keeps_searches():
+    summary = extractive_summary(tool_turn(0) + tool_turn(1), 1500)
+    assert "[Searched the knowledge base for: topic 0]" in summary
+    assert "Search returned: Topic 1" in summary
+
+
+class SummaryClient:
+    def __init__(self):
+        self.messages = self
+
+    def create(self, **kwargs):
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text="Earlier: topics 0 and 1.")],
+                               usage=SimpleNamespace(input_tokens=300, output_tokens=20))
+
+
+def test_model_summary_usage_is_reported():
+    reported = []
+    compactor = ConversationCompactor(SummaryClient(), model="claude-haiku-4-5",
+                                      on_usage=lambda model, usage: reported.append((model, usage.input_tokens)))
+    history = compactor.compact(tool_turn(0) + tool_turn(1) + tool_turn(2))
+    assert compactor.pending
+    assert compactor._pending[2].result()[1] == "model"
+    compactor.shutdown()
+    assert reported == [("claude-haiku-4-5", 300)]
+    assert len(history) == 12
+
+
+class HangingClient:
+    def __init__(self):
+        self.messages = self
+        self.release = threading.Event()
+        self.timeouts = []
+
+    def create(self, **kwargs):
+        self.timeouts.append(kwargs.get("timeout"))
+        self.release.wait(5)
+        raise TimeoutError("summary request timed out")
+
+
+def test_hung_summary_stops_holding_back_truncation():
+    client = HangingClient()
+    compactor = ConversationCompactor(client, model="claude-haiku-4-5")
+    history = []
+    lengths = []
+    for n in range(8):
+        history = compactor.compact(history)
+        # query_llm's rule: truncate unless a summary is pending and not yet stalled
+        if not (compactor.pending and not compactor.stalled):
+            history = truncate(history)
+        lengths.append(len(history))
+        history = history + tool_turn(n)
+
+    assert compactor.stalled
+    assert max(lengths) <= MAX_HISTORY + 4 * (ConversationCompactor.MAX_PENDING_TURNS + 1)
+    # Capped again (one over when backing up to keep a tool pair whole)
+    assert lengths[-1] <= MAX_HISTORY + 1
+    assert client.timeouts == [ConversationCompactor.SUMMARY_TIMEOUT_SECONDS]
+    client.release.set()
+    compactor.shutdown()
@@ -0,0 +1,73 @@
+import sqlite3
+import time
+
+import pytest
+
+import fair_scheduler
+from fair_scheduler import FairScheduler
+
+
+def ticket_count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM fq_tickets").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    scheduler = FairScheduler(str(tmp_path / "usage.db"), max_concurrent=1)
+    scheduler.MAX_WAIT_SECONDS = 5
+    return scheduler
+
+
+def test_spare_capacity_admits_immediately(scheduler):
+    started = time.perf_counter()
+    ticket = scheduler.acquire("alice", 100)
+    assert ticket is not None
+    assert time.perf_counter() - started < 1
+    scheduler.release(ticket)
+    assert ticket_count(scheduler.path) == 0
+
+
+def test_lighter_user_is_admitted_first(scheduler):
+    running = scheduler.acquire("holder", 1)
+    conn = fair_scheduler._connect(scheduler.path)
+    try:
+        heavy = scheduler._enqueue(conn, "heavy", 5000)
+        light = scheduler._enqueue(conn, "light", 10)
+    finally:
+        conn.close()
+    scheduler.release(running)
+
+    conn = fair_scheduler._connect(scheduler.path)
+    try:
+        assert not scheduler._try_admit(conn, heavy)
+        assert scheduler._try_admit(conn, light)
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("error", [KeyboardInterrupt, sqlite3.OperationalError])
+def test_interrupted_wait_leaves_no_ticket(scheduler, monkeypatch, error):
+    running = scheduler.acquire("holder", 1)
+
+    def interrupted(seconds):
+        raise error()
+
+    monkeypatch.setattr(fair_scheduler.time, "sleep", interrupted)
+    if error is KeyboardInterrupt:
+        with pytest.raises(KeyboardInterrupt):
+            scheduler.acquire("bob", 1)
+    else:
+        assert scheduler.acquire("bob", 1) is None
+    monkeypatch.undo()
+
+    scheduler.release(running)
+    assert ticket_count(scheduler.path) == 0
+
+    # With the queue empty again, a heavier request from someone else goes straight through
+    started = time.perf_counter()
+    scheduler.release(scheduler.acquire("carol", 1000))
+    assert time.perf_counter() - started < 1
@@ -0,0 +1,39 @@
+from flag_detector import FlagLeakDetector, benchmark
+
+FLAGS = {1: "FLAG{welcome}", 2: "FLAG{social}", 3: "FLAG{we}", 4: None}
+
+
+def test_finds_every_flag_in_a_string():
+    detector = FlagLeakDetector(FLAGS)
+    assert sorted(detector.scan("a FLAG{social} and FLAG{welcome} b")) == [1, 2]
+    assert detector.scan("FLAG{soc} FLAG{wel") == []
+
+
+def test_overlapping_flags_share_a_prefix():
+    detector = FlagLeakDetector(FLAGS)
+    # FLAG{we} is a prefix of FLAG{welcome} but only counts once it closes
+    assert detector.scan("FLAG{welcome}") == [1]
+    assert detector.scan("FLAG{we}") == [3]
+
+
+def test_flag_split_across_chunks():
+    matcher = FlagLeakDetector(FLAGS).matcher()
+    found = []
+    for chunk in ["The code is FL", "AG{soc", "ial", "} ok"]:
+        found.extend(matcher.feed(chunk))
+    assert found == [2]
+
+
+def test_each_flag_is_reported_once_per_stream():
+    matcher = FlagLeakDetector(FLAGS).matcher()
+    assert matcher.feed("FLAG{social}") == [2]
+    assert matcher.feed(" again FLAG{social}") == []
+
+
+def test_empty_flags_are_ignored():
+    assert 4 not in FlagLeakDetector(FLAGS).patterns
+
+
+def test_benchmark_catches_the_split_flag():
+    result = benchmark(tokens=2000)
+    assert result["found"] == [5]
@@ -0,0 +1,118 @@
+from backend_router import to_ollama_messages
+from fake_anthropic import FakeAnthropic, Record
+
+
+def search_round(text="Let me check."):
+    return [Record(type="text", text=text),
+            Record(type="tool_use", id="toolu_1", name="search_knowledge", input={"query": "octopus hearts"})]
+
+
+def assert_valid_history(history):
+    """Roles alternate from the user, and every tool_result answers the tool_use just before it"""
+    assert [m["role"] for m in history] == ["user", "assistant"] * (len(history) // 2)
+    for index, message in enumerate(history):
+        content = message["content"]
+        if message["role"] == "user" and isinstance(content, list):
+            asked = {block["id"] for block in history[index - 1]["content"] if block["type"] == "tool_use"}
+            assert {block["tool_use_id"] for block in content} == asked
+
+
+def assert_valid_ollama_messages(messages):
+    """Tool messages answer the assistant's tool_calls; everything else alternates"""
+    previous = None
+    pending_tools = 0
+    for message in messages:
+        if message["role"] == "tool":
+            assert pending_tools > 0
+            pending_tools -= 1
+            # The assistant answers once it has the results
+            previous = "user"
+            continue
+        assert pending_tools == 0
+        assert message["role"] != previous
+        previous = message["role"]
+        pending_tools = len(message.get("tool_calls") or [])
+    assert previous == "user"
+
+
+def test_cancel_before_the_first_token_forgets_the_turn(make_shell, shell_events):
+    client = FakeAnthropic()
+    shell = make_shell(anthropic_client=client)
+    client.next_turn(["Never", " shown"], interrupt_at=0)
+
+    assert shell.query_llm("hi") == ""
+    assert shell.conversation_history == []
+    assert client.stream.closed
+    event, = shell_events("generation_cancelled")
+    assert event["partial_chars"] == 0
+    assert event["max_tokens_remaining"] == shell.MAX_OUTPUT_TOKENS
+    # No finished answer yet, so there is nothing to estimate from
+    assert event["tokens_saved_estimate"] is None
+
+    client.next_turn(["Hello", " again."])
+    assert shell.query_llm("hi") == "Hello again."
+    assert client.requests[-1]["messages"] == [{"role": "user", "content": "hi"}]
+    assert_valid_history(shell.conversation_history)
+
+
+def test_cancel_mid_stream_keeps_the_partial_answer(make_shell, shell_events):
+    client = FakeAnthropic()
+    shell = make_shell(anthropic_client=client)
+    client.next_turn(["word " * 50])
+    shell.query_llm("tell me a story")
+
+    client.next_turn(["Once upon", " a time", " there was"], interrupt_at=2)
+    assert shell.query_llm("another one") == "Once upon a time"
+    assert shell.conversation_history[-1] == {"role": "assistant", "content": "Once upon a time"}
+    assert_valid_history(shell.conversation_history)
+
+    event, = shell_events("generation_cancelled")
+    generated = len("Once upon a time") // 4
+    assert event["tokens_saved_estimate"] == len(("word " * 50).strip()) // 4 - generated
+    assert event["max_tokens_remaining"] == shell.MAX_OUTPUT_TOKENS - generated
+
+    client.next_turn(["Sure."])
+    shell.query_llm("go on")
+    assert [m["role"] for m in client.requests[-1]["messages"]] == ["user", "assistant"] * 2 + ["user"]
+    assert_valid_history(shell.conversation_history)
+    assert_valid_ollama_messages(to_ollama_messages(shell.conversation_history[:-1]))
+
+
+def test_cancel_during_the_tool_loop_drops_the_whole_turn(make_shell):
+    client = FakeAnthropic()
+    shell = make_shell(anthropic_client=client)
+    shell.stage = 3
+    shell._update_system_prompt()
+    shell.query_llm("hi")
+    before = list(shell.conversation_history)
+
+    # Ctrl-C while the second request of the tool loop is in flight
+    client.next_turn(["Never", " shown"], tool_rounds=[search_round()], interrupt_tool_loop=True)
+    assert shell.query_llm("how many hearts does an octopus have?") == ""
+    assert client.stream is None
+    assert shell.conversation_history == before
+
+    client.next_turn(["Three."])
+    shell.query_llm("how many hearts does an octopus have?")
+    assert_valid_history(shell.conversation_history)
+
+
+def test_cancel_after_a_tool_round_keeps_it_valid_for_every_backend(make_shell):
+    client = FakeAnthropic()
+    shell = make_shell(anthropic_client=client)
+    shell.stage = 3
+    shell._update_system_prompt()
+
+    client.next_turn(["Octopuses have", " three hearts", " and blue blood."], interrupt_at=2,
+                     tool_rounds=[search_round()])
+    assert shell.query_llm("how many hearts does an octopus have?") == "Octopuses have three hearts"
+    history = shell.conversation_history
+    assert [m["role"] for m in history] == ["user", "assistant", "user", "assistant"]
+    assert history[2]["content"][0]["type"] == "tool_result"
+    assert_valid_history(history)
+
+    # The next turn can go to Anthropic as is, or to Ollama after conversion
+    client.next_turn(["Yes."])
+    shell.query_llm("really?")
+    assert_valid_history(shell.conversation_history)
+    assert_valid_ollama_messages(to_ollama_messages(shell.conversation_history[:-1]))
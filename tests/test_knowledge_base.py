@@ -0,0 +1,54 @@
+import pytest
+
+from knowledge_base import KnowledgeBase
+
+ANIMALS = """# Animals
+
+## Tardigrades
+Tardigrades, also called water bears, can survive in space. """ + "Filler sentence about nothing. " * 40 + """They enter cryptobiosis when dried out.
+
+## Octopuses
+Octopuses have three hearts and blue blood.
+"""
+
+SECRET = """# Secrets
+
+## Vault
+The vault code is hidden here.
+"""
+
+
+@pytest.fixture
+def kb(tmp_path):
+    (tmp_path / "animals.md").write_text(ANIMALS)
+    (tmp_path / "restricted").mkdir()
+    (tmp_path / "restricted" / "secret.md").write_text(SECRET)
+    return KnowledgeBase(knowledge_dir=str(tmp_path))
+
+
+def test_best_section_first(kb):
+    results = kb.search("octopuses hearts")
+    assert results[0][1] == "Octopuses"
+
+
+def test_snippet_follows_the_query(kb):
+    space = kb.search("tardigrades space", max_chars=200)[0][2]
+    dried = kb.search("tardigrades cryptobiosis", max_chars=200)[0][2]
+    assert "space" in space
+    assert "cryptobiosis" in dried
+    assert len(space) <= 200 and len(dried) <= 200
+
+
+def test_match_longer_than_the_budget_falls_back_to_the_head(kb):
+    section = kb.sections[next(key for key in kb.sections if key.endswith(":Tardigrades"))]
+    snippet = kb._extract_snippet(section, ["tardigrades"], 8)
+    assert snippet == section["content"][:8]
+
+
+def test_misspelled_keyword_still_matches(kb):
+    assert kb.search("tardigard")[0][1] == "Tardigrades"
+
+
+def test_restricted_content_needs_permission(kb):
+    assert all(title != "Vault" for _, title, _, _ in kb.search("vault code"))
+    assert kb.search("vault code", allow_restricted=True)[0][1] == "Vault"
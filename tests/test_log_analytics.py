@@ -0,0 +1,82 @@
+import gzip
+import json
+
+import pytest
+
+import log_analytics
+
+
+def session_events(session_id, user, latencies):
+    events = [{"timestamp": "2025-01-01T10:00:00", "session_id": session_id, "event": "session_start",
+               "user": user, "stage": 1}]
+    for second, latency in enumerate(latencies, start=1):
+        events.append({"timestamp": f"2025-01-01T10:00:{second:02d}", "session_id": session_id,
+                       "event": "chat", "stage": 1, "latency_ms": latency,
+                       "usage": {"input_tokens": 100, "output_tokens": 10}})
+    events.append({"timestamp": "2025-01-01T10:01:00", "session_id": session_id, "event": "flag_accepted",
+                   "stage": 1, "completed_stage": 1})
+    return events
+
+
+def encode(events):
+    return "".join(json.dumps(event) + "\n" for event in events).encode("utf-8")
+
+
+def write_segment(path, events):
+    data = encode(events)
+    if str(path).endswith(".gz"):
+        with gzip.open(path, "wb") as f:
+            f.write(data)
+    elif str(path).endswith(".zst"):
+        zstandard = pytest.importorskip("zstandard")
+        path.write_bytes(zstandard.ZstdCompressor().compress(data))
+    else:
+        path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize("name", ["llm_shell.jsonl", "llm_shell.jsonl.1.gz", "llm_shell.jsonl.2.zst"])
+def test_reads_every_segment_format(tmp_path, name):
+    path = write_segment(tmp_path / name, session_events("s1", "alice", [100, 200, 300]))
+    events = [event for _, event in log_analytics.iter_events(path)]
+    assert len(events) == 5
+    assert events[-1]["event"] == "flag_accepted"
+
+
+def test_analyze_merges_segments(tmp_path):
+    write_segment(tmp_path / "llm_shell.jsonl.1.gz", session_events("s1", "alice", [100, 200]))
+    write_segment(tmp_path / "llm_shell.jsonl", session_events("s2", "bob", [300]))
+    report = log_analytics.analyze([str(tmp_path)], workers=1)
+    assert report["sessions"] == 2
+    assert report["turns"] == 3
+    assert report["stage_funnel"]["2"] == 2
+    assert report["tokens"]["1"]["input_tokens"] == 300
+
+
+def test_session_seek_uses_the_index(tmp_path):
+    path = write_segment(tmp_path / "llm_shell.jsonl",
+                         session_events("s1", "alice", [100]) + session_events("s2", "bob", [200, 250]))
+    partial = log_analytics.summarize_segment(path, session="s2")
+    assert list(partial["sessions"]) == ["s2"]
+    assert partial["sessions"]["s2"]["turns"] == 2
+    assert (tmp_path / ("llm_shell.jsonl" + log_analytics.INDEX_SUFFIX)).exists()
+
+
+def test_histogram_percentiles():
+    hist = log_analytics.Histogram()
+    for value in range(1, 101):
+        hist.add(value)
+    assert hist.count() == 100
+    assert 45 <= hist.percentile(50) <= 55
+    assert hist.percentile(99) >= 90
+
+
+def test_flag_accepted_without_a_stage_is_skipped(tmp_path):
+    events = session_events("s1", "alice", [100])
+    events.append({"timestamp": "2025-01-01T10:02:00", "session_id": "s1", "event": "flag_accepted", "stage": 2})
+    events.append({"timestamp": "2025-01-01T10:03:00", "session_id": "s1", "event": "flag_accepted", "stage": 2,
+                   "completed_stage": "two"})
+    path = write_segment(tmp_path / "llm_shell.jsonl", events)
+    partial = log_analytics.summarize_segment(path)
+    assert partial["sessions"]["s1"]["solved"] == {"1": log_analytics.parse_time("2025-01-01T10:01:00")}
+    assert partial["sessions"]["s1"]["max_stage"] == 2
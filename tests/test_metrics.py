@@ -0,0 +1,33 @@
+import pytest
+
+from metrics import SessionMetrics, percentile
+
+
+@pytest.mark.parametrize("values, pct, expected", [
+    ([1, 2], 50, 1),
+    ([1, 2, 3, 4, 5, 6], 50, 3),
+    ([1, 2, 3, 4, 5], 50, 3),
+    (list(range(1, 101)), 95, 95),
+    (list(range(1, 101)), 100, 100),
+    ([7], 99, 7),
+    ([1, 2, 3], 0, 1),
+])
+def test_nearest_rank_percentile(values, pct, expected):
+    assert percentile(values, pct) == expected
+
+
+def test_percentile_of_nothing():
+    assert percentile([], 50) == 0
+
+
+def test_snapshot_summarizes_timings():
+    metrics = SessionMetrics()
+    metrics.incr("turns")
+    metrics.incr("turns", 2)
+    for value in (0.1, 0.2, 0.3, 0.4):
+        metrics.observe("latency", value)
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"] == {"turns": 3}
+    assert snapshot["timings"]["latency"]["count"] == 4
+    assert snapshot["timings"]["latency"]["p50"] == 0.2
+    assert snapshot["timings"]["latency"]["max"] == 0.4
@@ -0,0 +1,93 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from mock_llm_server import MockConfig, answer_words, start_server
+
+
+@pytest.fixture
+def server_url():
+    server, url = start_server(MockConfig(latency=0, tokens_per_second=0, tool_use_rate=1.0, response_tokens=5))
+    yield url
+    server.shutdown()
+
+
+def post(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return [json.loads(line) for line in response.read().splitlines() if line.strip()]
+
+
+TOOLS = [{"type": "function", "function": {"name": "search_knowledge", "parameters": {}}}]
+
+
+def test_ollama_chat_streams_tool_calls_then_timing(server_url):
+    chunks = post(f"{server_url}/api/chat", {"model": "llama3.2", "tools": TOOLS, "messages": [
+        {"role": "system", "content": "You are helpful."}, {"role": "user", "content": "tardigrades?"}]})
+    calls = [call for chunk in chunks for call in chunk["message"].get("tool_calls", [])]
+    assert calls[0]["function"]["name"] == "search_knowledge"
+    assert chunks[-1]["done"] and chunks[-1]["prompt_eval_count"] > 0
+    assert "prompt_eval_duration" in chunks[-1]
+
+
+def test_ollama_chat_answers_after_a_tool_message(server_url):
+    chunks = post(f"{server_url}/api/chat", {"model": "llama3.2", "tools": TOOLS, "messages": [
+        {"role": "user", "content": "tardigrades?"},
+        {"role": "tool", "content": "Water bears.", "tool_name": "search_knowledge"}]})
+    assert not any(chunk["message"].get("tool_calls") for chunk in chunks)
+    assert len("".join(chunk["message"]["content"] for chunk in chunks).split()) == 5
+
+
+def test_anthropic_messages_tool_use_then_answer(server_url):
+    tools = [{"name": "search_knowledge", "input_schema": {"type": "object"}}]
+    first = post(f"{server_url}/v1/messages", {"model": "mock", "max_tokens": 10, "tools": tools,
+                                               "messages": [{"role": "user", "content": "hi"}]})[0]
+    assert first["stop_reason"] == "tool_use"
+    tool_use = first["content"][-1]
+
+    second = post(f"{server_url}/v1/messages", {"model": "mock", "max_tokens": 10, "tools": tools, "messages": [
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": first["content"]},
+        {"role": "user", "content": [{"type": "tool_result", "tool_use_id": tool_use["id"], "content": "x"}]}]})[0]
+    assert second["stop_reason"] == "end_turn"
+    assert second["usage"]["input_tokens"] > 0
+
+
+def test_injected_errors():
+    server, url = start_server(MockConfig(latency=0, error_500=1.0))
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            post(f"{url}/v1/messages", {"model": "mock", "messages": []})
+        assert error.value.code == 500
+    finally:
+        server.shutdown()
+
+
+def test_shell_round_trips_a_tool_call_over_ollama(server_url, make_shell, shell_events, capsys):
+    shell = make_shell(ollama_host=server_url)
+    assert shell.backend_router.ordered_backends() == ["ollama"]
+    shell.stage = 3
+    shell._update_system_prompt()
+
+    response = shell.query_llm("Tell me about tardigrades")
+
+    # The answer was assembled from the streamed ndjson chunks of the second round
+    assert response == " ".join(answer_words(MockConfig(response_tokens=5)))
+    out = capsys.readouterr().out
+    assert out.index("Let me search for that.") < out.index(response)
+    user, tool_use, tool_result, answer = shell.conversation_history
+    call, = [block for block in tool_use["content"] if block["type"] == "tool_use"]
+    assert call["name"] == "search_knowledge" and call["input"] == {"query": "tardigrades"}
+    result, = tool_result["content"]
+    assert result["tool_use_id"] == call["id"]
+    assert "[From" in result["content"]
+    assert answer == {"role": "assistant", "content": response}
+    assert len(shell.turn_tool_rounds) == 1
+
+    # One timing object per round, read from the final ndjson line
+    timings = shell_events("ollama_timing")
+    assert [event["tool_round"] for event in timings] == [0, 1]
+    assert all(event["prompt_eval_count"] > 0 for event in timings)
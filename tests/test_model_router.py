@@ -0,0 +1,43 @@
+import pytest
+
+from model_router import ModelRouter, estimate_cost
+
+FAST = "claude-3-5-haiku-20241022"
+STRONG = "claude-sonnet-4-5"
+
+
+def test_stage_picks_the_model():
+    router = ModelRouter(FAST, STRONG)
+    assert router.choose(1, 100, False) == (FAST, "stage")
+    assert router.choose(5, 100, False) == (STRONG, "stage")
+
+
+def test_failing_model_is_avoided():
+    router = ModelRouter(FAST, STRONG)
+    for _ in range(router.MIN_SAMPLES):
+        router.record(FAST, error=True)
+    assert router.choose(1, 100, False) == (STRONG, "error_rate")
+
+
+def test_slow_model_is_avoided_for_long_tool_turns():
+    router = ModelRouter(FAST, STRONG)
+    for _ in range(router.MIN_SAMPLES):
+        router.record(STRONG, latency=8.0)
+        router.record(FAST, latency=2.0)
+    assert router.choose(5, 100, False) == (STRONG, "stage")
+    assert router.choose(5, 100, True) == (FAST, "latency")
+
+
+def test_latency_is_kept_per_round():
+    router = ModelRouter(FAST, STRONG)
+    for _ in range(router.MIN_SAMPLES):
+        router.record(FAST, latency=6.0, tool_rounds=2)
+    assert router.predict_latency(FAST, 100, False) == pytest.approx(2.0)
+    assert router.status()[FAST]["turns"] == router.MIN_SAMPLES
+
+
+def test_estimate_cost():
+    usage = {"input_tokens": 1_000_000, "output_tokens": 1_000_000,
+             "cache_creation_input_tokens": 1_000_000, "cache_read_input_tokens": 1_000_000}
+    assert estimate_cost(FAST, usage) == pytest.approx(1.0 + 5.0 + 1.25 + 0.1)
+    assert estimate_cost(STRONG, {"input_tokens": 1_000_000}) == pytest.approx(3.0)
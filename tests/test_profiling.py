@@ -0,0 +1,44 @@
+import os
+import tracemalloc
+
+from profiling import Profiler
+
+
+def work(n):
+    return sum(i * i for i in range(n))
+
+
+def test_profile_covers_wrapped_calls(tmp_path):
+    events = []
+    profiler = Profiler(str(tmp_path), "session_1", on_event=lambda event, **fields: events.append((event, fields)))
+    wrapped = profiler.wrap(work)
+
+    assert wrapped(10) == work(10)  # Not profiling yet
+    profiler.start()
+    wrapped(1000)
+    path = profiler.stop()
+
+    assert path and os.path.exists(path)
+    assert os.path.exists(path[:-len(".pstats")] + ".txt")
+    stopped = dict(events)["profiling_stopped"]
+    assert stopped["calls"] == 1
+
+
+def test_stop_without_calls_writes_nothing(tmp_path):
+    profiler = Profiler(str(tmp_path), "session_1")
+    profiler.start()
+    assert profiler.stop() is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_memory_snapshots(tmp_path):
+    profiler = Profiler(str(tmp_path), "session_1", memory_sizes=lambda: {"history_messages": 3})
+    try:
+        assert profiler.snapshot() is None  # First call starts tracing
+        path = profiler.snapshot()
+        with open(path) as f:
+            report = f.read()
+        assert "history_messages: 3" in report
+        assert "Growth since the previous snapshot" in report
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,33 @@
+from progress_store import ProgressStore, pack_history, unpack_history
+
+HISTORY = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+
+
+def test_progress_survives_a_new_session(tmp_path):
+    path = str(tmp_path / "progress.db")
+    store = ProgressStore(path)
+    store.save_stage("alice", 2)
+    store.save_history("alice", 2, HISTORY[:1])
+    store.save_history("alice", 2, HISTORY)
+    store.close()
+
+    assert ProgressStore(path).load("alice") == (2, HISTORY)
+
+
+def test_history_from_another_stage_is_not_restored(tmp_path):
+    path = str(tmp_path / "progress.db")
+    store = ProgressStore(path)
+    store.save_stage("bob", 1)
+    store.save_history("bob", 1, HISTORY)
+    store.save_stage("bob", 2)
+    store.close()
+
+    assert ProgressStore(path).load("bob") == (2, [])
+
+
+def test_unknown_player(tmp_path):
+    assert ProgressStore(str(tmp_path / "progress.db")).load("nobody") == (None, [])
+
+
+def test_history_round_trip():
+    assert unpack_history(pack_history(HISTORY)) == HISTORY
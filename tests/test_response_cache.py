@@ -0,0 +1,58 @@
+import pytest
+
+from response_cache import ResponseCache, normalize_input, text_chunks
+
+
+def turn(text):
+    return [{"role": "assistant", "content": text}]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    yield cache
+    cache.shutdown()
+
+
+def settle(cache):
+    cache._executor.submit(lambda: None).result()
+
+
+def test_name_is_personalized_for_each_player(cache):
+    key = ResponseCache.key("hello", "system", "model", [])
+    cache.put(key, turn("Hello Chase, welcome!"), "Chase")
+    settle(cache)
+    assert cache.get(key, "Robin") == turn("Hello Robin, welcome!")
+
+
+def test_ordinary_word_matching_the_name_is_not_rewritten(cache):
+    key = ResponseCache.key("hello", "system", "model", [])
+    cache.put(key, turn("Hello Summer! Tardigrades survive a hot summer."), "Summer")
+    settle(cache)
+    # The lowercase word makes the name ambiguous, so nothing is cached
+    assert cache.get(key, "Robin") is None
+
+
+def test_other_case_forms_are_left_alone(cache):
+    key = ResponseCache.key("hello", "system", "model", [])
+    cache.put(key, turn("Hello Chase, the CHASE begins."), "Chase")
+    settle(cache)
+    assert cache.get(key, "Robin") == turn("Hello Robin, the CHASE begins.")
+
+
+def test_short_names_are_not_cached(cache):
+    key = ResponseCache.key("hi", "system", "model", [])
+    cache.put(key, turn("Hi Al"), "Al")
+    settle(cache)
+    assert cache.get(key, "Robin") is None
+
+
+def test_key_normalizes_input():
+    assert normalize_input("  Hello   THERE!! ") == "hello there"
+    assert ResponseCache.key("Hello there!", "s", "m", []) == ResponseCache.key("hello there", "s", "m", [])
+    assert ResponseCache.key("hello", "s", "m", []) != ResponseCache.key("hello", "s", "other", [])
+
+
+def test_text_chunks_round_trip():
+    text = "Hello there,  world.\nBye"
+    assert "".join(text_chunks(text)) == text
@@ -0,0 +1,71 @@
+from retrieval_ledger import RetrievalLedger, section_id
+
+
+def tool_result_message(tool_use_id, text="..."):
+    return {"role": "user", "content": [{"type": "tool_result", "tool_use_id": tool_use_id, "content": text}]}
+
+
+def test_repeated_snippet_becomes_a_back_reference():
+    ledger = RetrievalLedger()
+    result = (5, "Tardigrades", "Tardigrades survive in space.", "animals.md")
+    ledger.record("toolu_1", [result])
+    ledger.sync([tool_result_message("toolu_1")])
+    assert ledger.split([result]) == ([], ["Tardigrades"])
+
+
+def test_other_window_of_the_same_section_is_sent():
+    ledger = RetrievalLedger()
+    first = (5, "Tardigrades", "Tardigrades survive in space.", "animals.md")
+    second = (4, "Tardigrades", "They enter cryptobiosis when dried out.", "animals.md")
+    assert section_id(first) != section_id(second)
+    ledger.record("toolu_1", [first])
+    ledger.sync([tool_result_message("toolu_1")])
+    assert ledger.split([second]) == ([second], [])
+
+
+def test_sync_forgets_results_outside_the_window():
+    ledger = RetrievalLedger()
+    result = (5, "Tardigrades", "Tardigrades survive in space.", "animals.md")
+    ledger.record("toolu_1", [result])
+    ledger.sync([])
+    assert ledger.split([result]) == ([result], [])
+
+
+def test_make_room_elides_oldest_results():
+    ledger = RetrievalLedger()
+    ledger.MAX_LIVE_CHARS = 100
+    old = (5, "Old", "x" * 80, "a.md")
+    ledger.record("toolu_1", [old])
+    history = [tool_result_message("toolu_1", "[From Old]\n" + "x" * 80)]
+    ledger.make_room(history, 50)
+    assert history[0]["content"][0]["content"].startswith("[Earlier search results removed")
+    assert ledger.live_chars() == 0
+
+
+def test_make_room_leaves_the_cached_prefix_alone():
+    ledger = RetrievalLedger()
+    ledger.MAX_LIVE_CHARS = 100
+    old = (5, "Old", "x" * 60, "a.md")
+    recent = (5, "Recent", "y" * 60, "b.md")
+    ledger.record("toolu_1", [old])
+    ledger.record("toolu_2", [recent])
+    history = [
+        {"role": "user", "content": "first"},
+        {"role": "assistant", "content": [{"type": "tool_use", "id": "toolu_1"}]},
+        tool_result_message("toolu_1", "[From Old]\n" + "x" * 60),
+        {"role": "assistant", "content": [{"type": "tool_use", "id": "toolu_2"}]},
+        tool_result_message("toolu_2", "[From Recent]\n" + "y" * 60),
+    ]
+    # The last request's breakpoint was on the tool_use at index 3
+    ledger.make_room(history, 50, cached_until=3)
+    assert history[2]["content"][0]["content"].startswith("[From Old]")
+    assert history[4]["content"][0]["content"].startswith("[Earlier search results removed")
+    assert ledger.live_chars() == 60
+
+
+def test_reset_forgets_every_delivery():
+    ledger = RetrievalLedger()
+    result = (5, "Tardigrades", "Tardigrades survive in space.", "animals.md")
+    ledger.record("toolu_1", [result])
+    ledger.reset()
+    assert ledger.split([result]) == ([result], [])
@@ -0,0 +1,43 @@
+from metrics import SessionMetrics
+from retrieval_prefetch import RetrievalPrefetcher, normalize_query
+
+
+class RecordingKnowledgeBase:
+    def __init__(self):
+        self.queries = []
+
+    def search(self, query, max_results=3, max_chars=1500, allow_restricted=False):
+        self.queries.append(query)
+        return [(1, query.title(), f"About {query}", "kb.md")]
+
+
+def test_candidates_skip_stopwords_and_pair_words():
+    prefetcher = RetrievalPrefetcher(RecordingKnowledgeBase())
+    candidates = prefetcher.candidate_queries("Tell me about Mantis Shrimp please")
+    assert candidates[0] == "tell me about mantis shrimp please"
+    assert "mantis" in candidates and "shrimp" in candidates and "mantis shrimp" in candidates
+    assert "tell" not in candidates and "please" not in candidates
+    prefetcher.shutdown()
+
+
+def test_lookup_serves_prefetched_results():
+    metrics = SessionMetrics()
+    kb = RecordingKnowledgeBase()
+    prefetcher = RetrievalPrefetcher(kb, metrics=metrics)
+    prefetcher.start("What about black holes?")
+    assert prefetcher.lookup("Black  Holes") == [(1, "Black Holes", "About black holes", "kb.md")]
+    assert prefetcher.lookup("neutron stars") is None
+    assert metrics.get("retrieval_prefetch_hit") == 1
+    assert metrics.get("retrieval_prefetch_miss") == 1
+    prefetcher.shutdown()
+
+
+def test_restricted_results_are_not_shared_across_permissions():
+    prefetcher = RetrievalPrefetcher(RecordingKnowledgeBase())
+    prefetcher.start("vault code", allow_restricted=False)
+    assert prefetcher.lookup("vault", allow_restricted=True) is None
+    prefetcher.shutdown()
+
+
+def test_normalize_query():
+    assert normalize_query("  Black\tHOLES ") == "black holes"
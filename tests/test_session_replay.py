@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+import session_replay
+from session_replay import PromptCacheModel, load_sessions
+
+SYSTEM = [{"type": "text", "text": "x" * 20000, "cache_control": {"type": "ephemeral"}}]
+
+
+def params(messages):
+    return {"model": "claude-sonnet-4-5", "system": SYSTEM, "messages": messages}
+
+
+def test_second_request_reads_the_cached_prefix():
+    model = PromptCacheModel()
+    first = model.usage(params([{"role": "user", "content": "hi"}]), 40, now=0)
+    assert first.cache_creation_input_tokens > 0 and first.cache_read_input_tokens == 0
+
+    second = model.usage(params([{"role": "user", "content": "hello"}]), 40, now=60)
+    assert second.cache_read_input_tokens == first.cache_creation_input_tokens
+    assert second.cache_creation_input_tokens == 0
+
+
+def test_cache_expires_after_the_ttl():
+    model = PromptCacheModel()
+    model.usage(params([{"role": "user", "content": "hi"}]), 40, now=0)
+    later = model.usage(params([{"role": "user", "content": "hi"}]), 40, now=3600)
+    assert later.cache_read_input_tokens == 0
+
+
+def test_short_prefix_is_never_cached():
+    model = PromptCacheModel()
+    short = {"model": "claude-sonnet-4-5", "messages": [{"role": "user", "content": "hi"}],
+             "system": [{"type": "text", "text": "short", "cache_control": {"type": "ephemeral"}}]}
+    assert model.usage(short, 40, now=0).cache_creation_input_tokens == 0
+
+
+def test_load_sessions_groups_chat_records(tmp_path):
+    events = [
+        {"timestamp": "2025-01-01T10:00:00", "session_id": "s1", "event": "session_start", "user": "alice"},
+        {"timestamp": "2025-01-01T10:00:01", "session_id": "s1", "event": "chat", "user_input": "hi"},
+        {"timestamp": "2025-01-01T10:00:02", "session_id": "s2", "event": "session_start", "user": "bob"},
+        {"timestamp": "2025-01-01T10:00:03", "session_id": "s1", "event": "chat", "user_input": "more"},
+    ]
+    (tmp_path / "llm_shell.jsonl").write_text("".join(json.dumps(e) + "\n" for e in events))
+    sessions = load_sessions([str(tmp_path)])
+    assert [(s["session_id"], s["user"], len(s["turns"])) for s in sessions] == [("s1", "alice", 2)]
+
+
+def test_replay_keeps_live_state_and_quotas_out(tmp_path, monkeypatch):
+    for name in ("anthropic", "openai", "requests", "dotenv"):
+        pytest.importorskip(name)
+    import llm_shell
+
+    # replay_session rewrites these; monkeypatch restores them afterwards
+    monkeypatch.setattr(llm_shell, "LOG_DIR", llm_shell.LOG_DIR)
+    monkeypatch.setattr(llm_shell, "LOG_FILE", llm_shell.LOG_FILE)
+    live = tmp_path / "live"
+    live.mkdir()
+    monkeypatch.setenv("LOG_DIR", str(live))
+    for name in session_replay.REPLAY_UNSET_ENV:
+        monkeypatch.setenv(name, "1")
+    for name, filename in session_replay.REPLAY_STATE_FILES.items():
+        monkeypatch.setenv(name, str(live / filename))
+
+    session = {"session_id": "s1", "user": "alice", "turns": [
+        {"user_input": "hi", "ai_response": "Hello there.", "stage": 1},
+        {"user_input": "who are you?", "ai_response": "Just the shell.", "stage": 1},
+    ]}
+    results = session_replay.replay_session(session)
+
+    # A one-token session quota would refuse the second turn if it leaked in
+    assert [turn["diverged"] for turn in results] == [False, False]
+    assert [turn["api_calls"] for turn in results] == [2, 2]
+    assert list(live.iterdir()) == []
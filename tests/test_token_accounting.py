@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+import token_accounting
+from model_router import estimate_cost
+from token_accounting import TokenAccountant
+
+USAGE = {"input_tokens": 3000, "output_tokens": 400, "cache_creation_input_tokens": 0,
+         "cache_read_input_tokens": 600}
+MODEL = "claude-3-5-haiku-20241022"
+
+
+@pytest.fixture
+def accountant(tmp_path, monkeypatch):
+    for name in ("LLM_SESSION_TOKEN_LIMIT", "LLM_USER_DAILY_TOKEN_LIMIT", "LLM_USER_DAILY_COST_LIMIT"):
+        monkeypatch.delenv(name, raising=False)
+    accountant = TokenAccountant(str(tmp_path / "usage.db"), "alice")
+    yield accountant
+    accountant.shutdown()
+
+
+def test_summary_includes_the_last_turn(accountant, monkeypatch):
+    original = accountant._write
+
+    def slow_write(usage, cost, turns):
+        time.sleep(0.2)
+        original(usage, cost, turns)
+
+    monkeypatch.setattr(accountant, "_write", slow_write)
+    for _ in range(3):
+        accountant.record(MODEL, USAGE)
+
+    summary = accountant.summary()
+    assert summary["user_today"]["turns"] == 3
+    assert summary["user_today"]["tokens"] == 3 * token_accounting.total_tokens(USAGE)
+    assert summary["session"]["input_tokens"] == 9000
+
+
+def test_background_usage_counts_tokens_but_not_turns(accountant):
+    accountant.record(MODEL, USAGE)
+    accountant.record(MODEL, USAGE, turn=False)
+    today = accountant.user_today()
+    assert today["turns"] == 1
+    assert today["tokens"] == 2 * token_accounting.total_tokens(USAGE)
+
+
+def test_record_prices_usage(accountant):
+    cost = accountant.record(MODEL, USAGE)
+    assert cost == pytest.approx(estimate_cost(MODEL, USAGE))
+    assert accountant.user_today()["cost_usd"] == pytest.approx(cost)
+
+
+def test_daily_quota_soft_then_hard(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_USER_DAILY_TOKEN_LIMIT", "10000")
+    accountant = TokenAccountant(str(tmp_path / "usage.db"), "bob")
+    try:
+        assert accountant.check() == (None, 1.0)
+        accountant.record(MODEL, {"input_tokens": 8500})
+        assert accountant.check() == (None, accountant.SOFT_LIMIT_WEIGHT)
+        accountant.record(MODEL, {"input_tokens": 2000})
+        assert accountant.check() == ("daily", 0.0)
+    finally:
+        accountant.shutdown()
+
+
+def test_session_quota(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_SESSION_TOKEN_LIMIT", "1000")
+    accountant = TokenAccountant(str(tmp_path / "usage.db"), "carol")
+    try:
+        accountant.record(MODEL, {"input_tokens": 1200})
+        assert accountant.check()[0] == "session"
+    finally:
+        accountant.shutdown()
@@ -0,0 +1,27 @@
+import time
+
+from fake_anthropic import FakeAnthropic, Record
+
+
+def test_routers_get_api_time_not_render_time(make_shell, monkeypatch):
+    import llm_shell
+    monkeypatch.setattr(llm_shell.LLMShell, "ADAPTIVE_MODEL_ROUTING", True)
+    client = FakeAnthropic(latency=0.05)
+    shell = make_shell(anthropic_client=client)
+    shell.stage = 3
+    shell._update_system_prompt()
+    # 40 characters of fake-streamed pre-tool text take 0.4s to print
+    shell.PRE_TOOL_TEXT_DELAY = 0.01
+    client.next_turn(["Octopuses have three hearts."], tool_rounds=[[
+        Record(type="text", text="Let me look that up in the archives now."),
+        Record(type="tool_use", id="toolu_1", name="search_knowledge", input={"query": "octopus hearts"})]])
+
+    started = time.perf_counter()
+    shell.query_llm("How many hearts does an octopus have?")
+    assert time.perf_counter() - started >= 0.4
+
+    # Two requests and the stream's first chunk, 0.05s each
+    assert 0.15 <= shell.turn_api_seconds < 0.35
+    assert shell.backend_router.backends["anthropic"].latency_ewma == shell.turn_api_seconds
+    model_status = shell.model_router.status()[shell.turn_model]
+    assert model_status["p95_round_seconds"] < 0.35 / 2
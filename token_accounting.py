@@ -0,0 +1,189 @@
+"""
+Per-session and per-user token and cost accounting with quotas
+Usage from every API response is priced per model (input, output, cache
+writes, cache reads) and summed for the session in memory and for the
+player per UTC day in SQLite, shared by all their sessions. Quotas come
+from the environment (0 or unset means unlimited):
+
+    LLM_SESSION_TOKEN_LIMIT       tokens per session
+    LLM_USER_DAILY_TOKEN_LIMIT    tokens per player per day
+    LLM_USER_DAILY_COST_LIMIT     USD per player per day
+
+A player past SOFT_LIMIT_FRACTION of a daily quota gets a lower weight in
+the fair scheduler before being refused outright at the quota.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from model_router import estimate_cost
+from progress_store import _connect
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_usage (
+    user_name TEXT NOT NULL,
+    day TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_creation_input_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_read_input_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    turns INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_name, day)
+);
+"""
+
+
+def _env_number(name):
+    try:
+        return float(os.getenv(name) or 0)
+    except ValueError:
+        return 0.0
+
+
+def _today():
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def total_tokens(usage):
+    return sum(usage.get(field, 0) for field in USAGE_FIELDS)
+
+
+def usage_from_response(usage):
+    """Token counts of an API response's usage object, as a plain dict"""
+    return {field: getattr(usage, field, 0) or 0 for field in USAGE_FIELDS}
+
+
+class TokenAccountant:
+    # Fraction of a daily quota after which the player's scheduling weight drops
+    SOFT_LIMIT_FRACTION = 0.8
+    # Scheduling weight of a player past the soft limit (normal is 1.0)
+    SOFT_LIMIT_WEIGHT = 0.25
+
+    def __init__(self, path, user_name, metrics=None):
+        self.path = path
+        self.user_name = user_name
+        self.metrics = metrics
+        self.session_limit = _env_number("LLM_SESSION_TOKEN_LIMIT")
+        self.daily_token_limit = _env_number("LLM_USER_DAILY_TOKEN_LIMIT")
+        self.daily_cost_limit = _env_number("LLM_USER_DAILY_COST_LIMIT")
+        self.session_usage = dict.fromkeys(USAGE_FIELDS, 0)
+        self.session_cost = 0.0
+        # Background calls (summaries, cache warm-ups) record from their own threads
+        self._lock = threading.Lock()
+
+        conn = _connect(path)
+        try:
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-accounting")
+
+    def record(self, model, usage, turn=True):
+        """
+        Add one turn's usage (or, with turn=False, a background call's);
+        returns its estimated cost in USD
+        """
+        cost = estimate_cost(model, usage)
+        with self._lock:
+            for field in USAGE_FIELDS:
+                self.session_usage[field] += usage.get(field, 0)
+            self.session_cost += cost
+        if self.metrics:
+            for field in USAGE_FIELDS:
+                self.metrics.incr(f"usage_{field}", usage.get(field, 0))
+            self.metrics.incr("usage_cost_usd", cost)
+        self._executor.submit(self._write, dict(usage), cost, 1 if turn else 0)
+        return cost
+
+    def _write(self, usage, cost, turns):
+        try:
+            conn = _connect(self.path)
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT INTO token_usage (user_name, day, input_tokens, output_tokens, "
+                        "cache_creation_input_tokens, cache_read_input_tokens, cost_usd, turns, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(user_name, day) DO UPDATE SET "
+                        "input_tokens = input_tokens + excluded.input_tokens, "
+                        "output_tokens = output_tokens + excluded.output_tokens, "
+                        "cache_creation_input_tokens = cache_creation_input_tokens + excluded.cache_creation_input_tokens, "
+                        "cache_read_input_tokens = cache_read_input_tokens + excluded.cache_read_input_tokens, "
+                        "cost_usd = cost_usd + excluded.cost_usd, turns = turns + excluded.turns, "
+                        "updated_at = excluded.updated_at",
+                        (self.user_name, _today(), *(usage.get(field, 0) for field in USAGE_FIELDS), cost, turns,
+                         time.time()))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            if self.metrics:
+                self.metrics.incr("usage_write_errors")
+
+    def flush(self):
+        """Wait for this session's queued writes to land"""
+        try:
+            # The single worker runs writes in order, so a no-op behind them marks the end
+            self._executor.submit(lambda: None).result()
+        except RuntimeError:
+            # Already shut down, which waited for the writes
+            pass
+
+    def user_today(self):
+        """The player's usage today across all their sessions, this session's last turn included"""
+        self.flush()
+        try:
+            conn = _connect(self.path)
+            try:
+                row = conn.execute(
+                    "SELECT input_tokens, output_tokens, cache_creation_input_tokens, cache_read_input_tokens, "
+                    "cost_usd, turns FROM token_usage WHERE user_name = ? AND day = ?",
+                    (self.user_name, _today())).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            return {"tokens": 0, "cost_usd": 0.0, "turns": 0}
+        return {"tokens": sum(row[:4]), "cost_usd": row[4], "turns": row[5]}
+
+    def _daily_fraction(self, today):
+        """Largest fraction of a daily quota used so far"""
+        fractions = [0.0]
+        if self.daily_token_limit:
+            fractions.append(today["tokens"] / self.daily_token_limit)
+        if self.daily_cost_limit:
+            fractions.append(today["cost_usd"] / self.daily_cost_limit)
+        return max(fractions)
+
+    def check(self):
+        """
+        Return (limit_reason, scheduling_weight)
+        limit_reason is None while the player is within every quota
+        """
+        if self.session_limit and total_tokens(self.session_usage) >= self.session_limit:
+            return "session", 0.0
+        if not (self.daily_token_limit or self.daily_cost_limit):
+            return None, 1.0
+        fraction = self._daily_fraction(self.user_today())
+        if fraction >= 1.0:
+            return "daily", 0.0
+        if fraction >= self.SOFT_LIMIT_FRACTION:
+            return None, self.SOFT_LIMIT_WEIGHT
+        return None, 1.0
+
+    def summary(self):
+        return {
+            "session": dict(self.session_usage, cost_usd=round(self.session_cost, 6)),
+            "user_today": self.user_today()
+        }
+
+    def shutdown(self):
+        # Let the last turn's usage land
+        self._executor.shutdown(wait=True)